@@ -1,10 +1,24 @@
-from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, session, g
+from flask import Flask, render_template, request, flash, redirect, url_for, jsonify, session, g, send_file
 from flask_debugtoolbar import DebugToolbarExtension
-from flask_bcrypt import Bcrypt
-from models import db, connect_db, User, Deck, Card, DeckCard
+from models import db, connect_db, User, Deck, Card, DeckCard, install_deck_card_triggers
 from forms import RegisterForm, LoginForm, UserEditForm, DeckForm, CardSearchForm, RenameDeckForm
 from sqlalchemy.exc import IntegrityError
-from helpers import fetch_ygo_cards, calculate_card_limit, add_card_to_db, fetch_card_by_id, is_extra_deck
+from http_client import upstream
+from metrics import metrics
+from images import image_store, open_card_image, upstream_image_url, IMAGE_SIZES
+from fragments import FragmentCacheExtension, fragment_cache
+from passwords import password_hasher, PasswordHasherBusy
+from search_index import build_search_index
+from helpers import find_cards, SEARCH_PAGE_SIZE, calculate_card_limit, add_card_to_db, get_card, check_deck_op, apply_deck_ops, MAX_DECK_OPS, MAX_DECK_LIST_CARDS, deck_card_dicts, deck_cards_refreshed_at, card_cache, card_cache_stats, search_cache, is_extra_deck, load_card_dump, sync_card_catalog
+from helpers import get_popular_decks, refresh_popular_decks, invalidate_popular_decks, popular_decks_cache
+from helpers import get_user, invalidate_user, user_cache, user_cache_stats, user_lookup_counts
+from helpers import prewarm_card_images, localize_deck_covers, import_deck, clear_deck_cards, remove_deck, duplicate_deck, add_deck_card_copy, remove_deck_card_copy, deck_card_ids, fetch_banlist, refresh_banlist
+from helpers import cached_deck_stats, deck_stats_cache, main_deck_composition, deck_suggestions, rebuild_card_pairs, MAX_SUGGESTIONS, SUGGESTIONS_SIZE
+from odds import deck_odds, simulate_hands, OddsUnavailable, DEFAULT_TRIALS, MAX_TRIALS
+from deck_codes import parse_deck_code, format_ydk, format_ydke
+import click
+import hmac
+from werkzeug.utils import secure_filename
 
 
 # Environment libraries
@@ -27,6 +41,55 @@ app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+# 'auto' answers card searches locally once the catalog has been synced with `flask sync-cards`
+app.config['CARD_SEARCH_BACKEND'] = os.getenv('CARD_SEARCH_BACKEND', 'auto')
+# Size of the in-process card cache, and how long (seconds) a card's ban status is trusted
+app.config['CARD_CACHE_SIZE'] = int(os.getenv('CARD_CACHE_SIZE', 2048))
+app.config['CARD_CACHE_TTL'] = int(os.getenv('CARD_CACHE_TTL', 24 * 60 * 60))
+# Number of deck versions whose statistics are kept in memory
+app.config['DECK_STATS_CACHE_SIZE'] = int(os.getenv('DECK_STATS_CACHE_SIZE', 1024))
+# Number of rendered template fragments kept in memory (0 renders every fragment every time)
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.getenv('FRAGMENT_CACHE_SIZE', 1024))
+# How long (seconds) the logged in user's record is reused before it is read again
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))
+# API search result cache: size, freshness, "no cards match" TTL and stale-while-revalidate window (seconds)
+app.config['SEARCH_CACHE_SIZE'] = int(os.getenv('SEARCH_CACHE_SIZE', 512))
+app.config['SEARCH_CACHE_TTL'] = int(os.getenv('SEARCH_CACHE_TTL', 5 * 60))
+app.config['SEARCH_CACHE_NEGATIVE_TTL'] = int(os.getenv('SEARCH_CACHE_NEGATIVE_TTL', 30))
+app.config['SEARCH_CACHE_STALE_TTL'] = int(os.getenv('SEARCH_CACHE_STALE_TTL', 10 * 60))
+# How many pages past the one requested are fetched into the search cache in the background,
+# and at most how many of those fetches may run at once
+app.config['SEARCH_PREFETCH_PAGES'] = int(os.getenv('SEARCH_PREFETCH_PAGES', 1))
+app.config['SEARCH_PREFETCH_WORKERS'] = int(os.getenv('SEARCH_PREFETCH_WORKERS', 2))
+# Upstream HTTP client: pooled connections per host, timeouts (seconds) and retries
+app.config['UPSTREAM_POOL_SIZE'] = int(os.getenv('UPSTREAM_POOL_SIZE', 10))
+app.config['UPSTREAM_CONNECT_TIMEOUT'] = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+app.config['UPSTREAM_READ_TIMEOUT'] = float(os.getenv('UPSTREAM_READ_TIMEOUT', 10))
+app.config['UPSTREAM_RETRIES'] = int(os.getenv('UPSTREAM_RETRIES', 2))
+app.config['UPSTREAM_BACKOFF'] = float(os.getenv('UPSTREAM_BACKOFF', 0.3))
+# bcrypt cost factor for new password hashes (older hashes are upgraded at login),
+# hashing threads, and how many more logins may wait before answering 503. Under gunicorn
+# sync workers set BCRYPT_LOCK_DIR to a directory the workers share, so BCRYPT_WORKERS is machine-wide
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.getenv('BCRYPT_WORKERS', 2))
+app.config['BCRYPT_MAX_PENDING'] = int(os.getenv('BCRYPT_MAX_PENDING', 8))
+app.config['BCRYPT_LOCK_DIR'] = os.getenv('BCRYPT_LOCK_DIR')
+# Card image cache: directory, size bound (bytes) and how long (seconds) browsers may reuse an image
+app.config['IMAGE_CACHE_DIR'] = os.getenv('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'images'))
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+app.config['IMAGE_MAX_AGE'] = int(os.getenv('IMAGE_MAX_AGE', 30 * 24 * 60 * 60))
+# How long (seconds) the popular decks feed is served before it is rebuilt in the background
+app.config['POPULAR_DECKS_TTL'] = int(os.getenv('POPULAR_DECKS_TTL', 15 * 60))
+# Request metrics served on /metrics, and whether to log requests that run more SQL
+# statements or take longer (milliseconds) than their budget
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+# /metrics answers only requests bearing this token, and is off without one. With several
+# worker processes, METRICS_DIR is a directory they share so any worker reports them all
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', '')
+app.config['METRICS_LOG_OVER_BUDGET'] = os.getenv('METRICS_LOG_OVER_BUDGET', 'false').lower() == 'true'
+app.config['METRICS_QUERY_BUDGET'] = int(os.getenv('METRICS_QUERY_BUDGET', 20))
+app.config['METRICS_LATENCY_BUDGET_MS'] = int(os.getenv('METRICS_LATENCY_BUDGET_MS', 500))
 
 # toolbar = DebugToolbarExtension(app)
 
@@ -36,9 +99,38 @@ connect_db(app)
 # Create tables
 with app.app_context():
     db.create_all()
+    install_deck_card_triggers()
+    metrics.instrument_engine(db.engine)
 
-# Create bcrypt instance
-bcrypt = Bcrypt(app)
+
+# Size the caches from config
+card_cache.configure(maxsize=app.config['CARD_CACHE_SIZE'], ttl=app.config['CARD_CACHE_TTL'])
+search_cache.configure(maxsize=app.config['SEARCH_CACHE_SIZE'], ttl=app.config['SEARCH_CACHE_TTL'])
+popular_decks_cache.configure(ttl=app.config['POPULAR_DECKS_TTL'])
+user_cache.configure(ttl=app.config['USER_CACHE_TTL'])
+deck_stats_cache.configure(maxsize=app.config['DECK_STATS_CACHE_SIZE'])
+fragment_cache.configure(maxsize=app.config['FRAGMENT_CACHE_SIZE'])
+app.jinja_env.add_extension(FragmentCacheExtension)
+image_store.configure(root=app.config['IMAGE_CACHE_DIR'], max_bytes=app.config['IMAGE_CACHE_MAX_BYTES'])
+
+metrics.configure(enabled=app.config['METRICS_ENABLED'], shared_dir=app.config['METRICS_DIR'])
+
+# Configure the shared password hasher
+password_hasher.configure(
+    rounds=app.config['BCRYPT_LOG_ROUNDS'],
+    max_workers=app.config['BCRYPT_WORKERS'],
+    max_pending=app.config['BCRYPT_MAX_PENDING'],
+    lock_dir=app.config['BCRYPT_LOCK_DIR']
+)
+
+# Configure the shared upstream HTTP client
+upstream.configure(
+    pool_size=app.config['UPSTREAM_POOL_SIZE'],
+    connect_timeout=app.config['UPSTREAM_CONNECT_TIMEOUT'],
+    read_timeout=app.config['UPSTREAM_READ_TIMEOUT'],
+    retries=app.config['UPSTREAM_RETRIES'],
+    backoff=app.config['UPSTREAM_BACKOFF']
+)
 
 
 
@@ -51,6 +143,12 @@ def not_found_error(error):
 def internal_error(error):
     return jsonify({"error": "An unexpected error occurred"}), 500
 
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    response = jsonify({"error": str(error)})
+    response.retry_after = 1
+    return response, 503
+
 @app.errorhandler(Exception)
 def handle_exception(error):
     response = {
@@ -60,13 +158,43 @@ def handle_exception(error):
     return jsonify(response), 500
 
 
+# Start counting the request's SQL and upstream work; registered first so it sees every query
+@app.before_request
+def start_request_metrics():
+    if metrics.enabled:
+        metrics.start_request()
+
+# Record the request's latency and query count, and log it if it went over budget
+@app.after_request
+def finish_request_metrics(response):
+    counters = metrics.finish_request(request.endpoint, request.method, response.status_code)
+    if counters is None or not app.config['METRICS_LOG_OVER_BUDGET']:
+        return response
+
+    milliseconds = counters['seconds'] * 1000
+    if counters['queries'] > app.config['METRICS_QUERY_BUDGET'] or milliseconds > app.config['METRICS_LATENCY_BUDGET_MS']:
+        app.logger.warning(
+            "Request over budget: %s %s -> %s in %.1fms, %d SQL statements (%.1fms), %d upstream calls (%.1fms)",
+            request.method, request.path, response.status_code, milliseconds,
+            counters['queries'], counters['sql_seconds'] * 1000,
+            counters['upstream_calls'], counters['upstream_seconds'] * 1000
+        )
+    return response
+
+# Endpoints that never read g.user, so add_user_to_g skips the lookup for them
+NO_USER_ENDPOINTS = {'static', 'card_image', 'get_deck_cards', 'get_deck_stats', 'get_deck_odds', 'get_deck_suggestions', 'search_cards', 'cache_stats', 'metrics_endpoint'}
+
 # Add user to Flask global
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    if request.endpoint in NO_USER_ENDPOINTS:
+        user_lookup_counts['skipped'] += 1
+        g.user = None
+
+    elif CURR_USER_KEY in session:
+        g.user = get_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -80,68 +208,7 @@ def add_user_to_g():
 def homepage():
     """Home page."""
 
-    popular_decks = [
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/88284599.jpg',
-            'deck_name': 'Voice',
-            'href': 'https://ygoprodeck.com/deck/voice-voi-512763'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/28143384.jpg',
-            'deck_name': 'Yubel Fiendsmith',
-            'href': 'https://ygoprodeck.com/deck/yubel-fiendsmith-july-2024-512480'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/73542331.jpg',
-            'deck_name': 'Pure Build Kashtira',
-            'href': 'https://ygoprodeck.com/deck/pure-build-kashtira-512751'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/27204311.jpg',
-            'deck_name': 'Fiendsmith Centur-Ion',
-            'href': 'https://ygoprodeck.com/deck/fiendsmith-centur-ion-july-2024-512714'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/93860227.jpg',
-            'deck_name': 'Fiendsmith Tune',
-            'href': 'https://ygoprodeck.com/deck/voiceless-voice-fiendsmith-tune-512705'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/96030710.jpg',
-            'deck_name': 'Centur-Ion',
-            'href': 'https://ygoprodeck.com/deck/centur-ion-july-2024-512626'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/91810826.jpg',
-            'deck_name': 'Tenpai deck',
-            'href': 'https://ygoprodeck.com/deck/tenpai-deck-512615'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/10000020.jpg',
-            'deck_name': 'Osiris - The Sky Dragon',
-            'href': 'https://ygoprodeck.com/deck/osiris-the-sky-dragon-512609'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/53842431.jpg',
-            'deck_name': 'Trif',
-            'href': 'https://ygoprodeck.com/deck/trif-512603'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/44822037.jpg',
-            'deck_name': 'White Wood v 6.0',
-            'href': 'https://ygoprodeck.com/deck/white-wood-v-6-0-512598'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/23657016.jpg',
-            'deck_name': 'Tenpai Dragon',
-            'href': 'https://ygoprodeck.com/deck/tenpai-dragon-512591'
-        },
-        {
-            'image_url': 'https://images.ygoprodeck.com/images/cards_small/37617348.jpg',
-            'deck_name': 'Rescue-ACE Fiendsmith',
-            'href': 'https://ygoprodeck.com/deck/rescue-ace-fiendsmith-512583'
-        }
-    ]
+    popular_decks = get_popular_decks()
 
 
     if g.user:
@@ -170,68 +237,7 @@ def decks_view():
         return render_template('decks.html', user=g.user, decks=g.user.decks)
     
     else:
-        popular_decks = [
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/88284599.jpg',
-                'deck_name': 'Voice',
-                'href': 'https://ygoprodeck.com/deck/voice-voi-512763'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/28143384.jpg',
-                'deck_name': 'Yubel Fiendsmith',
-                'href': 'https://ygoprodeck.com/deck/yubel-fiendsmith-july-2024-512480'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/73542331.jpg',
-                'deck_name': 'Pure Build Kashtira',
-                'href': 'https://ygoprodeck.com/deck/pure-build-kashtira-512751'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/27204311.jpg',
-                'deck_name': 'Fiendsmith Centur-Ion',
-                'href': 'https://ygoprodeck.com/deck/fiendsmith-centur-ion-july-2024-512714'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/93860227.jpg',
-                'deck_name': 'Fiendsmith Tune',
-                'href': 'https://ygoprodeck.com/deck/voiceless-voice-fiendsmith-tune-512705'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/96030710.jpg',
-                'deck_name': 'Centur-Ion',
-                'href': 'https://ygoprodeck.com/deck/centur-ion-july-2024-512626'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/91810826.jpg',
-                'deck_name': 'Tenpai deck',
-                'href': 'https://ygoprodeck.com/deck/tenpai-deck-512615'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/10000020.jpg',
-                'deck_name': 'Osiris - The Sky Dragon',
-                'href': 'https://ygoprodeck.com/deck/osiris-the-sky-dragon-512609'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/53842431.jpg',
-                'deck_name': 'Trif',
-                'href': 'https://ygoprodeck.com/deck/trif-512603'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/44822037.jpg',
-                'deck_name': 'White Wood v 6.0',
-                'href': 'https://ygoprodeck.com/deck/white-wood-v-6-0-512598'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/23657016.jpg',
-                'deck_name': 'Tenpai Dragon',
-                'href': 'https://ygoprodeck.com/deck/tenpai-dragon-512591'
-            },
-            {
-                'image_url': 'https://images.ygoprodeck.com/images/cards_small/37617348.jpg',
-                'deck_name': 'Rescue-ACE Fiendsmith',
-                'href': 'https://ygoprodeck.com/deck/rescue-ace-fiendsmith-512583'
-            }
-        ]
+        popular_decks = get_popular_decks()
 
         return render_template('/home-anon.html', popular_decks=popular_decks)
 
@@ -246,6 +252,7 @@ def register():
             user = User.register(form.username.data, form.password.data, form.email.data)
             db.session.add(user)
             db.session.commit()
+            invalidate_user(user.id)
         except IntegrityError:
             flash("Username already taken", 'danger')
             return render_template('register.html', form=form)
@@ -309,6 +316,7 @@ def edit_user():
             g.user.img_url = form.img_url.data
 
             db.session.commit()
+            invalidate_user(g.user.id)
             flash("You successfully updated your profile.", "success")
             return redirect("/user/edit")
         
@@ -344,14 +352,14 @@ def edit_deck(deck_id):
 
     form = CardSearchForm()
     renameDeckForm = RenameDeckForm()
-    offset = request.args.get('offset', 0, type=int)
-    per_page = 24  # Number of cards per page
+    cursor = request.args.get('cursor') or None
 
     if form.validate_on_submit() or request.method == 'GET':
 
         # Preserve form data if available
         if not form.validate_on_submit():
             form.name.data = request.args.get('name', '')
+            form.search_in.data = request.args.get('search_in', 'name')
             form.type.data = request.args.get('type', '')
             form.attribute.data = request.args.get('attribute', '')
             form.race.data = request.args.get('race', '')
@@ -359,68 +367,59 @@ def edit_deck(deck_id):
             form.attack.data = request.args.get('attack', '')
             form.defense.data = request.args.get('defense', '')
 
-        cards_data = fetch_ygo_cards(
-            fname=form.name.data,
-            type=form.type.data if form.type.data != '' else None,
-            attribute=form.attribute.data if form.attribute.data != '' else None,
-            race=form.race.data if form.race.data != '' else None,
-            level=form.level.data if form.level.data != '' else None,
-            attack=f"gte{form.attack.data}" if form.attack.data != '' else None,
-            defense=f"gte{form.defense.data}" if form.defense.data != '' else None,
-            num=per_page,
-            offset=offset
-        )
+        try:
+            cards_data = find_cards(
+                fname=form.name.data,
+                search_text=form.search_in.data == 'text',
+                type=form.type.data if form.type.data != '' else None,
+                attribute=form.attribute.data if form.attribute.data != '' else None,
+                race=form.race.data if form.race.data != '' else None,
+                level=form.level.data if form.level.data != '' else None,
+                attack=f"gte{form.attack.data}" if form.attack.data != '' else None,
+                defense=f"gte{form.defense.data}" if form.defense.data != '' else None,
+                num=SEARCH_PAGE_SIZE,
+                cursor=cursor
+            )
+        except ValueError:
+            flash("That page of results is no longer available. Please search again.", "danger")
+            return render_template('deck-view.html', deck=deck, form=form, cards=[], renameDeckForm=renameDeckForm, user=g.user)
 
         if not cards_data:
             flash("No cards found that fit the filters", "danger")
-            return render_template('deck-view.html', deck=deck, form=form, cards=[], offset=offset, renameDeckForm=renameDeckForm, user=g.user)
+            return render_template('deck-view.html', deck=deck, form=form, cards=[], renameDeckForm=renameDeckForm, user=g.user)
 
         # Extract relevant data for rendering
         cards = cards_data['data']
-        pages_remaining = cards_data['meta']['pages_remaining']
+        next_cursor = cards_data['meta']['next_cursor']
+        prev_cursor = cards_data['meta']['prev_cursor']
 
-        return render_template('deck-view.html', deck=deck, cards=cards, form=form, offset=offset, pages_remaining=pages_remaining, renameDeckForm=renameDeckForm, user=g.user)
+        return render_template('deck-view.html', deck=deck, cards=cards, form=form, next_cursor=next_cursor, prev_cursor=prev_cursor, renameDeckForm=renameDeckForm, user=g.user)
 
-    return render_template('deck-view.html', deck=deck, form=form, cards=[], offset=0, renameDeckForm=renameDeckForm, user=g.user)
+    return render_template('deck-view.html', deck=deck, form=form, cards=[], renameDeckForm=renameDeckForm, user=g.user)
 
 
 # New Search route for edit deck
 @app.route('/decks/<int:deck_id>/cards/new_search', methods=['POST'])
 def new_search(deck_id):
-    """Called when a new search is made. Resets offset to 0 and redirects to edit_deck with form data."""
+    """Called when a new search is made. Starts from the first page and redirects to edit_deck with form data."""
 
-    # get form data, set offset to 0, and redirect to edit_deck
+    # get form data, drop any page cursor, and redirect to edit_deck
     form_data = request.form.to_dict()
-    return redirect(url_for('edit_deck', deck_id=deck_id, offset=0, **form_data))
+    form_data.pop('cursor', None)
+    return redirect(url_for('edit_deck', deck_id=deck_id, **form_data))
 
 
 # Previous card page route for deck edit
 @app.route('/decks/<int:deck_id>/cards/previous_page', methods=['POST'])
 def previous_page(deck_id):
-    """Load the previous page of cards."""
-
-    offset = int(request.form['offset'])
-    new_offset = max(0, offset - 30)
-
-    # Convert form data to dictionary and remove offset
-    form_data = request.form.to_dict()
-    form_data.pop('offset', None)
-    
-    return redirect(url_for('edit_deck', deck_id=deck_id, offset=new_offset, **form_data))
+    """Load the previous page of cards. The form's cursor is the prev_cursor of the current page."""
+    return redirect(url_for('edit_deck', deck_id=deck_id, **request.form.to_dict()))
 
 # Next card page route for deck edit
 @app.route('/decks/<int:deck_id>/cards/next_page', methods=['POST'])
 def next_page(deck_id):
-    """Load the next page of cards."""
-
-    offset = int(request.form['offset'])
-    new_offset = offset + 30
-
-    # Convert form data to dictionary and remove offset
-    form_data = request.form.to_dict()
-    form_data.pop('offset', None)
-    
-    return redirect(url_for('edit_deck', deck_id=deck_id, offset=new_offset, **form_data))
+    """Load the next page of cards. The form's cursor is the next_cursor of the current page."""
+    return redirect(url_for('edit_deck', deck_id=deck_id, **request.form.to_dict()))
 
 # Delete deck route
 @app.route('/decks/<int:deck_id>/delete', methods=['GET', 'POST'])
@@ -433,8 +432,10 @@ def delete_deck(deck_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    db.session.delete(deck)
+    # One DELETE; the database removes the deck's cards with it
+    remove_deck(deck)
     db.session.commit()
+    invalidate_popular_decks()
     # flash("Deck deleted.", "success")
     return redirect("/decks")
 
@@ -451,36 +452,18 @@ def add_card_to_deck(deck_id, card_id):
         return jsonify({"error": "Access unauthorized."}), 401
 
     deck = Deck.query.get_or_404(deck_id)
-    card = fetch_card_by_id(card_id)
+    card = get_card(card_id)
 
     if not card:
         return jsonify({"error": "Card not found."}), 404
 
-    card = add_card_to_db(card)
-
-    # If there are more than 60 cards with card.extra_deck = False, don't allow the user to add more cards
-    if (not card.extra_deck) and (deck.main_deck_count >= 60):
-        return jsonify({"error": "Cannot add more than 60 cards to the main deck."}), 400
-
-
-    # If there are more than 15 cards with card.extra_deck = True, don't allow the user to add more cards
-    if card.extra_deck and (deck.extra_deck_count >= 15):
-        return jsonify({"error": "Cannot add more than 15 cards to the extra deck."}), 400
-    
-
-
-    if card.limit == 0:
-        return jsonify({"error": f"{card.name} is banned."}), 400
-
-    deck_card = DeckCard.query.filter_by(deck_id=deck_id, card_id=card_id).first()
-
-    if deck_card:
-        if deck_card.quantity >= card.limit:
-            return jsonify({"error": f"Cannot add more than {card.limit} copies of {card.name}."}), 400
-        deck_card.quantity += 1
-    else:
-        deck_card = DeckCard(deck_id=deck_id, card_id=card.id, quantity=1)
-        db.session.add(deck_card)
+    # One conditional upsert checks the rules and adds the copy, so concurrent clicks can't overshoot
+    if add_deck_card_copy(deck_id, card.id) is None:
+        db.session.rollback()
+        deck_card = db.session.get(DeckCard, (deck_id, card.id))
+        # 60 main / 15 extra, banlist and card limit
+        error = check_deck_op(card, deck_card.quantity if deck_card else 0, 1, deck.main_deck_count, deck.extra_deck_count)
+        return jsonify({"error": error or f"Cannot add {card.name} to {deck.name}."}), 400
 
     db.session.commit()
     return jsonify({"message": f"{card.name} added to {deck.name}."}), 200
@@ -497,20 +480,18 @@ def remove_card_from_deck(deck_id, card_id):
         return jsonify({"error": "Access unauthorized."}), 401
 
     deck = Deck.query.get_or_404(deck_id)
-    deck_card = DeckCard.query.filter_by(deck_id=deck_id, card_id=card_id).first()
-    card = fetch_card_by_id(card_id)
+    card = get_card(card_id)
 
     if not card:
         return jsonify({"error": "Card not found."}), 404
 
-    card = add_card_to_db(card)
-    if deck_card:
-        deck_card.quantity -= 1
-        if deck_card.quantity == 0:
-            db.session.delete(deck_card)
-        db.session.commit()
-        return jsonify({"message": f"{card.name} removed from {deck.name}."}), 200
-    return jsonify({"error": f"{card.name} is not in the deck."}), 400
+    # One UPDATE takes the copy out, and the card leaves the deck with its last copy
+    if remove_deck_card_copy(deck_id, card.id) is None:
+        db.session.rollback()
+        return jsonify({"error": f"{card.name} is not in the deck."}), 400
+
+    db.session.commit()
+    return jsonify({"message": f"{card.name} removed from {deck.name}."}), 200
 
 
 # Clear deck route
@@ -525,29 +506,249 @@ def clear_deck(deck_id):
     
     deck = Deck.query.get_or_404(deck_id)
 
-    # Select all deck_cards from database
-    deck_cards = DeckCard.query.filter_by(deck_id=deck_id).all()
-
-    # Delete all deck_cards and commit changes
-    for deck_card in deck_cards:
-        db.session.delete(deck_card)
+    # Delete all deck_cards in one statement and commit changes
+    clear_deck_cards(deck)
     db.session.commit()
     
     # flash(f"{deck.name} cleared.", "success")
     return redirect(f"/decks/{deck_id}")
 
 
+# Duplicate deck route
+@app.route('/decks/<int:deck_id>/duplicate', methods=['POST'])
+def duplicate_deck_view(deck_id):
+    """Copy a deck and its cards into a new deck for the logged in user, and open the copy."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    deck = Deck.query.get_or_404(deck_id)
+    copy = duplicate_deck(deck, g.user.id)
+    db.session.commit()
+    return redirect(f"/decks/{copy.id}")
+
+
 
 # API ENDPOINTS
 
+# Part of every deck ETag. Bump it whenever a deck endpoint's response changes shape, so browsers
+# revalidate copies cached under the old format
+DECK_PAYLOAD_FORMAT = 1
+
 # API endpoint to get all cards in a deck
 @app.route('/api/decks/<int:deck_id>/cards', methods=['GET'])
 def get_deck_cards(deck_id):
     """API endpoint to get all cards in a deck."""
 
     deck = Deck.query.get_or_404(deck_id)
-    cards = [{'id': dc.card_id, 'quantity': dc.quantity, 'is_extra_deck': dc.card.extra_deck, 'img_url': dc.card.img_url, 'card_desc': dc.card.description} for dc in deck.deck_cards]
-    return jsonify(cards)
+
+    # ?split=1 returns {"main": [...], "extra": [...]} instead of one list
+    split = request.args.get('split', 0, type=int) == 1
+    # Refreshed card text and art change the list without bumping the deck's version
+    refreshed_at = deck_cards_refreshed_at(deck.id)
+    cards_stamp = refreshed_at.strftime('%Y%m%d%H%M%S%f') if refreshed_at else '0'
+    etag = f"deck-{deck.id}-v{deck.version}-c{cards_stamp}-{'split' if split else 'flat'}-f{DECK_PAYLOAD_FORMAT}"
+
+    # Unchanged deck and cards, skip loading the cards
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(deck_card_dicts(deck_id, split))
+
+    # Let the browser cache the cards but revalidate them on every use
+    response.set_etag(etag)
+    response.last_modified = max(filter(None, (deck.updated_at, refreshed_at)), default=None)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# API endpoint to get a deck's statistics
+@app.route('/api/decks/<int:deck_id>/stats', methods=['GET'])
+def get_deck_stats(deck_id):
+    """API endpoint to get a deck's type, attribute, race and level breakdowns and ATK/DEF curves,
+    counted in copies. Cached per deck version, so repeat views skip the aggregate query."""
+
+    deck = Deck.query.get_or_404(deck_id)
+    etag = f"deck-{deck.id}-v{deck.version}-stats-f{DECK_PAYLOAD_FORMAT}"
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({
+            "deck_id": deck.id,
+            "version": deck.version,
+            "main_deck_count": deck.main_deck_count,
+            "extra_deck_count": deck.extra_deck_count,
+            "over_limit": deck.over_limit,
+            **cached_deck_stats(deck)
+        })
+
+    response.set_etag(etag)
+    response.last_modified = deck.updated_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# API endpoint to get a deck's opening hand odds
+@app.route('/api/decks/<int:deck_id>/odds', methods=['GET'])
+def get_deck_odds(deck_id):
+    """API endpoint to get the chance of opening with cards from the main deck, in 5 and 6 card hands.
+    By default returns the exact odds of drawing each card, and with ?cards=<id>,<id>&at_least=<k>
+    the odds of drawing at least k cards from that set.
+    With ?mode=simulate, estimates the odds of a hand meeting every ?condition=<id>,<id>:<k>
+    (at least k cards from each set) over ?trials= shuffled hands, up to MAX_TRIALS.
+    Every k must be between 1 and the largest hand size."""
+
+    deck = Deck.query.get_or_404(deck_id)
+    composition = main_deck_composition(deck.id)
+    in_deck = {card_id for card_id, _ in composition}
+
+    def card_set(text):
+        card_ids = tuple(sorted({int(card_id) for card_id in text.split(',') if card_id.strip()}))
+        missing = [card_id for card_id in card_ids if card_id not in in_deck]
+        if not card_ids or missing:
+            raise ValueError(f"Cards not in the main deck: {', '.join(map(str, missing))}." if missing else "No cards given.")
+        return card_ids
+
+    try:
+        if request.args.get('mode') == 'simulate':
+            conditions = []
+            for condition in request.args.getlist('condition'):
+                cards, _, at_least = condition.partition(':')
+                conditions.append((card_set(cards), int(at_least or 1)))
+            if not conditions:
+                return jsonify({"error": "Give at least one condition=<id>,<id>:<k>."}), 400
+            trials = min(request.args.get('trials', DEFAULT_TRIALS, type=int), MAX_TRIALS)
+            result = simulate_hands(composition, tuple(conditions), max(trials, 1))
+        else:
+            chosen = card_set(request.args['cards']) if request.args.get('cards') else ()
+            result = deck_odds(composition, chosen, request.args.get('at_least', 1, type=int))
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    except OddsUnavailable as error:
+        return jsonify({"error": str(error)}), 503
+
+    return jsonify({"deck_id": deck.id, "version": deck.version, **result})
+
+# API endpoint to suggest cards for a deck
+@app.route('/api/decks/<int:deck_id>/suggestions', methods=['GET'])
+def get_deck_suggestions(deck_id):
+    """API endpoint to suggest cards that often share decks with this deck's cards.
+    ?limit= sets how many (default 12, at most 50)."""
+
+    deck = Deck.query.get_or_404(deck_id)
+    limit = min(max(request.args.get('limit', SUGGESTIONS_SIZE, type=int), 1), MAX_SUGGESTIONS)
+    return jsonify({"deck_id": deck.id, "version": deck.version, "cards": deck_suggestions(deck.id, limit)})
+
+# API endpoint to apply a batch of card changes to a deck
+@app.route('/api/decks/<int:deck_id>/ops', methods=['POST'])
+def deck_ops(deck_id):
+    """API endpoint to add and remove many cards in one transaction.
+    Expects JSON {"ops": [{"card_id": 89631139, "delta": 2}, ...], "atomic": true}.
+    Atomic batches are all-or-nothing; otherwise rule-breaking changes are skipped and
+    listed under "rejected". At most MAX_DECK_OPS changes per batch. Returns the resulting deck."""
+
+    if not g.user:
+        return jsonify({"error": "Access unauthorized."}), 401
+
+    deck = Deck.query.get_or_404(deck_id)
+    data = request.get_json(silent=True)
+
+    # Accept {"ops": [...]} or a bare list of ops
+    payload = data if isinstance(data, dict) else {"ops": data}
+    try:
+        ops = [(int(op['card_id']), int(op['delta'])) for op in payload['ops']]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Invalid operations."}), 400
+    if len(ops) > MAX_DECK_OPS:
+        return jsonify({"error": f"At most {MAX_DECK_OPS} operations per batch."}), 400
+
+    atomic = bool(payload.get('atomic', True))
+
+    try:
+        rejected = apply_deck_ops(deck, ops, atomic=atomic)
+        if atomic and rejected:
+            db.session.rollback()
+            card_id, error = rejected[0]
+            return jsonify({"error": error, "card_id": card_id}), 400
+        db.session.commit()
+    except ValueError as error:
+        db.session.rollback()
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({
+        **deck_card_dicts(deck_id, split=True),
+        "main_deck_count": deck.main_deck_count,
+        "extra_deck_count": deck.extra_deck_count,
+        "over_limit": deck.over_limit,
+        "version": deck.version,
+        "rejected": [{"card_id": card_id, "error": error} for card_id, error in rejected]
+    })
+
+# API endpoint to import a deck list
+@app.route('/api/decks/<int:deck_id>/import', methods=['POST'])
+def import_deck_list(deck_id):
+    """API endpoint to load a .ydk file or ydke:// URL into a deck in one transaction.
+    Expects JSON {"deck": "<ydk text or ydke:// URL>", "replace": true}, or the deck list as
+    the request body. The whole list is checked against the deck rules first; if any copy
+    breaks one, nothing is changed and every problem is listed. Side decks are ignored. Lists
+    longer than MAX_DECK_LIST_CARDS are refused before any card is looked up."""
+
+    if not g.user:
+        return jsonify({"error": "Access unauthorized."}), 401
+
+    deck = Deck.query.get_or_404(deck_id)
+    data = request.get_json(silent=True)
+    payload = data if isinstance(data, dict) else {"deck": request.get_data(as_text=True)}
+
+    try:
+        main, extra, side = parse_deck_code(str(payload.get('deck') or ''))
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    if not main and not extra:
+        return jsonify({"error": "The deck list is empty."}), 400
+    if len(main) + len(extra) + len(side) > MAX_DECK_LIST_CARDS:
+        return jsonify({"error": f"A deck list holds at most {MAX_DECK_LIST_CARDS} cards."}), 400
+
+    try:
+        rejected = import_deck(deck, main + extra, replace=bool(payload.get('replace', True)))
+        if rejected:
+            return jsonify({
+                "error": rejected[0][1],
+                "rejected": [{"card_id": card_id, "error": error} for card_id, error in rejected]
+            }), 400
+        db.session.commit()
+    except ValueError as error:
+        db.session.rollback()
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({
+        **deck_card_dicts(deck_id, split=True),
+        "main_deck_count": deck.main_deck_count,
+        "extra_deck_count": deck.extra_deck_count,
+        "over_limit": deck.over_limit,
+        "version": deck.version,
+        "ignored_side_deck": len(side)
+    })
+
+# API endpoint to export a deck list
+@app.route('/api/decks/<int:deck_id>/export', methods=['GET'])
+def export_deck_list(deck_id):
+    """API endpoint to download a deck as a .ydk file (?format=ydk, the default) or get its
+    ydke:// URL (?format=ydke)."""
+
+    deck = Deck.query.get_or_404(deck_id)
+    main, extra = deck_card_ids(deck_id)
+
+    if request.args.get('format', 'ydk') == 'ydke':
+        return jsonify({"ydke": format_ydke(main, extra)})
+
+    response = app.response_class(format_ydk(main, extra), mimetype='text/plain')
+    filename = secure_filename(deck.name) or f"deck-{deck.id}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.ydk"'
+    return response
 
 # API endpoint to clear a deck
 @app.route('/api/decks/<int:deck_id>/clear', methods=['POST'])
@@ -555,62 +756,125 @@ def clear_deck_api(deck_id):
     """API endpoint to clear a deck of all cards."""
 
     deck = Deck.query.get_or_404(deck_id)
-    deck_cards = DeckCard.query.filter_by(deck_id=deck_id).all()
-
-    for deck_card in deck_cards:
-        db.session.delete(deck_card)
+    clear_deck_cards(deck)
     db.session.commit()
 
     return jsonify({"message": f"{deck.name} cleared."})
 
+# API endpoint to duplicate a deck
+@app.route('/api/decks/<int:deck_id>/duplicate', methods=['POST'])
+def duplicate_deck_api(deck_id):
+    """API endpoint to copy a deck and its cards into a new deck for the logged in user.
+    An optional JSON body {"name": ...} names the copy."""
+
+    if not g.user:
+        return jsonify({"error": "Access unauthorized."}), 401
+
+    deck = Deck.query.get_or_404(deck_id)
+    name = (request.get_json(silent=True) or {}).get('name')
+    if name is not None and (not isinstance(name, str) or not name.strip()):
+        return jsonify({"error": "name must be a non-empty string."}), 400
+
+    copy = duplicate_deck(deck, g.user.id, name=name.strip() if name else None)
+    db.session.commit()
+
+    return jsonify({
+        "deck_id": copy.id,
+        "name": copy.name,
+        "main_deck_count": copy.main_deck_count,
+        "extra_deck_count": copy.extra_deck_count,
+        "over_limit": copy.over_limit
+    }), 201
+
 # API endpoint to search for cards
 @app.route('/api/cards/search', methods=['GET', 'POST'])
 def search_cards():
     """API endpoint to search for cards."""
     form = CardSearchForm()
-    per_page = 30
 
-    # Retrieve offset from request (POST for search form, GET for pagination)
-    if request.method == 'POST':
-        offset = int(request.form.get('offset', 0))
-    else:
-        offset = int(request.args.get('offset', 0))
+    # Retrieve the page cursor from request (POST for search form, GET for pagination)
+    cursor = request.values.get('cursor') or None
 
     if form.validate_on_submit() or request.method in ['POST', 'GET']:
         # Preserve form data if available
         if request.method == 'GET' or not form.validate_on_submit():
             form.name.data = request.values.get('name', '')
+            form.search_in.data = request.values.get('search_in', 'name')
             form.type.data = request.values.get('type', '')
             form.attribute.data = request.values.get('attribute', '')
             form.race.data = request.values.get('race', '')
             form.level.data = request.values.get('level', '')
             form.attack.data = request.values.get('attack', '')
             form.defense.data = request.values.get('defense', '')
-            form.offset.data = offset
-
-        cards_data = fetch_ygo_cards(
-            fname=form.name.data,
-            type=form.type.data if form.type.data != '' else None,
-            attribute=form.attribute.data if form.attribute.data != '' else None,
-            race=form.race.data if form.race.data != '' else None,
-            level=form.level.data if form.level.data != '' else None,
-            attack=f"gte{form.attack.data}" if form.attack.data != '' else None,
-            defense=f"gte{form.defense.data}" if form.defense.data != '' else None,
-            num=per_page,
-            offset=offset
-        )
+            form.cursor.data = cursor
+
+        try:
+            cards_data = find_cards(
+                fname=form.name.data,
+                search_text=form.search_in.data == 'text',
+                type=form.type.data if form.type.data != '' else None,
+                attribute=form.attribute.data if form.attribute.data != '' else None,
+                race=form.race.data if form.race.data != '' else None,
+                level=form.level.data if form.level.data != '' else None,
+                attack=f"gte{form.attack.data}" if form.attack.data != '' else None,
+                defense=f"gte{form.defense.data}" if form.defense.data != '' else None,
+                num=SEARCH_PAGE_SIZE,
+                cursor=cursor
+            )
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
 
         if not cards_data:
             return jsonify({"error": "No cards found that fit the filters."}), 404
 
         # Extract relevant data for rendering
         cards = cards_data['data']
-        pages_remaining = cards_data['meta']['pages_remaining']
+        meta = cards_data['meta']
 
-        return jsonify({"cards": cards, "offset": offset, "pages_remaining": pages_remaining})
+        return jsonify({"cards": cards, "next_cursor": meta['next_cursor'], "prev_cursor": meta['prev_cursor']})
 
     return jsonify({"error": "Invalid form data."}), 400
 
+# Card image route
+@app.route('/images/cards/<size>/<int:card_id>.jpg', methods=['GET'])
+def card_image(size, card_id):
+    """Serve a card's art from the local image cache, fetching it from YGOPRODeck on first use.
+    Only cards in the cards table are fetched; art for any other id (alternate artworks, API
+    search results not stored locally) is left to the browser to load from YGOPRODeck."""
+
+    if size not in IMAGE_SIZES:
+        return jsonify({"error": "Resource not found"}), 404
+
+    opened = open_card_image(card_id, size, fetch=False)
+    if opened is None:
+        if db.session.get(Card, card_id) is None:
+            return redirect(upstream_image_url(card_id, size))
+        opened = open_card_image(card_id, size)
+    if opened is None:
+        return jsonify({"error": "Image not found."}), 404
+
+    # The digest names the image's content, so it doubles as a strong ETag
+    digest, file = opened
+    return send_file(file, mimetype='image/jpeg', etag=digest, max_age=app.config['IMAGE_MAX_AGE'], conditional=True)
+
+# API endpoint to report cache statistics
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """API endpoint to report card, search, user, deck statistics and image cache sizes and hit ratios."""
+    return jsonify({"cards": card_cache_stats(), "search": search_cache.stats(), "users": user_cache_stats(), "deck_stats": deck_stats_cache.stats(), "fragments": fragment_cache.stats(), "images": image_store.stats()})
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Report request latency, SQL and upstream call metrics in Prometheus text format.
+    Requires an 'Authorization: Bearer <METRICS_TOKEN>' header."""
+    token = app.config['METRICS_TOKEN']
+    if not metrics.enabled or not token:
+        return jsonify({"error": "Resource not found"}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify({"error": "Access unauthorized."}), 401
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # API endpoint to rename a deck
 @app.route('/api/<int:deck_id>/rename', methods=['POST'])
 def rename_deck(deck_id):
@@ -626,6 +890,7 @@ def rename_deck(deck_id):
     if form.validate_on_submit():
         deck.name = form.name.data
         db.session.commit()
+        invalidate_popular_decks()
         return redirect(f"/decks/{deck_id}")
 
     return jsonify({"error": "Invalid form data."}), 400
@@ -635,11 +900,69 @@ def rename_deck(deck_id):
 def set_deck_cover(deck_id, card_id):
     """API endpoint to set a decks cover image."""
     deck = Deck.query.get_or_404(deck_id)
-    card = fetch_card_by_id(card_id)
+    card = get_card(card_id)
 
     if not card:
         return jsonify({"error": "Card not found."}), 404
 
-    deck.cover_card_url = card['card_images'][0]['image_url_small']
+    deck.cover_card_url = card.local_img_url_small
     db.session.commit()
-    return jsonify({"message": f"Cover image set to {card['name']}."}), 200
+    invalidate_popular_decks()
+    return jsonify({"message": f"Cover image set to {card.name}."}), 200
+
+
+
+# CLI COMMANDS
+
+# Mirror the card catalog into the database
+@app.cli.command('sync-cards')
+@click.option('--file', 'path', default=None, help="Path to a cardinfo JSON dump. Downloads from the API if omitted.")
+def sync_cards_command(path):
+    """Load the full card catalog into the cards table."""
+    count = sync_card_catalog(load_card_dump(path), source=path or "api")
+    click.echo(f"Synced {count} cards.")
+
+# Recompute deck counters
+@app.cli.command('repair-deck-counts')
+def repair_deck_counts_command():
+    """Recompute the main and extra deck counters and over-limit flag of every deck."""
+    count = Deck.recount_all()
+    click.echo(f"Recounted {count} decks.")
+
+# Build the card text search index
+@app.cli.command('build-search-index')
+def build_search_index_command():
+    """Create or rebuild the full-text and substring search index on cards."""
+    dialect = build_search_index()
+    click.echo(f"Built search index for {dialect}.")
+
+# Apply the current banlist
+@app.cli.command('refresh-banlist')
+@click.option('--file', 'path', default=None, help="Path to a cardinfo JSON dump. Downloads the TCG banlist from the API if omitted.")
+def refresh_banlist_command(path):
+    """Update card limits from the current banlist and flag decks now over a limit."""
+    changed, over_limit = refresh_banlist(load_card_dump(path) if path else fetch_banlist())
+    click.echo(f"Updated the limit of {len(changed)} cards; {len(over_limit)} decks are now over a limit.")
+
+# Rebuild the card co-occurrence matrix
+@app.cli.command('rebuild-card-pairs')
+def rebuild_card_pairs_command():
+    """Recount which cards share decks, for deck suggestions, from every deck."""
+    count = rebuild_card_pairs()
+    click.echo(f"Stored {count} card pairs.")
+
+# Rebuild the popular decks feed
+@app.cli.command('refresh-popular-decks')
+def refresh_popular_decks_command():
+    """Re-rank decks into the popular decks feed."""
+    count = refresh_popular_decks()
+    click.echo(f"Ranked {count} popular decks.")
+
+# Fill the card image cache
+@app.cli.command('prewarm-images')
+@click.option('--size', 'sizes', multiple=True, type=click.Choice(list(IMAGE_SIZES)), help="Image sizes to fetch. Defaults to all.")
+def prewarm_images_command(sizes):
+    """Fetch the art of every card in a deck into the image cache and point deck covers at it."""
+    stored, failed = prewarm_card_images(sizes or tuple(IMAGE_SIZES), workers=app.config['UPSTREAM_POOL_SIZE'])
+    covers = localize_deck_covers()
+    click.echo(f"Cached {stored} images ({failed} failed) and moved {covers} deck covers to the image cache.")
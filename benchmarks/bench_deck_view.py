@@ -0,0 +1,91 @@
+"""Benchmark rendering the deck editor page with and without fragment caching.
+
+Runs offline against in-memory SQLite with the upstream API stubbed out, on a
+synthetic catalog and a full deck (60 main, 15 extra), and times:
+
+    render_uncached    rendering deck-view.html with the fragment cache disabled
+    render_cached      the same with the deck grid and search form cached
+    get_uncached       GET /decks/<id> for a logged in user, fragment cache disabled
+    get_cached         the same with the fragment cache
+
+    python benchmarks/bench_deck_view.py [--repeat 200]
+
+Prints one JSON object with median and p95 microseconds and SQL queries per
+operation, and the cached/uncached median ratio."""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configure the app before importing it
+os.environ['SUPABASE_URI'] = 'sqlite://'
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ['CARD_SEARCH_BACKEND'] = 'local'
+
+from flask import g, render_template
+from app import app, CURR_USER_KEY
+from models import db, Deck, User
+from forms import CardSearchForm, RenameDeckForm
+from fragments import fragment_cache
+from helpers import add_cards_to_db
+from bench_search import synthetic_catalog
+from bench_hot_paths import StubUpstream, QueryCounter, measure, build_full_deck, git_commit
+import helpers
+import images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    helpers.upstream = StubUpstream()
+    images.upstream = StubUpstream()
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    catalog = synthetic_catalog(2000)
+    client = app.test_client()
+
+    with app.app_context():
+        add_cards_to_db(catalog)
+        deck_id = build_full_deck(catalog)
+        user_id = User.query.filter_by(username="benchmark").one().id
+        queries = QueryCounter(db.engine)
+
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = user_id
+
+    def render():
+        with app.test_request_context(f"/decks/{deck_id}"):
+            g.user = db.session.get(User, user_id)
+            deck = db.session.get(Deck, deck_id)
+            return render_template('deck-view.html', deck=deck, form=CardSearchForm(), cards=[], renameDeckForm=RenameDeckForm(), user=g.user)
+
+    url = f"/decks/{deck_id}"
+    results = {}
+    with app.app_context():
+        for label, maxsize in (("uncached", 0), ("cached", 1024)):
+            fragment_cache.clear()
+            fragment_cache.configure(maxsize=maxsize)
+            results[f"render_{label}"] = measure(render, args.repeat, queries)
+            results[f"get_{label}"] = measure(lambda: client.get(url), args.repeat, queries)
+
+    report = {
+        "benchmark": "deck_view",
+        "commit": git_commit(),
+        "database": "sqlite",
+        "repeat": args.repeat,
+        "results": results,
+        "cached_median_ratio": {
+            name: round(results[f"{name}_cached"]["median_us"] / results[f"{name}_uncached"]["median_us"], 3)
+            for name in ("render", "get")
+        }
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Microbenchmarks for the models and helpers hot paths.
+
+Runs offline against in-memory SQLite with the upstream API stubbed out, on a
+synthetic catalog and a full deck (60 main, 15 extra), and times:
+
+    deck_counts            reading main_deck_count/extra_deck_count of a full deck
+    validate_quantity      the DeckCard quantity validator
+    add_card_to_db         upserting one card
+    add_cards_to_db_100    upserting a batch of 100 cards
+    calculate_card_limit   deriving the copy limit from an API card
+    is_extra_deck          deriving deck placement from an API card
+    get_deck_cards         GET /api/decks/<id>/cards, JSON serialization included
+    get_deck_cards_split   the same with ?split=1
+    get_deck_cards_304     a revalidation that answers 304
+
+    python benchmarks/bench_hot_paths.py [--repeat 200] [--output results.json] [--compare baseline.json]
+
+Prints one JSON object with median and p95 microseconds and SQL queries per
+operation. --compare adds each operation's median ratio against an earlier run."""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configure the app before importing it
+os.environ['SUPABASE_URI'] = 'sqlite://'
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ['CARD_SEARCH_BACKEND'] = 'local'
+
+from sqlalchemy import event
+from app import app
+from models import db, User, Deck, DeckCard
+from helpers import add_card_to_db, add_cards_to_db, calculate_card_limit, is_extra_deck
+from bench_search import synthetic_catalog
+import helpers
+import images
+
+
+class StubUpstream:
+    """Stands in for the pooled upstream client so nothing leaves the machine."""
+
+    class Response:
+        status_code = 404
+
+        def json(self):
+            return {"error": "No card matching your query was found in the database."}
+
+    def get(self, url, **kwargs):
+        return self.Response()
+
+
+class QueryCounter:
+    """Counts SQL statements sent through an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, *args):
+        self.count += 1
+
+
+def measure(operation, repeat, queries):
+    """Return median/p95 microseconds and queries per call for 'repeat' calls of 'operation'."""
+    operation()  # warm up
+    timings = []
+    started_queries = queries.count
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    timings.sort()
+    return {
+        "median_us": round(statistics.median(timings), 2),
+        "p95_us": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "queries": round((queries.count - started_queries) / repeat, 2)
+    }
+
+
+def build_full_deck(catalog):
+    """Create a user and a deck with 20 main deck cards x3 and 5 extra deck cards x3. Return the deck id."""
+    user = User(username="benchmark", hash_password="unused", email="benchmark@example.com")
+    db.session.add(user)
+    db.session.commit()
+
+    deck = Deck(name="Full Deck", user_id=user.id)
+    db.session.add(deck)
+    db.session.commit()
+
+    main = [card for card in catalog if not is_extra_deck(card)][:20]
+    extra = [card for card in catalog if is_extra_deck(card)][:5]
+    for card in main + extra:
+        db.session.add(DeckCard(deck_id=deck.id, card_id=card['id'], quantity=3))
+    db.session.commit()
+    return deck.id
+
+
+def git_commit():
+    """Return the current commit hash, or None outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--compare", help="Results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    helpers.upstream = StubUpstream()
+    images.upstream = StubUpstream()
+
+    catalog = synthetic_catalog(2000)
+    client = app.test_client()
+
+    with app.app_context():
+        add_cards_to_db(catalog)
+        deck_id = build_full_deck(catalog)
+        queries = QueryCounter(db.engine)
+
+        def deck_counts():
+            deck = db.session.get(Deck, deck_id, populate_existing=True)
+            return deck.main_deck_count, deck.extra_deck_count
+
+        deck_card = DeckCard.query.filter_by(deck_id=deck_id).first()
+        deck_card.card  # load the card, as the deck editor routes do
+
+        def validate_quantity():
+            deck_card.quantity = 2
+
+        single = catalog[0]
+        batch = catalog[100:200]
+        url = f"/api/decks/{deck_id}/cards"
+
+        results = {
+            "deck_counts": measure(deck_counts, args.repeat, queries),
+            "validate_quantity": measure(validate_quantity, args.repeat, queries)
+        }
+        # Don't let the validated change reach the deck
+        db.session.rollback()
+
+        etag = client.get(url).headers['ETag']
+        results.update({
+            "add_card_to_db": measure(lambda: add_card_to_db(single), args.repeat, queries),
+            "add_cards_to_db_100": measure(lambda: add_cards_to_db(batch), max(args.repeat // 10, 5), queries),
+            "calculate_card_limit": measure(lambda: calculate_card_limit(single), args.repeat, queries),
+            "is_extra_deck": measure(lambda: is_extra_deck(single), args.repeat, queries),
+            "get_deck_cards": measure(lambda: client.get(url), args.repeat, queries),
+            "get_deck_cards_split": measure(lambda: client.get(f"{url}?split=1"), args.repeat, queries),
+            "get_deck_cards_304": measure(lambda: client.get(url, headers={'If-None-Match': etag}), args.repeat, queries)
+        })
+
+    report = {
+        "benchmark": "hot_paths",
+        "commit": git_commit(),
+        "database": "sqlite",
+        "repeat": args.repeat,
+        "results": results
+    }
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        report["compared_to"] = baseline.get("commit")
+        report["median_ratio"] = {
+            name: round(result["median_us"] / baseline["results"][name]["median_us"], 3)
+            for name, result in results.items() if name in baseline.get("results", {})
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Benchmark deck editor latency during a login storm.
+
+Serves the app from a threaded local server backed by a temporary SQLite file,
+times GET /api/decks/<id>/cards alone, then again while other threads hammer
+POST /login with the real bcrypt cost.
+
+With --processes the server instead forks a single-threaded process per request,
+like gunicorn sync workers, so each process's own hashing bound never fills.
+Add --shared-slots to give the processes a shared BCRYPT_LOCK_DIR, which makes
+the bound machine-wide again.
+
+    python benchmarks/bench_login_storm.py [--logins 16] [--repeat 100] [--rounds 12]
+                                           [--processes 32 [--shared-slots]]
+
+Prints one JSON object with median and p95 latency in milliseconds for each
+phase, plus how the storm's logins were answered (302 signed in, 503 shed)."""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def time_requests(session, url, repeat):
+    """Return median and p95 milliseconds for 'repeat' GETs of 'url'."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        session.get(url).raise_for_status()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"median_ms": round(statistics.median(timings), 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=16, help="Concurrent login threads")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--processes", type=int, default=0, help="Fork up to this many single-threaded request processes")
+    parser.add_argument("--shared-slots", action="store_true", help="Share hashing slots across processes")
+    args = parser.parse_args()
+
+    # Configure the app before importing it
+    database = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+    os.environ['SUPABASE_URI'] = f"sqlite:///{database.name}"
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    os.environ['CARD_SEARCH_BACKEND'] = 'local'
+    lock_dir = tempfile.TemporaryDirectory() if args.shared_slots else None
+    if lock_dir:
+        os.environ['BCRYPT_LOCK_DIR'] = lock_dir.name
+
+    import requests
+    from werkzeug.serving import make_server
+    from app import app
+    from models import db, User, Deck
+    from helpers import load_card_dump, sync_card_catalog, apply_deck_ops
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with app.app_context():
+        sync_card_catalog(load_card_dump(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures', 'cardinfo.json')), source="benchmark")
+        user = User.register(username="benchmark", unhash_password="password", email="benchmark@example.com")
+        db.session.add(user)
+        db.session.commit()
+        deck = Deck(name="Benchmark Deck", user_id=user.id)
+        db.session.add(deck)
+        db.session.commit()
+        apply_deck_ops(deck, [(89631139, 3), (46986414, 2), (23995346, 1)])
+        db.session.commit()
+        deck_id = deck.id
+
+    if args.processes:
+        server = make_server('127.0.0.1', 0, app, processes=args.processes)
+    else:
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    deck_url = f"{base_url}/api/decks/{deck_id}/cards"
+
+    editor = requests.Session()
+    time_requests(editor, deck_url, 5)  # warm up
+    idle = time_requests(editor, deck_url, args.repeat)
+
+    # Storm: every thread logs in over and over with a fresh session
+    stop = threading.Event()
+    answers = Counter()
+    answers_lock = threading.Lock()
+
+    def storm():
+        while not stop.is_set():
+            response = requests.post(f"{base_url}/login", data={"username": "benchmark", "password": "password"}, allow_redirects=False)
+            with answers_lock:
+                answers[response.status_code] += 1
+            # Shed logins back off like a browser honoring Retry-After
+            if response.status_code == 503:
+                stop.wait(float(response.headers.get('Retry-After', 1)))
+
+    threads = [threading.Thread(target=storm, daemon=True) for _ in range(args.logins)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    during_storm = time_requests(editor, deck_url, args.repeat)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    server.shutdown()
+    os.unlink(database.name)
+    if lock_dir:
+        lock_dir.cleanup()
+
+    print(json.dumps({
+        "benchmark": "login_storm",
+        "bcrypt_rounds": args.rounds,
+        "login_threads": args.logins,
+        "processes": args.processes,
+        "shared_slots": args.shared_slots,
+        "repeat": args.repeat,
+        "results": {"idle": idle, "during_storm": during_storm},
+        "login_answers": {str(status): count for status, count in sorted(answers.items())}
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark the opening hand odds calculator.
+
+Times exact odds for every card in 40 and 60 card main decks (plus a chosen set of
+cards), a memoized repeat, and a two-condition Monte Carlo estimate. The memoization
+is bypassed for the cold timings, so each one does the full vectorized pass.
+
+    python benchmarks/bench_odds.py [--repeat 100] [--trials 20000]
+
+Prints one JSON object with median and p95 latency in milliseconds per case."""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from odds import deck_odds, simulate_hands
+
+
+def time_calls(operation, repeat):
+    """Return median and p95 milliseconds for 'repeat' calls of 'operation'."""
+    operation()  # warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"median_ms": round(statistics.median(timings), 4), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 4)}
+
+
+def composition(size):
+    """Return a main deck of 'size' cards: threes, then twos and ones to fill it out."""
+    cards, card_id = [], 10000000
+    while sum(copies for _, copies in cards) < size:
+        remaining = size - sum(copies for _, copies in cards)
+        cards.append((card_id, min(3 if len(cards) % 3 else 2, remaining)))
+        card_id += 1
+    return tuple(cards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--trials", type=int, default=20000, help="Monte Carlo hands per estimate")
+    args = parser.parse_args()
+
+    results, distinct_cards = {}, {}
+    for size in (40, 60):
+        deck = composition(size)
+        chosen = tuple(card_id for card_id, _ in deck[:4])
+        results[f"exact_{size}"] = time_calls(lambda: deck_odds.__wrapped__(deck, chosen, 1), args.repeat)
+        results[f"exact_{size}_memoized"] = time_calls(lambda: deck_odds(deck, chosen, 1), args.repeat)
+
+        conditions = ((chosen[:2], 1), (chosen[2:], 1))
+        results[f"simulate_{size}"] = time_calls(lambda: simulate_hands.__wrapped__(deck, conditions, args.trials), max(args.repeat // 10, 5))
+        distinct_cards[size] = len(deck)
+
+    print(json.dumps({
+        "benchmark": "odds",
+        "repeat": args.repeat,
+        "trials": args.trials,
+        "distinct_cards": distinct_cards,
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark local card search over a catalog-sized fixture.
+
+Generates a synthetic catalog the size of the full YGOPRODeck dump into SQLite,
+then times name and effect text searches through search_local_cards. Deep page
+queries follow next_cursor for 'pages' pages first, then time the page reached.
+
+    python benchmarks/bench_search.py [--cards 13000] [--repeat 50]
+
+Prints one JSON object with per-query median and p95 latency in milliseconds."""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db
+from helpers import search_local_cards, sync_card_catalog
+
+WORDS = [
+    "Dragon", "Magician", "Blue-Eyes", "Dark", "Knight", "Cyber", "Elemental", "HERO", "Destiny",
+    "Ash", "Blossom", "Maxx", "Ghost", "Ogre", "Sky", "Striker", "Tenpai", "Kashtira", "Voiceless",
+    "Voice", "Fiendsmith", "Centur-Ion", "Yubel", "Rescue-ACE", "Labrynth", "Branded", "Despia",
+    "Sprind", "Snake-Eye", "Tearlaments", "Spright", "Floowandereeze", "Swordsoul", "Purrely"
+]
+# Effect text is built from a large pool of filler words plus common rules phrases,
+# each appearing in roughly the share of real cards that contain it
+FILLER = [f"word{index}" for index in range(3000)]
+PHRASES = [
+    ("negate that effect", 0.04), ("destroy that card", 0.06), ("Special Summon this card from your hand", 0.08),
+    ("draw 1 card", 0.05), ("banish", 0.15), ("add 1 monster from your Deck to your hand", 0.07),
+    ("send it to the GY", 0.05), ("gains 500 ATK", 0.02), ("you can only use this effect once per turn", 0.30),
+    ("target 1 face-up monster", 0.05)
+]
+TYPES = ["Effect Monster", "Spell Card", "Trap Card", "Fusion Monster", "XYZ Monster", "Link Monster", "Tuner Monster"]
+
+QUERIES = [
+    ("name_word", {"fname": "dragon"}),
+    ("name_rare", {"fname": "fiendsmith knight"}),
+    ("name_short", {"fname": "as"}),
+    ("name_filtered", {"fname": "dark", "type": "Effect Monster", "attack": "gte2000"}),
+    ("text_phrase", {"fname": "negate that effect", "search_text": True}),
+    ("text_word", {"fname": "banish", "search_text": True}),
+    ("deep_page", {"fname": "dragon", "pages": 25}),
+    ("browse_deep_page", {"pages": 300})
+]
+
+
+def card_text(rng):
+    """Return repeatable random effect text about as long as a real card's."""
+    sentences = [" ".join(rng.choices(FILLER, k=12)) for _ in range(4)]
+    sentences += [phrase for phrase, share in PHRASES if rng.random() < share]
+    rng.shuffle(sentences)
+    return ". ".join(sentences) + "."
+
+
+def synthetic_catalog(count, seed=1):
+    """Return 'count' card dicts in the API shape, with repeatable random names and text."""
+    rng = random.Random(seed)
+    cards = []
+    for card_id in range(1, count + 1):
+        name = " ".join(rng.sample(WORDS, rng.randint(2, 4))) + f" {card_id}"
+        card_type = rng.choice(TYPES)
+        card = {
+            "id": card_id,
+            "name": name[:50],
+            "type": card_type,
+            "desc": card_text(rng),
+            "race": rng.choice(["Dragon", "Spellcaster", "Warrior", "Normal"]),
+            "card_images": [{"image_url": f"https://images.ygoprodeck.com/images/cards/{card_id}.jpg"}]
+        }
+        if "Monster" in card_type:
+            card.update(attribute=rng.choice(["DARK", "LIGHT", "FIRE"]), level=rng.randint(1, 12), atk=rng.randrange(0, 4000, 100), **{"def": rng.randrange(0, 3000, 100)})
+        cards.append(card)
+    return cards
+
+
+def page_cursor(filters, pages):
+    """Return the cursor 'pages' pages into a search, following next_cursor from the first page."""
+    cursor = None
+    for _ in range(pages):
+        cursor = search_local_cards(num=24, cursor=cursor, **filters)['meta']['next_cursor']
+    return cursor
+
+
+def time_query(filters, repeat):
+    """Return median and p95 milliseconds for 'repeat' runs of one search."""
+    filters = dict(filters)
+    cursor = page_cursor(filters, filters.pop('pages', 0))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        search_local_cards(num=24, cursor=cursor, **filters)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"median_ms": round(statistics.median(timings), 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=13000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite://')
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        sync_card_catalog(synthetic_catalog(args.cards), source="benchmark")
+
+        results = {name: time_query(filters, args.repeat) for name, filters in QUERIES}
+        print(json.dumps({
+            "benchmark": "search",
+            "database": db.session.get_bind().dialect.name,
+            "cards": args.cards,
+            "repeat": args.repeat,
+            "results": results
+        }, indent=2))
+
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark deck suggestions over a large card co-occurrence matrix.
+
+Generates tens of thousands of synthetic decks into SQLite (each built from one
+archetype's cards plus common staples, like real decks), builds card_pairs with the
+offline rebuild, then times suggestions for random decks and the incremental
+update that adding or removing a card triggers.
+
+    python benchmarks/bench_suggestions.py [--decks 20000] [--repeat 200]
+
+Prints one JSON object with the rebuild time, the matrix size, and median and p95
+latency in milliseconds for suggestions and incremental updates."""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, User, Deck, DeckCard
+from helpers import sync_card_catalog, deck_suggestions, rebuild_card_pairs, apply_deck_ops
+from bench_search import synthetic_catalog
+
+ARCHETYPES = 150
+ARCHETYPE_SIZE = 30
+STAPLES = 300
+
+
+def time_calls(operation, repeat):
+    """Return median and p95 milliseconds for 'repeat' calls of 'operation'."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"median_ms": round(statistics.median(timings), 3), "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+
+
+def insert_decks(count, rng):
+    """Insert 'count' decks of 14 archetype cards and 6 staples straight into the tables. Return their ids."""
+    user = User(username="benchmark", hash_password="unused", email="benchmark@example.com")
+    db.session.add(user)
+    db.session.commit()
+
+    db.session.execute(db.insert(Deck), [{'name': f"Deck {index}", 'user_id': user.id} for index in range(count)])
+    deck_ids = list(db.session.scalars(db.select(Deck.id).order_by(Deck.id)))
+
+    staples = range(ARCHETYPES * ARCHETYPE_SIZE + 1, ARCHETYPES * ARCHETYPE_SIZE + STAPLES + 1)
+    rows = []
+    for deck_id in deck_ids:
+        first = rng.randrange(ARCHETYPES) * ARCHETYPE_SIZE + 1
+        cards = rng.sample(range(first, first + ARCHETYPE_SIZE), 14) + rng.sample(staples, 6)
+        rows.extend({'deck_id': deck_id, 'card_id': card_id, 'quantity': rng.randint(1, 3)} for card_id in cards)
+    db.session.execute(db.insert(DeckCard), rows)
+    db.session.commit()
+    Deck.recount_all()
+    return deck_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--decks", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite://')
+    db.init_app(app)
+    rng = random.Random(1)
+
+    with app.app_context():
+        db.create_all()
+        sync_card_catalog(synthetic_catalog(ARCHETYPES * ARCHETYPE_SIZE + STAPLES), source="benchmark")
+        deck_ids = insert_decks(args.decks, rng)
+
+        started = time.perf_counter()
+        pairs = rebuild_card_pairs()
+        rebuild_seconds = time.perf_counter() - started
+
+        results = {"suggestions": time_calls(lambda: deck_suggestions(rng.choice(deck_ids)), args.repeat)}
+
+        # Adding a card updates about 2 x 20 pairs, removing it again the same
+        def add_and_remove():
+            deck = db.session.get(Deck, rng.choice(deck_ids))
+            card_id = rng.randrange(1, ARCHETYPES * ARCHETYPE_SIZE + 1)
+            for delta in (1, -1):
+                if not apply_deck_ops(deck, [(card_id, delta)]):
+                    db.session.commit()
+
+        results["add_and_remove_card"] = time_calls(add_and_remove, args.repeat)
+
+        print(json.dumps({
+            "benchmark": "suggestions",
+            "database": db.session.get_bind().dialect.name,
+            "decks": args.decks,
+            "card_pairs": pairs,
+            "rebuild_seconds": round(rebuild_seconds, 2),
+            "repeat": args.repeat,
+            "results": results
+        }, indent=2))
+
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
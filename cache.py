@@ -0,0 +1,109 @@
+"""In-process caches for YGO Deck Builder."""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by TTLCache.lookup when a key is not cached, since None may be a cached value
+MISSING = object()
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries expire after 'ttl' seconds.
+    Holds at most 'maxsize' entries, evicting the least recently used one when full.
+    Entries may be given a stale window after expiry in which lookup() still returns them."""
+
+    def __init__(self, maxsize=1024, ttl=300, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = OrderedDict()  # key -> (expires_at, stale_until, value)
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        """Change the size bound and/or default TTL, evicting entries if the cache shrank."""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    def get(self, key, default=None):
+        """Return the cached value for 'key', or 'default' if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.timer():
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def lookup(self, key):
+        """Return (value, is_fresh) for 'key'. Entries past their TTL but inside their stale
+        window are returned with is_fresh False. Return (MISSING, False) if not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self.timer()
+            if entry is None or entry[1] <= now:
+                self.misses += 1
+                return MISSING, False
+
+            self._entries.move_to_end(key)
+            if entry[0] > now:
+                self.hits += 1
+                return entry[2], True
+
+            self.stale_hits += 1
+            return entry[2], False
+
+    def set(self, key, value, ttl=None, stale_ttl=0):
+        """Cache 'value' under 'key' for 'ttl' seconds (the cache default if omitted),
+        then keep serving it to lookup() as stale for another 'stale_ttl' seconds."""
+        expires_at = self.timer() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, expires_at + stale_ttl, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, key):
+        """Drop 'key' from the cache if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.stale_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits + self.stale_hits) / lookups if lookups else 0.0
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits. Caller holds the lock."""
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
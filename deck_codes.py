@@ -0,0 +1,83 @@
+"""Reading and writing deck lists in the YDK file and ydke:// URL formats used by
+YGOPRODeck, EDOPro and Dueling Book. Both list card passcodes, one entry per copy,
+split into main, extra and side decks."""
+
+import base64
+import binascii
+import struct
+
+YDKE_PREFIX = "ydke://"
+
+
+# Function to read a .ydk file
+def parse_ydk(text):
+    """Return (main, extra, side) lists of card ids from .ydk text. Raise ValueError on a bad line."""
+
+    sections = {'#main': [], '#extra': [], '!side': []}
+    current = sections['#main']
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line in sections:
+            current = sections[line]
+        elif line.startswith('#'):
+            # Comments such as "#created by ..."
+            continue
+        elif line.isdigit():
+            current.append(int(line))
+        else:
+            raise ValueError(f"Invalid card id on line {number}.")
+
+    return sections['#main'], sections['#extra'], sections['!side']
+
+
+# Function to write a .ydk file
+def format_ydk(main, extra, side=(), created_by="YGO Deck Builder"):
+    """Return .ydk text for the given lists of card ids."""
+    lines = [f"#created by {created_by}", "#main", *map(str, main), "#extra", *map(str, extra), "!side", *map(str, side)]
+    return "\n".join(lines) + "\n"
+
+
+# Function to read a ydke:// URL
+def parse_ydke(url):
+    """Return (main, extra, side) lists of card ids from a ydke:// URL. Raise ValueError if malformed."""
+
+    if not url.startswith(YDKE_PREFIX):
+        raise ValueError("Not a ydke:// URL.")
+
+    # Each section is base64 of little-endian 32-bit passcodes, and each ends with '!'
+    parts = url[len(YDKE_PREFIX):].strip().split('!')
+    if len(parts) < 3:
+        raise ValueError("A ydke:// URL needs main, extra and side sections.")
+
+    sections = []
+    for part in parts[:3]:
+        try:
+            packed = base64.b64decode(part, validate=True)
+        except binascii.Error:
+            raise ValueError("Invalid base64 in ydke:// URL.")
+        if len(packed) % 4:
+            raise ValueError("Invalid card id data in ydke:// URL.")
+        sections.append(list(struct.unpack(f"<{len(packed) // 4}I", packed)))
+
+    return tuple(sections)
+
+
+# Function to write a ydke:// URL
+def format_ydke(main, extra, side=()):
+    """Return a ydke:// URL for the given lists of card ids."""
+    def pack(ids):
+        return base64.b64encode(struct.pack(f"<{len(ids)}I", *ids)).decode('ascii')
+
+    return f"{YDKE_PREFIX}{pack(main)}!{pack(extra)}!{pack(side)}!"
+
+
+# Function to read a deck list in either format
+def parse_deck_code(text):
+    """Return (main, extra, side) from a ydke:// URL or .ydk text, whichever 'text' is."""
+    text = text.strip()
+    if text.startswith(YDKE_PREFIX):
+        return parse_ydke(text)
+    return parse_ydk(text)
@@ -97,6 +97,10 @@ class CardSearchForm(FlaskForm):
     """Form for searching for cards."""
     
     name = StringField('Name')
+    search_in = SelectField('Search In', choices=[
+        ('name', 'Search Card Names'),
+        ('text', 'Search Names and Effect Text')
+    ], default='name')
     type = SelectField('Type', choices=[
         ('', 'Card Type'),
         ('Skill Card', 'Skill Card'), 
@@ -198,7 +202,18 @@ class CardSearchForm(FlaskForm):
     ])
     attack = StringField('ATK')
     defense = StringField('DEF')
-    offset = HiddenField('Offset', default=0)
+    cursor = HiddenField('Cursor')
+
+    def fragment_key(self):
+        """Return a key for caching the rendered fields while the form is blank, the one markup
+        every editor shares. Return None once a search or errors fill it in, so free-text values
+        never take up cache space."""
+        if self.errors:
+            return None
+        for field in self:
+            if getattr(field.widget, 'input_type', None) != 'hidden' and field.data not in (None, '', field.default):
+                return None
+        return 'blank'
 
 class RenameDeckForm(FlaskForm):
     """Form for renaming a deck."""
@@ -0,0 +1,45 @@
+"""Template fragment caching for YGO Deck Builder.
+
+    {% cache 'deck-grid', deck.id, deck.name %} ... {% endcache %}
+
+renders its body once per key and serves the markup from a bounded in-process
+store after that. Keys name everything the fragment depends on, so a fragment
+never goes stale: a renamed deck just gets a new entry, and the old one ages
+out of the LRU. Keep keys to values that change rarely, since every distinct
+key takes an entry. A key with a None part isn't cached, for fragments that
+can't be shared this time."""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from cache import TTLCache
+
+# Rendered fragments keyed by the tag's arguments
+fragment_cache = TTLCache(maxsize=1024, ttl=60 * 60)
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache key, ... %} ... {% endcache %} tag."""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        """Return the cached markup for 'key', rendering the body on a miss."""
+        if any(part is None for part in key):
+            return caller()
+
+        key = tuple(key)
+        markup = fragment_cache.get(key)
+        if markup is None:
+            markup = caller()
+            fragment_cache.set(key, markup)
+        return markup
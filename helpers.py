@@ -1,11 +1,42 @@
+import base64
+import hashlib
+import json
+import operator
+import threading
 import requests
-from models import db, Card
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import String, and_, case, cast, delete, func, insert, literal, or_, select, tuple_, union_all, update
+from sqlalchemy.orm import aliased, joinedload, make_transient_to_detached
+from models import db, User, Card, CardArtwork, CardPair, CatalogSync, Deck, DeckCard, PopularDeck, UPSERT_BY_DIALECT, DECK_CARD_DDL_BY_DIALECT, deck_is_over_limit, deck_copies, release_deck_pairs, claim_deck_pairs, adjust_deck_counts, adjust_card_pairs
+from cache import TTLCache, MISSING
+from http_client import upstream
+from search_index import filter_cards_by_text
+from images import fetch_card_image, localize_image_url
+
+YGO_API_URL = "https://db.ygoprodeck.com/api/v7/cardinfo.php"
+
+# Cards on a page of search results, in the deck editor and the search API alike
+SEARCH_PAGE_SIZE = 24
 
 # Function to fetch cards from API
-def fetch_ygo_cards(fname="", type=None, attribute=None, race=None, level=None, attack=None, defense=None, num=30, offset=0):
-    """Fetch Yu-Gi-Oh! cards from API by 'fname'."""
+def fetch_ygo_cards(fname="", type=None, attribute=None, race=None, level=None, attack=None, defense=None, num=SEARCH_PAGE_SIZE, offset=0):
+    """Fetch Yu-Gi-Oh! cards from API by 'fname'. Return None if no cards match or the API is unavailable."""
+    try:
+        return request_ygo_cards(fname, type, attribute, race, level, attack, defense, num, offset)
+    except requests.RequestException as error:
+        print(f"Card search failed: {error}")
+        return None
+
+
+# Function to request cards from API, telling "no match" apart from failure
+def request_ygo_cards(fname="", type=None, attribute=None, race=None, level=None, attack=None, defense=None, num=SEARCH_PAGE_SIZE, offset=0):
+    """Fetch Yu-Gi-Oh! cards from API by 'fname'. Return None if no cards match (the API answers 400).
+    Raise requests.RequestException if the API times out or fails with any other status."""
     # url = "https://db.ygoprodeck.com/api/v7/cardinfo.php?&num=20&offset=0"
-    url = "https://db.ygoprodeck.com/api/v7/cardinfo.php"
+    url = YGO_API_URL
 
     params = {
         "fname": fname,
@@ -26,20 +57,29 @@ def fetch_ygo_cards(fname="", type=None, attribute=None, race=None, level=None,
     if defense:
         params["def"] = defense
 
-    response = requests.get(url, params=params)
+    response = upstream.get(url, params=params)
+
     if response.status_code == 200:
         data = response.json()
         # return data['data']
         return data
-    else:
+    if response.status_code == 400:
         print("No cards match the filters.")
         return None
+    response.raise_for_status()
+    raise requests.HTTPError(f"Unexpected status {response.status_code}", response=response)
     
 # Function to fetch card by ID
 def fetch_card_by_id(id):
     """Fetch a Yu-Gi-Oh! card by 'id'."""
-    url = f"https://db.ygoprodeck.com/api/v7/cardinfo.php?id={id}"
-    response = requests.get(url)
+    url = f"{YGO_API_URL}?id={id}"
+
+    try:
+        response = upstream.get(url)
+    except requests.RequestException as error:
+        print(f"Card lookup failed: {error}")
+        return None
+
     if response.status_code == 200:
         data = response.json()
         return data['data'][0]
@@ -47,9 +87,458 @@ def fetch_card_by_id(id):
         return None
 
 
+# Function to fetch many cards by ID
+def fetch_cards_by_ids(ids):
+    """Fetch the cards with 'ids' from the API in one request. Return a list of API card dicts
+    (empty if none were found or the API is unavailable)."""
+
+    try:
+        response = upstream.get(YGO_API_URL, params={"id": ",".join(map(str, ids))})
+    except requests.RequestException as error:
+        print(f"Card lookup failed: {error}")
+        return []
+
+    if response.status_code == 200:
+        return response.json()['data']
+    return []
+
+# Cache of API search results keyed by normalized filters
+search_cache = TTLCache(maxsize=512, ttl=5 * 60)
+
+# Keys currently being refreshed or prefetched in the background
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+# Function to build a search cache key
+def search_cache_key(filters):
+    """Normalize search filters into a hashable key: empty filters dropped, text
+    case-folded (except type, which the API matches exactly) and sorted by name."""
+
+    filters = {"fname": "", "num": SEARCH_PAGE_SIZE, "offset": 0, **filters}
+    key = []
+
+    for name, value in filters.items():
+        if value is None or value == "":
+            continue
+        if isinstance(value, str) and name != "type":
+            value = value.strip().casefold()
+        key.append((name, value))
+
+    return tuple(sorted(key))
+
+
+# Function to fetch cards from the API through the search cache
+def cached_fetch_ygo_cards(**filters):
+    """Return fetch_ygo_cards(**filters), serving repeated searches from the search cache.
+    "No cards match" results are cached for SEARCH_CACHE_NEGATIVE_TTL seconds; failed requests
+    are not cached at all. Expired results are still served for SEARCH_CACHE_STALE_TTL seconds
+    while they are refreshed in the background, and kept if the refresh fails.
+    The following SEARCH_PREFETCH_PAGES pages are fetched into the cache in the background."""
+
+    key = search_cache_key(filters)
+    negative_ttl = current_app.config.get('SEARCH_CACHE_NEGATIVE_TTL', 30)
+    stale_ttl = current_app.config.get('SEARCH_CACHE_STALE_TTL', 10 * 60)
+
+    data, fresh = search_cache.lookup(key)
+    if data is not MISSING:
+        if not fresh:
+            revalidate_search(key, filters, negative_ttl, stale_ttl)
+    else:
+        try:
+            data = request_ygo_cards(**filters)
+        except requests.RequestException as error:
+            print(f"Card search failed: {error}")
+            return None
+        store_search_result(key, data, negative_ttl, stale_ttl)
+
+    if data:
+        prefetch_next_pages(filters, data, negative_ttl, stale_ttl)
+    return data
+
+
+# Function to cache a search result
+def store_search_result(key, data, negative_ttl, stale_ttl):
+    """Cache an API search result, using the short negative TTL for "no cards match"."""
+    if data is None:
+        search_cache.set(key, None, ttl=negative_ttl)
+    else:
+        search_cache.set(key, data, stale_ttl=stale_ttl)
+
+
+# Function to refresh a stale search result in the background
+def revalidate_search(key, filters, negative_ttl, stale_ttl):
+    """Refetch a stale search result on a background thread, once per key at a time."""
+
+    with _revalidating_lock:
+        if key in _revalidating:
+            return
+        _revalidating.add(key)
+
+    def refresh():
+        try:
+            store_search_result(key, request_ygo_cards(**filters), negative_ttl, stale_ttl)
+        except requests.RequestException:
+            # Keep serving the stale result until it falls out of its stale window
+            pass
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+
+# Pool for speculative next-page fetches, created on first use
+_prefetch_executor = None
+_prefetch_lock = threading.Lock()
+
+
+# Function to fetch the next pages of a search in the background
+def prefetch_next_pages(filters, data, negative_ttl, stale_ttl):
+    """Fetch up to SEARCH_PREFETCH_PAGES pages after 'data' into the search cache on the
+    prefetch pool, so paging forward is served locally. Pages already cached or being fetched
+    are skipped, and so is everything once SEARCH_PREFETCH_WORKERS fetches are in flight,
+    since prefetching is only a guess."""
+
+    global _prefetch_executor
+
+    depth = current_app.config.get('SEARCH_PREFETCH_PAGES', 1)
+    workers = current_app.config.get('SEARCH_PREFETCH_WORKERS', 2)
+    pages_remaining = data.get('meta', {}).get('pages_remaining', 0)
+    num = filters.get('num', SEARCH_PAGE_SIZE)
+    offset = filters.get('offset', 0)
+
+    for page in range(1, min(depth, pages_remaining) + 1):
+        page_filters = {**filters, 'offset': offset + page * num}
+        key = search_cache_key(page_filters)
+        if search_cache.lookup(key)[0] is not MISSING:
+            continue
+
+        with _revalidating_lock:
+            if key in _revalidating or len(_revalidating) >= workers:
+                continue
+            _revalidating.add(key)
+
+        with _prefetch_lock:
+            if _prefetch_executor is None:
+                _prefetch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+            executor = _prefetch_executor
+
+        executor.submit(prefetch_page, key, page_filters, negative_ttl, stale_ttl)
+
+
+# Function to fetch one page into the search cache
+def prefetch_page(key, filters, negative_ttl, stale_ttl):
+    """Fetch a search page into the search cache, then release its in-flight slot.
+    A failed fetch caches nothing, so the page is fetched again when it is asked for."""
+    try:
+        store_search_result(key, request_ygo_cards(**filters), negative_ttl, stale_ttl)
+    except requests.RequestException:
+        pass
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+
+# Function to translate an API numeric filter into SQL
+def numeric_filter(column, value):
+    """Translate an API style numeric filter ('gte1500', 'lt4', '8') into a SQL clause.
+    Raise ValueError if the value is not a number."""
+
+    value = str(value)
+    comparisons = (('gte', operator.ge), ('lte', operator.le), ('gt', operator.gt), ('lt', operator.lt))
+
+    for prefix, compare in comparisons:
+        if value.startswith(prefix):
+            return compare(column, int(value[len(prefix):]))
+
+    return column == int(value)
+
+
+# Function to fingerprint a search
+def search_fingerprint(filters):
+    """Return a short hash of a search's normalized filters, which every cursor for the search carries."""
+    return hashlib.sha1(repr(search_cache_key(filters)).encode()).hexdigest()[:12]
+
+
+# Function to write a page cursor
+def encode_cursor(fingerprint, **position):
+    """Return an opaque, URL-safe cursor for a position in the search with 'fingerprint'."""
+    payload = json.dumps({'search': fingerprint, **position}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode('ascii').rstrip('=')
+
+
+# Function to read a page cursor
+def decode_cursor(cursor, fingerprint):
+    """Return the position a cursor encodes. Raise ValueError if it is malformed or
+    belongs to a search other than the one with 'fingerprint'."""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        position = None
+    if not isinstance(position, dict) or position.pop('search', None) != fingerprint:
+        raise ValueError("Invalid cursor for this search.")
+    return position
+
+
+# Function to filter a query to the rows past a sort key
+def keyset_filter(sort_keys, values, forward=True):
+    """Return a clause matching the rows after the row whose sort key is 'values', or before
+    it if not 'forward', in the order of 'sort_keys' ((expression, descending) pairs)."""
+
+    # A single direction is one row value comparison, which can walk an index
+    if len({descending for _, descending in sort_keys}) == 1:
+        row, key = tuple_(*[expression for expression, _ in sort_keys]), tuple_(*values)
+        return row > key if forward != sort_keys[0][1] else row < key
+
+    # Otherwise, rows that tie on the keys before one of the keys and pass it on that key;
+    # values are bound with their key's type, as booleans can't be compared literally
+    values = [literal(value, expression.type) for (expression, _), value in zip(sort_keys, values)]
+    clauses = []
+    for index, ((expression, descending), value) in enumerate(zip(sort_keys, values)):
+        ties = [earlier == tied for (earlier, _), tied in zip(sort_keys, values[:index])]
+        clauses.append(and_(*ties, expression > value if forward != descending else expression < value))
+    return or_(*clauses)
+
+
+# Function to order a query by sort keys
+def keyset_order(sort_keys, forward=True):
+    """Return the ORDER BY for 'sort_keys', reversed if not 'forward'."""
+    return [expression.desc() if descending == forward else expression.asc() for expression, descending in sort_keys]
+
+
+# Function to search cards in the local catalog mirror
+def search_local_cards(fname="", type=None, attribute=None, race=None, level=None, attack=None, defense=None, num=SEARCH_PAGE_SIZE, cursor=None, search_text=False):
+    """Search the local cards table with the same filters and response shape as fetch_ygo_cards.
+    Name searches use the text search index and are ranked by relevance; if 'search_text',
+    effect text is searched too. Return None if no cards match the filters.
+
+    Pages are read by keyset: 'cursor' is the next_cursor or prev_cursor of another page of
+    the same search, and holds the sort key of the row the page continues from, so a deep
+    page costs the same as the first. Raise ValueError for a cursor from another search."""
+
+    fingerprint = search_fingerprint({
+        'fname': fname, 'type': type, 'attribute': attribute, 'race': race, 'level': level,
+        'attack': attack, 'defense': defense, 'num': num, 'search_text': search_text
+    })
+    position = decode_cursor(cursor, fingerprint) if cursor else {'after': None}
+
+    query = Card.query
+    sort_keys = [(Card.name, False), (Card.id, False)]
+
+    if fname and fname.strip():
+        query, sort_keys = filter_cards_by_text(query, fname, search_text)
+    if type:
+        query = query.filter(Card.type == type)
+    if attribute:
+        query = query.filter(func.lower(Card.attribute) == attribute.lower())
+    if race:
+        query = query.filter(func.lower(Card.race) == race.lower())
+
+    # Mirror the API, which rejects non-numeric stat filters
+    try:
+        if level:
+            query = query.filter(numeric_filter(Card.level, level))
+        if attack:
+            query = query.filter(numeric_filter(Card.attack, attack))
+        if defense:
+            query = query.filter(numeric_filter(Card.defense, defense))
+    except ValueError:
+        return None
+
+    forward = 'before' not in position
+    values = position.get('after') if forward else position['before']
+    if values is not None:
+        if not isinstance(values, list) or len(values) != len(sort_keys):
+            raise ValueError("Invalid cursor for this search.")
+        query = query.filter(keyset_filter(sort_keys, values, forward))
+
+    # Read the sort keys alongside the cards, and one row more than a page to see if there are more
+    sort_columns = [expression.label(f'sort_{index}') for index, (expression, _) in enumerate(sort_keys)]
+    rows = query.add_columns(*sort_columns).order_by(*keyset_order(sort_keys, forward)).limit(num + 1).all()
+    more = len(rows) > num
+    rows = rows[:num] if forward else rows[:num][::-1]
+    if not rows:
+        return None
+
+    has_next = more if forward else True
+    has_previous = values is not None if forward else more
+
+    return {
+        "data": [row[0].to_api_dict() for row in rows],
+        "meta": {
+            "current_rows": len(rows),
+            "next_cursor": encode_cursor(fingerprint, after=list(rows[-1][1:])) if has_next else None,
+            "prev_cursor": encode_cursor(fingerprint, before=list(rows[0][1:])) if has_previous else None
+        }
+    }
+
+
+# Function to check if the local catalog mirror is present
+_catalog_synced = False
+
+def use_local_catalog():
+    """Return True if card searches should be answered from the local cards table.
+    CARD_SEARCH_BACKEND may be 'local', 'remote' or 'auto' (local once a catalog sync has run)."""
+    global _catalog_synced
+
+    backend = current_app.config.get('CARD_SEARCH_BACKEND', 'auto')
+    if backend != 'auto':
+        return backend == 'local'
+
+    # A sync never disappears, so only keep checking until one is found
+    if not _catalog_synced:
+        _catalog_synced = db.session.query(CatalogSync.id).first() is not None
+
+    return _catalog_synced
+
+
+# Function to search cards locally or through the API
+def find_cards(search_text=False, cursor=None, **filters):
+    """Search cards using the local catalog mirror when present, otherwise the API.
+    Effect text search ('search_text') is only available locally. Either way the result's
+    meta carries the next_cursor and prev_cursor to page with, None at either end."""
+    if use_local_catalog():
+        return search_local_cards(search_text=search_text, cursor=cursor, **filters)
+    return search_remote_cards(cursor=cursor, **filters)
+
+
+# Function to search cards through the API
+def search_remote_cards(cursor=None, **filters):
+    """Search cards through the API and search cache. The API only pages by offset, so
+    its cursors carry the offset of the page. Raise ValueError for a cursor from another search."""
+
+    filters = {'num': SEARCH_PAGE_SIZE, **filters}
+    fingerprint = search_fingerprint(filters)
+    offset = decode_cursor(cursor, fingerprint).get('offset') if cursor else 0
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor for this search.")
+
+    data = localize_card_images(cached_fetch_ygo_cards(offset=offset, **filters))
+    if not data:
+        return data
+
+    num = filters['num']
+    meta = data.get('meta', {})
+    meta = {
+        **meta,
+        'next_cursor': encode_cursor(fingerprint, offset=offset + num) if meta.get('pages_remaining') else None,
+        'prev_cursor': encode_cursor(fingerprint, offset=max(offset - num, 0)) if offset else None
+    }
+    return {**data, 'meta': meta}
+
+
+# Function to point API search results at the local image route
+def localize_card_images(data):
+    """Return a copy of an API search result whose card art URLs use the local image route."""
+    if not data:
+        return data
+    cards = [
+        {**card, 'card_images': [
+            {**image, 'image_url': localize_image_url(image.get('image_url')), 'image_url_small': localize_image_url(image.get('image_url_small'))}
+            for image in card.get('card_images', [])
+        ]}
+        for card in data['data']
+    ]
+    return {**data, 'data': cards}
+
+
+# Function to load the full card dump
+def load_card_dump(path=None):
+    """Load the full cardinfo dump from a local JSON file, or from the API if no path is given.
+    Return the list of card dicts."""
+
+    if path:
+        with open(path, encoding='utf-8') as dump_file:
+            data = json.load(dump_file)
+    else:
+        response = upstream.get(YGO_API_URL)
+        response.raise_for_status()
+        data = response.json()
+
+    # Accept both the raw API response and a bare list of cards
+    return data['data'] if isinstance(data, dict) else data
+
+
+# Function to mirror the card catalog into the database
+def sync_card_catalog(cards, source="api"):
+    """Insert or update every card in 'cards' and record the sync. Return the number of cards synced."""
+
+    # Apply banlist changes first, so decks they push over a limit get flagged
+    refresh_banlist(cards, commit=False)
+    synced = add_cards_to_db(cards, commit=False)
+
+    db.session.add(CatalogSync(source=source, card_count=len(synced)))
+    db.session.commit()
+
+    return len(synced)
+
+
+# Function to fetch the current banlist
+def fetch_banlist():
+    """Return the API cards on the TCG banlist (banned, limited and semi-limited). Raise on failure."""
+    response = upstream.get(YGO_API_URL, params={"banlist": "tcg"})
+    response.raise_for_status()
+    return response.json()['data']
+
+
+# Function to apply a banlist to the stored cards
+def refresh_banlist(cards, commit=True):
+    """Apply the banlist in 'cards' (API card dicts: the full catalog, or only the cards on the
+    banlist) to the stored cards. A stored card not in 'cards' is taken to be unlimited.
+    Changed limits are written with one UPDATE and the decks holding those cards are flagged
+    in another, so the work scales with the number of changed cards. Return (ids of cards
+    whose limit changed, ids of those decks now over a limit)."""
+
+    restricted = {card['id']: limit for card in cards if (limit := int(calculate_card_limit(card))) < 3}
+
+    # Only cards restricted before or after this banlist can have changed
+    stored = db.session.execute(select(Card.id, Card.limit).where(or_(Card.limit < 3, Card.id.in_(restricted))))
+    changed = {card_id: restricted.get(card_id, 3) for card_id, limit in stored if restricted.get(card_id, 3) != limit}
+
+    over_limit = []
+    if changed:
+        db.session.execute(
+            update(Card).where(Card.id.in_(changed)).values(limit=case(changed, value=Card.id)),
+            execution_options={"synchronize_session": False}
+        )
+        expire_loaded(Card, ['limit'])
+        over_limit = flag_decks_over_limit(changed)
+
+    if commit:
+        db.session.commit()
+    uncache_cards(changed)
+
+    return sorted(changed), over_limit
+
+
+# Function to recheck the decks holding some cards against the card limits
+def flag_decks_over_limit(card_ids):
+    """Set over_limit on every deck holding one of 'card_ids' and bump its version, in one UPDATE.
+    Return the ids of those decks that are over a limit."""
+
+    affected = select(DeckCard.deck_id).where(DeckCard.card_id.in_(card_ids))
+    db.session.execute(
+        update(Deck).where(Deck.id.in_(affected)).values(over_limit=deck_is_over_limit(Deck.id), version=Deck.version + 1),
+        execution_options={"synchronize_session": False}
+    )
+    expire_loaded(Deck, ['over_limit', 'version'])
+
+    return list(db.session.scalars(select(Deck.id).where(Deck.id.in_(affected), Deck.over_limit.is_(True)).order_by(Deck.id)))
+
+
+# Function to expire columns changed behind the session's back
+def expire_loaded(model, attributes):
+    """Expire 'attributes' on every loaded 'model' instance, so they are reread after a bulk UPDATE."""
+    for instance in list(db.session.identity_map.values()):
+        if isinstance(instance, model):
+            db.session.expire(instance, attributes)
+
+
 # Function to calculate card limit
 def calculate_card_limit(card):
-    """Calculate the card limit."""
+    """Calculate the card limit. Cards only on the OCG banlist, or with a status we don't know, are unlimited."""
 
     # API ban_tcg, limit mapping
     limit_mapping = {
@@ -60,44 +549,827 @@ def calculate_card_limit(card):
     }
 
     # Get banlist info from card
-    if card.get('banlist_info') and card['banlist_info']['ban_tcg']:
-        limit = card['banlist_info']['ban_tcg']
+    limit = (card.get('banlist_info') or {}).get('ban_tcg') or 'Unlimited'
+
+    return limit_mapping.get(limit, '3')
+
+
+# Function to map an API card to Card columns
+def card_to_row(card):
+    """Return the Card column values for a card dict from the API."""
+    return {
+        'id': card['id'],
+        'name': card['name'],
+        'type': card['type'],
+        'attribute': card.get('attribute', None),
+        'race': card.get('race', None),
+        'level': card.get('level', None),
+        'attack': card.get('atk', None),
+        'defense': card.get('def', None),
+        'description': card.get('desc', ''),
+        'img_url': card['card_images'][0]['image_url'],
+        'limit': int(calculate_card_limit(card)),
+        'extra_deck': is_extra_deck(card),
+        'refreshed_at': datetime.utcnow()
+    }
+
+
+# Rows per upsert statement, which keeps SQLite under its bound parameter limit
+UPSERT_BATCH_SIZE = 500
+
+
+# Function to add cards to database
+def add_cards_to_db(cards, commit=True):
+    """Insert or update every card in 'cards' (API card dicts) and return the resulting
+    Cards keyed by id. Uses multi-row INSERT ... ON CONFLICT DO UPDATE statements on
+    Postgres and SQLite instead of a lookup and commit per card."""
+
+    rows = {card['id']: card_to_row(card) for card in cards}
+    if not rows:
+        return {}
+
+    dialect = db.session.get_bind().dialect.name
+    upsert = UPSERT_BY_DIALECT.get(dialect)
+    result = {}
+
+    if upsert is None:
+        # No ON CONFLICT support: split the rows on the ids that already exist
+        existing_ids = {card_id for (card_id,) in db.session.query(Card.id).filter(Card.id.in_(rows))}
+        new_rows = [row for card_id, row in rows.items() if card_id not in existing_ids]
+        changed_rows = [row for card_id, row in rows.items() if card_id in existing_ids]
+        if new_rows:
+            db.session.execute(insert(Card), new_rows)
+        if changed_rows:
+            db.session.execute(update(Card), changed_rows)
+        result = {card.id: card for card in Card.query.populate_existing().filter(Card.id.in_(rows))}
     else:
-        limit = 'Unlimited'
+        all_rows = list(rows.values())
+        for start in range(0, len(all_rows), UPSERT_BATCH_SIZE):
+            stmt = upsert(Card).values(all_rows[start:start + UPSERT_BATCH_SIZE])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Card.id],
+                set_={column: stmt.excluded[column] for column in all_rows[0] if column != 'id'}
+            )
+            # RETURNING hands back the stored rows, so no SELECT is needed afterwards
+            for card in db.session.scalars(stmt.returning(Card), execution_options={'populate_existing': True}):
+                result[card.id] = card
+
+    store_card_artworks(cards)
+
+    if commit:
+        db.session.commit()
 
-    return limit_mapping.get(limit)
+    return result
 
 
 # Function to add card to database
 def add_card_to_db(card):
-    """Add a card to the database if it does not already exist in the database. Return the card."""
-
-    # Check if card already exists
-    existing_card = Card.query.filter_by(name=card['name']).first()
-
-    if existing_card:
-        return existing_card
-
-    # Create a new card
-    new_card = Card(
-        id=card['id'],
-        name=card['name'],
-        type=card['type'],
-        attribute=card.get('attribute', None),
-        race=card.get('race', None),
-        level=card.get('level', None),
-        attack=card.get('atk', None),
-        defense=card.get('def', None),
-        description=card.get('desc', ''),
-        img_url=card['card_images'][0]['image_url'],
-        limit=calculate_card_limit(card),
-        extra_deck=is_extra_deck(card)
+    """Insert or update a single card (an API card dict). Return the Card."""
+    return add_cards_to_db([card])[card['id']]
+
+# Function to record alternate artwork passcodes
+def store_card_artworks(cards):
+    """Map every alternate artwork passcode in 'cards' (API card dicts) to its card, so lookups
+    by those passcodes are resolved locally. The caller commits."""
+
+    rows = {
+        image['id']: {'id': image['id'], 'card_id': card['id']}
+        for card in cards for image in card.get('card_images', [])
+        if image.get('id') not in (None, card['id'])
+    }
+    if not rows:
+        return
+
+    upsert = UPSERT_BY_DIALECT.get(db.session.get_bind().dialect.name)
+    if upsert is None:
+        db.session.execute(delete(CardArtwork).where(CardArtwork.id.in_(rows)))
+        db.session.execute(insert(CardArtwork), list(rows.values()))
+        return
+
+    all_rows = list(rows.values())
+    for start in range(0, len(all_rows), UPSERT_BATCH_SIZE):
+        stmt = upsert(CardArtwork).values(all_rows[start:start + UPSERT_BATCH_SIZE])
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[CardArtwork.id], set_={'card_id': stmt.excluded.card_id}))
+
+
+# Function to find the cards behind alternate artwork passcodes
+def cards_by_artwork(artwork_ids):
+    """Return {passcode: Card} for the passcodes in 'artwork_ids' that are stored alternate
+    artworks of a card."""
+    if not artwork_ids:
+        return {}
+    rows = db.session.execute(
+        select(CardArtwork.id, Card).join(Card, Card.id == CardArtwork.card_id).where(CardArtwork.id.in_(artwork_ids))
     )
+    return {artwork_id: card for artwork_id, card in rows}
+
+
+# In-process cache of Card snapshots keyed by card id. The TTL also bounds how
+# stale a card's ban status may get before it is refreshed from the API.
+card_cache = TTLCache(maxsize=2048, ttl=24 * 60 * 60)
+
+# Where get_card found each card: 'cache', 'db' or 'api'
+card_lookup_counts = Counter()
 
-    db.session.add(new_card)
+
+# Function to resolve a card by ID
+def get_card(id):
+    """Return the Card with 'id', or None if it doesn't exist.
+    Looks in the in-process cache, then the cards table, and only calls the API on a
+    real miss or when the stored card is older than the cache TTL."""
+
+    cached = card_cache.get(id)
+    if cached is not None:
+        card_lookup_counts['cache'] += 1
+        # Attach a copy to this session without a SELECT
+        return db.session.merge(cached, load=False)
+
+    card = db.session.get(Card, id)
+    if card is None:
+        # Alternate artwork passcodes resolve to their card's row
+        card = cards_by_artwork([id]).get(id)
+    if card is not None and not card_is_stale(card):
+        card_lookup_counts['db'] += 1
+    else:
+        api_card = fetch_card_by_id(id)
+        if api_card:
+            card_lookup_counts['api'] += 1
+            card = refresh_card(card, api_card)
+        elif card is None:
+            return None
+        else:
+            # Serve the stale card if the API is unavailable
+            card_lookup_counts['db'] += 1
+
+    cache_card(card, id)
+    return card
+
+
+# Function to check if a stored card needs refreshing from the API
+def card_is_stale(card):
+    """Return True if the card's ban status is older than the cache TTL."""
+    if card.refreshed_at is None:
+        return True
+    return datetime.utcnow() - card.refreshed_at > timedelta(seconds=card_cache.ttl)
+
+
+# Function to update or insert a card from API data
+def refresh_card(card, api_card):
+    """Write 'api_card' into 'card' (or a new Card if None) and commit. Return the card.
+    If the card's limit changed, the decks holding it are rechecked against it."""
+    old_limit = card.limit if card is not None else None
+    # The upsert refreshes 'card' in place when it is already in the session
+    card = add_card_to_db(api_card)
+    if old_limit is not None and card.limit != old_limit:
+        flag_decks_over_limit([card.id])
+        db.session.commit()
+    return card
+
+
+# Function to put a card in the in-process cache
+def cache_card(card, requested_id=None):
+    """Cache a detached snapshot of 'card' so later sessions can merge it without a query.
+    It is cached under 'requested_id' too when that is one of the card's alternate artworks."""
+    snapshot = detached_snapshot(card)
+    card_cache.set(card.id, snapshot)
+    if requested_id is not None and requested_id != card.id:
+        card_cache.set(requested_id, snapshot)
+
+
+# Function to drop cards from the in-process cache
+def uncache_cards(card_ids):
+    """Invalidate the cached snapshots of 'card_ids', including those cached under their
+    alternate artwork passcodes."""
+    if not card_ids:
+        return
+    artwork_ids = db.session.scalars(select(CardArtwork.id).where(CardArtwork.card_id.in_(card_ids)))
+    for card_id in [*card_ids, *artwork_ids]:
+        card_cache.invalidate(card_id)
+
+
+# Function to copy a loaded row out of its session
+def detached_snapshot(instance):
+    """Return a detached copy of 'instance' holding its column values, for caching across
+    sessions. Merge it back with db.session.merge(snapshot, load=False)."""
+    model = type(instance)
+    snapshot = model(**{column.key: getattr(instance, column.key) for column in model.__table__.columns})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+# Function to report card resolution counters
+def card_cache_stats():
+    """Return the card cache counters and where lookups were served from."""
+    return {**card_cache.stats(), 'sources': dict(card_lookup_counts)}
+
+
+# In-process cache of the logged in users' User rows, keyed by user id. Kept short
+# since other processes can change a user; invalidate_user covers this process.
+user_cache = TTLCache(maxsize=1024, ttl=60)
+
+# Where get_user found each user: 'cache' or 'db'
+user_lookup_counts = Counter()
+
+
+# Function to resolve the current user by ID
+def get_user(id):
+    """Return the User with 'id', or None. Served from the user cache when possible."""
+
+    cached = user_cache.get(id)
+    if cached is not None:
+        user_lookup_counts['cache'] += 1
+        return db.session.merge(cached, load=False)
+
+    user_lookup_counts['db'] += 1
+    user = db.session.get(User, id)
+    if user is not None:
+        user_cache.set(id, detached_snapshot(user))
+    return user
+
+
+# Function to drop a user from the user cache
+def invalidate_user(id):
+    """Forget the cached copy of a user after it changes."""
+    user_cache.invalidate(id)
+
+
+# Function to report user resolution counters
+def user_cache_stats():
+    """Return the user cache counters and where lookups were served from ('skipped' counts
+    requests to endpoints that don't need the user)."""
+    return {**user_cache.stats(), 'sources': dict(user_lookup_counts)}
+
+
+# Function to check a change to a deck against the deck building rules
+def check_deck_op(card, quantity, delta, main_count, extra_count):
+    """Return an error message if changing the deck's 'quantity' copies of 'card' by 'delta'
+    breaks a deck rule (60 main, 15 extra, banlist, card limit), else None."""
+
+    if delta > 0:
+        if (not card.extra_deck) and (main_count + delta > 60):
+            return "Cannot add more than 60 cards to the main deck."
+        if card.extra_deck and (extra_count + delta > 15):
+            return "Cannot add more than 15 cards to the extra deck."
+        if card.limit == 0:
+            return f"{card.name} is banned."
+        if quantity + delta > card.limit:
+            return f"Cannot add more than {card.limit} copies of {card.name}."
+    elif delta < 0:
+        if quantity == 0:
+            return f"{card.name} is not in the deck."
+        if quantity + delta < 0:
+            return f"Cannot remove more than {quantity} copies of {card.name}."
+
+    return None
+
+
+# Function to add one copy of a card to a deck
+def add_deck_card_copy(deck_id, card_id):
+    """Add one copy of a card to a deck with one conditional upsert. The copy is only written
+    while the card is under its limit and the main (60) or extra (15) deck has room, checked in
+    the statement that writes it, so rapid clicks can't both pass a check made beforehand.
+    Return the new quantity, or None if a rule stopped it. The caller commits."""
+
+    decks, cards, deck_cards = Deck.__table__, Card.__table__, DeckCard.__table__
+    room = case((cards.c.extra_deck, decks.c.extra_deck_count < 15), else_=decks.c.main_deck_count < 60)
+
+    # Postgres waits on the deck row, so concurrent adds see each other's counts
+    source = (
+        select(decks.c.id, cards.c.id, literal(1))
+        .select_from(decks.join(cards, cards.c.id == card_id))
+        .where(decks.c.id == deck_id, cards.c.limit > 0, room)
+        .with_for_update(of=decks)
+    )
+    stmt = UPSERT_BY_DIALECT[db.session.get_bind().dialect.name](deck_cards).from_select(['deck_id', 'card_id', 'quantity'], source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[deck_cards.c.deck_id, deck_cards.c.card_id],
+        set_={'quantity': deck_cards.c.quantity + 1},
+        where=deck_cards.c.quantity < select(cards.c.limit).where(cards.c.id == card_id).scalar_subquery()
+    ).returning(deck_cards.c.quantity)
+
+    quantity = db.session.execute(stmt).scalar()
+    if quantity is not None:
+        deck_card_copies_changed(deck_id, card_id, 1, quantity)
+    return quantity
+
+
+# Function to remove one copy of a card from a deck
+def remove_deck_card_copy(deck_id, card_id):
+    """Remove one copy of a card from a deck with one UPDATE that only lowers a quantity above
+    zero; the deck_cards_drop_empty trigger deletes the card in the same statement once none are
+    left. Return the new quantity (0 once the card has left the deck), or None if it wasn't in
+    the deck. The caller commits."""
+
+    quantity = db.session.execute(
+        update(DeckCard.__table__)
+        .where(DeckCard.deck_id == deck_id, DeckCard.card_id == card_id, DeckCard.quantity > 0)
+        .values(quantity=DeckCard.quantity - 1)
+        .returning(DeckCard.quantity)
+    ).scalar()
+
+    if quantity is not None:
+        if quantity == 0 and db.session.get_bind().dialect.name not in DECK_CARD_DDL_BY_DIALECT:
+            db.session.execute(delete(DeckCard).where(DeckCard.deck_id == deck_id, DeckCard.card_id == card_id))
+        deck_card_copies_changed(deck_id, card_id, -1, quantity)
+    return quantity
+
+
+# Function to update what depends on a deck's cards after a bulk write
+def deck_card_copies_changed(deck_id, card_id, delta, quantity):
+    """Apply a 'delta' copies change of a card, now at 'quantity', to the deck's counters and the
+    card pairs, as the DeckCard events would for an ORM write."""
+
+    adjust_deck_counts(db.session.connection(), deck_id, card_id, delta)
+    if quantity == (1 if delta > 0 else 0):
+        # The card joined or left the deck
+        members = set(db.session.scalars(select(DeckCard.card_id).where(DeckCard.deck_id == deck_id))) | {card_id}
+        adjust_card_pairs(db.session, members, {card_id}, delta)
+
+    expire_loaded(Deck, ['main_deck_count', 'extra_deck_count', 'over_limit', 'version', 'updated_at', 'deck_cards'])
+    expire_loaded(DeckCard, ['quantity'])
+
+
+# Most changes accepted in one batch: enough to build a full main, extra and side deck card by card
+MAX_DECK_OPS = 75
+
+# Most cards accepted in one imported deck list: a full main (60), extra (15) and side (15) deck
+MAX_DECK_LIST_CARDS = 60 + 15 + 15
+
+
+# Function to apply a batch of card changes to a deck
+def apply_deck_ops(deck, ops, atomic=True, cards=None):
+    """Apply (card_id, delta) changes to 'deck' in order, with the same rules as adding and
+    removing cards one at a time. Changes are added to the session; the caller commits.
+    Return a list of (card_id, error) for rejected changes. If 'atomic', stop at the first
+    rejected change without applying anything. 'cards' may map card ids to already resolved Cards."""
+
+    # Resolve cards first, with one query and at most one API request, since storing cards from the API commits
+    if cards is None:
+        resolved = resolve_cards(card_id for card_id, _ in ops)
+        # Alternate artwork passcodes count as the card itself
+        ops = [(resolved[card_id].id if resolved[card_id] is not None else card_id, delta) for card_id, delta in ops]
+        cards = {card.id if card is not None else card_id: card for card_id, card in resolved.items()}
+
+    # Lock the deck row so concurrent batches see each other's counters
+    db.session.refresh(deck, with_for_update=True)
+    deck_cards = {
+        deck_card.card_id: deck_card
+        for deck_card in DeckCard.query.filter(DeckCard.deck_id == deck.id, DeckCard.card_id.in_(cards))
+    }
+
+    quantities = {card_id: deck_card.quantity for card_id, deck_card in deck_cards.items()}
+    main_count, extra_count = deck.main_deck_count, deck.extra_deck_count
+    rejected = []
+
+    for card_id, delta in ops:
+        card = cards[card_id]
+        quantity = quantities.get(card_id, 0)
+        error = "Card not found." if card is None else check_deck_op(card, quantity, delta, main_count, extra_count)
+
+        if error:
+            rejected.append((card_id, error))
+            if atomic:
+                return rejected
+            continue
+
+        quantities[card_id] = quantity + delta
+        if card.extra_deck:
+            extra_count += delta
+        else:
+            main_count += delta
+
+    # Write only the net change per card
+    for card_id, quantity in quantities.items():
+        deck_card = deck_cards.get(card_id)
+        if deck_card is None:
+            if quantity > 0:
+                db.session.add(DeckCard(deck_id=deck.id, card_id=card_id, quantity=quantity))
+        elif quantity == 0:
+            db.session.delete(deck_card)
+        elif quantity != deck_card.quantity:
+            deck_card.quantity = quantity
+
+    return rejected
+
+
+
+# Function to resolve many cards by ID
+def resolve_cards(card_ids):
+    """Return {card_id: Card or None} for 'card_ids', loading known cards and alternate artworks
+    with one query each and fetching only the unknown and stale ones from the API, in one request."""
+
+    card_ids = set(card_ids)
+    cards = {card.id: card for card in Card.query.filter(Card.id.in_(card_ids))}
+
+    # Alternate artwork passcodes resolve to their card's row
+    cards.update(cards_by_artwork(card_ids - set(cards)))
+
+    # Stored cards past the cache TTL have their ban status refreshed in the same request, as
+    # get_card does, so every path checks the same limits. If the API is down they are served as is
+    stale = {card.id: card.limit for card in cards.values() if card_is_stale(card)}
+    unknown = card_ids - set(cards)
+    if unknown or stale:
+        api_cards = fetch_cards_by_ids(sorted(unknown | set(stale)))
+        # Known cards are updated in place, since the upsert repopulates loaded rows
+        stored = add_cards_to_db(api_cards)
+        for api_card in api_cards:
+            # Alternate artworks have their own passcodes but share the card's main id
+            for image in api_card.get('card_images', []):
+                if image.get('id') in unknown:
+                    cards[image['id']] = stored[api_card['id']]
+            if api_card['id'] in unknown:
+                cards[api_card['id']] = stored[api_card['id']]
+
+        # Recheck the decks holding cards whose limit changed, as refresh_card does
+        changed = [card_id for card_id, limit in stale.items() if card_id in stored and stored[card_id].limit != limit]
+        if changed:
+            flag_decks_over_limit(changed)
+            db.session.commit()
+            uncache_cards(changed)
+
+    return {card_id: cards.get(card_id) for card_id in card_ids}
+
+
+# Function to replace or extend a deck from a deck list
+def import_deck(deck, card_ids, replace=True):
+    """Set 'deck' to the cards in 'card_ids' (one entry per copy), or add them if not 'replace'.
+    Every copy is checked against the deck rules before anything is written. Changes are added to
+    the session; the caller commits. Return a list of (card_id, error), empty on success."""
+
+    wanted = Counter()
+    cards = resolve_cards(card_ids)
+    for card_id in card_ids:
+        card = cards[card_id]
+        # Alternate artwork passcodes count as the card itself
+        wanted[card.id if card is not None else card_id] += 1
+
+    current = {deck_card.card_id: deck_card.quantity for deck_card in DeckCard.query.filter_by(deck_id=deck.id)}
+    if not replace:
+        wanted.update(current)
+
+    cards = {card.id if card is not None else card_id: card for card_id, card in cards.items()}
+    cards.update({card.id: card for card in Card.query.filter(Card.id.in_(set(current) - set(cards)))})
+
+    # Removals first, so a full deck can be swapped for another without passing the size limits
+    changes = [(card_id, wanted.get(card_id, 0) - current.get(card_id, 0)) for card_id in set(current) | set(wanted)]
+    ops = sorted((change for change in changes if change[1]), key=lambda change: change[1] > 0)
+
+    rejected = apply_deck_ops(deck, ops, atomic=False, cards=cards)
+    if rejected:
+        db.session.rollback()
+    return rejected
+
+
+# Function to remove every card from a deck
+def clear_deck_cards(deck):
+    """Remove every card from 'deck' with one DELETE, without loading them. Its card pairs are
+    released and its counters reset alongside, since bulk deletes skip the DeckCard events.
+    The caller commits. Return the number of distinct cards removed."""
+
+    # Lock the deck row first, so no add can commit between releasing the pairs and the delete
+    db.session.refresh(deck, with_for_update=True)
+    release_deck_pairs(db.session, deck.id)
+    removed = db.session.execute(delete(DeckCard).where(DeckCard.deck_id == deck.id)).rowcount
+    if removed:
+        db.session.execute(
+            update(Deck).where(Deck.id == deck.id)
+            .values(main_deck_count=0, extra_deck_count=0, over_limit=False, version=Deck.version + 1, updated_at=datetime.utcnow()),
+            execution_options={"synchronize_session": False}
+        )
+        db.session.expire(deck, ['main_deck_count', 'extra_deck_count', 'over_limit', 'version', 'updated_at', 'deck_cards'])
+    return removed
+
+
+# Function to delete a deck
+def remove_deck(deck):
+    """Delete 'deck' with one DELETE; the database cascades it to the deck's cards and popular
+    feed entry, so none are loaded. Its card pairs are released first, under the deck's row
+    lock. The caller commits."""
+    db.session.refresh(deck, with_for_update=True)
+    release_deck_pairs(db.session, deck.id)
+    db.session.execute(delete(Deck).where(Deck.id == deck.id))
+
+
+# Function to copy a deck
+def duplicate_deck(deck, user_id, name=None):
+    """Copy 'deck' and its cards to a new deck owned by 'user_id'. The cards are copied with one
+    INSERT ... SELECT however many there are, then counted into the new deck's counters and the
+    card pairs. The caller commits. Return the new deck."""
+
+    copy = Deck(
+        user_id=user_id, name=(name or f"{deck.name} (copy)")[:50],
+        description=deck.description, cover_card_url=deck.cover_card_url
+    )
+    db.session.add(copy)
+    db.session.flush()
+
+    db.session.execute(insert(DeckCard).from_select(
+        ['deck_id', 'card_id', 'quantity'],
+        select(literal(copy.id), DeckCard.card_id, DeckCard.quantity).where(DeckCard.deck_id == deck.id)
+    ))
+    db.session.execute(
+        update(Deck).where(Deck.id == copy.id)
+        .values(main_deck_count=deck_copies(copy.id, False), extra_deck_count=deck_copies(copy.id, True), over_limit=deck_is_over_limit(copy.id)),
+        execution_options={"synchronize_session": False}
+    )
+    claim_deck_pairs(db.session, copy.id)
+    db.session.expire(copy, ['main_deck_count', 'extra_deck_count', 'over_limit'])
+    return copy
+
+
+# Function to list a deck's cards as deck list sections
+def deck_card_ids(deck_id):
+    """Return (main, extra) lists of card ids for a deck, one entry per copy, for exporting."""
+    main, extra = [], []
+    for card in deck_card_dicts(deck_id):
+        (extra if card['is_extra_deck'] else main).extend([card['id']] * card['quantity'])
+    return main, extra
+
+
+# Function to list a deck's cards for the deck editor
+def deck_card_dicts(deck_id, split=False):
+    """Return the deck's cards as dicts for the deck editor, loaded with one joined query.
+    If 'split', return {'main': [...], 'extra': [...]} instead of one list."""
+
+    deck_cards = DeckCard.query.options(joinedload(DeckCard.card)).filter_by(deck_id=deck_id).all()
+    # Deck slots show the small art; the full art is only loaded for the hover view
+    cards = [{'id': dc.card_id, 'quantity': dc.quantity, 'is_extra_deck': dc.card.extra_deck, 'img_url': dc.card.local_img_url_small, 'img_url_full': dc.card.local_img_url, 'card_desc': dc.card.description} for dc in deck_cards]
+
+    if split:
+        return {
+            'main': [card for card in cards if not card['is_extra_deck']],
+            'extra': [card for card in cards if card['is_extra_deck']]
+        }
+    return cards
+
+
+# Function to date the card data in a deck's card list
+def deck_cards_refreshed_at(deck_id):
+    """Return when the deck's cards were last written from the API or a catalog sync, or None
+    for an empty deck. The card list shows their text and art, which change without the deck."""
+    return db.session.scalar(
+        select(func.max(Card.refreshed_at)).join(DeckCard, DeckCard.card_id == Card.id).where(DeckCard.deck_id == deck_id)
+    )
+
+
+# Function to read a deck's main deck for the odds calculator
+def main_deck_composition(deck_id):
+    """Return the deck's main deck as a sorted tuple of (card_id, copies), loaded with one query."""
+    rows = db.session.execute(
+        select(DeckCard.card_id, DeckCard.quantity)
+        .join(Card, Card.id == DeckCard.card_id)
+        .where(DeckCard.deck_id == deck_id, Card.extra_deck.is_(False), DeckCard.quantity > 0)
+        .order_by(DeckCard.card_id)
+    )
+    return tuple((card_id, quantity) for card_id, quantity in rows)
+
+
+# Number of cards suggested for a deck by default, and at most
+SUGGESTIONS_SIZE = 12
+MAX_SUGGESTIONS = 50
+
+
+# Function to suggest cards for a deck
+def deck_suggestions(deck_id, limit=SUGGESTIONS_SIZE):
+    """Return up to 'limit' cards not in the deck, as dicts for the deck editor, ranked by how
+    often they share decks with the deck's cards. The score of card b is the sum over the deck's
+    cards a of quantity(a) * card_pairs[a, b]: one sparse matrix-vector product, run as a
+    GROUP BY over the deck's rows of card_pairs. Banned cards are left out."""
+
+    in_deck = select(DeckCard.card_id).where(DeckCard.deck_id == deck_id)
+    # Sum over the matrix rows first, so cards are only joined once per candidate
+    scores = (
+        select(CardPair.card_b.label('card_id'), func.sum(CardPair.decks * DeckCard.quantity).label('score'))
+        .select_from(DeckCard)
+        .join(CardPair, CardPair.card_a == DeckCard.card_id)
+        .where(DeckCard.deck_id == deck_id)
+        .group_by(CardPair.card_b)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(Card, scores.c.score)
+        .join(scores, scores.c.card_id == Card.id)
+        .where(scores.c.card_id.not_in(in_deck), Card.limit > 0)
+        .order_by(scores.c.score.desc(), Card.id)
+        .limit(limit)
+    )
+    return [
+        {'id': card.id, 'name': card.name, 'score': int(score), 'is_extra_deck': card.extra_deck, 'img_url': card.local_img_url_small, 'img_url_full': card.local_img_url, 'card_desc': card.description}
+        for card, score in rows
+    ]
+
+
+# Function to rebuild the card co-occurrence matrix
+def rebuild_card_pairs():
+    """Recount card_pairs from every deck with one INSERT ... SELECT, replacing the incrementally
+    maintained counts. Return the number of pairs stored."""
+
+    first, second = aliased(DeckCard), aliased(DeckCard)
+    pairs = (
+        select(first.card_id, second.card_id, func.count())
+        .join(second, and_(second.deck_id == first.deck_id, second.card_id != first.card_id))
+        .group_by(first.card_id, second.card_id)
+    )
+
+    db.session.execute(delete(CardPair))
+    result = db.session.execute(insert(CardPair).from_select(['card_a', 'card_b', 'decks'], pairs))
     db.session.commit()
+    return result.rowcount
+
+
+# Deck statistics keyed by (deck id, deck version). Any change to a deck's cards bumps its
+# version, so an entry never goes stale; old versions just age out of the LRU.
+deck_stats_cache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+# Breakdowns in the deck statistics: name -> (column, bucket width for numeric columns)
+DECK_STAT_DIMENSIONS = {
+    'type': (Card.type, None),
+    'attribute': (Card.attribute, None),
+    'race': (Card.race, None),
+    'level': (Card.level, None),
+    'attack': (Card.attack, 500),
+    'defense': (Card.defense, 500)
+}
+
+
+# Function to get a deck's statistics
+def cached_deck_stats(deck):
+    """Return the statistics of 'deck' at its current version, computing them on a cache miss."""
+    key = (deck.id, deck.version)
+    stats = deck_stats_cache.get(key)
+    if stats is None:
+        stats = compute_deck_stats(deck.id)
+        deck_stats_cache.set(key, stats)
+    return stats
+
+
+# Function to compute a deck's statistics
+def compute_deck_stats(deck_id):
+    """Return the deck's copies broken down by type, attribute, race and level, and its ATK
+    and DEF curves in 500 point buckets, each as a list of {'value', 'copies'} sorted by value.
+    Every breakdown is a SUM(quantity) GROUP BY over deck_cards JOIN cards, all in one query."""
+
+    breakdowns = []
+    for name, (column, width) in DECK_STAT_DIMENSIONS.items():
+        value = column if width is None else column // width * width
+        breakdowns.append(
+            select(literal(name).label('dimension'), cast(value, String).label('value'), func.sum(DeckCard.quantity).label('copies'))
+            .join(Card, Card.id == DeckCard.card_id)
+            .where(DeckCard.deck_id == deck_id, column.is_not(None))
+            .group_by(value)
+        )
+
+    stats = {name: [] for name in DECK_STAT_DIMENSIONS}
+    for dimension, value, copies in db.session.execute(union_all(*breakdowns)):
+        numeric = DECK_STAT_DIMENSIONS[dimension][0].type.python_type is int
+        stats[dimension].append({'value': int(value) if numeric else value, 'copies': int(copies)})
+
+    for breakdown in stats.values():
+        breakdown.sort(key=operator.itemgetter('value'))
+    return stats
+
+
+# Function to fill the image cache with the art of every card in a deck
+def prewarm_card_images(sizes=('small', 'full'), workers=8):
+    """Fetch the art of every card used in a deck into the image store, 'workers' downloads at a
+    time. Return (stored, failed) counts."""
+
+    card_ids = [card_id for (card_id,) in db.session.query(DeckCard.card_id).distinct()]
+    jobs = [(card_id, size) for card_id in card_ids for size in sizes]
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prewarm') as executor:
+        results = list(executor.map(lambda job: fetch_card_image(*job), jobs))
+
+    failed = results.count(None)
+    return len(results) - failed, failed
+
+
+# Function to point deck covers at the local image route
+def localize_deck_covers():
+    """Rewrite deck cover URLs that point at YGOPRODeck to the local image route. Return the number changed."""
+
+    changed = 0
+    for deck in Deck.query.filter(Deck.cover_card_url.like('http%')):
+        url = localize_image_url(deck.cover_card_url)
+        if url != deck.cover_card_url:
+            deck.cover_card_url = url
+            changed += 1
+
+    db.session.commit()
+    invalidate_popular_decks()
+    return changed
+
+
+# Curated YGOPRODeck lists that fill the popular decks feed until enough of our own decks are flagged
+FEATURED_DECKS = [
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/88284599.jpg', 'deck_name': 'Voice', 'href': 'https://ygoprodeck.com/deck/voice-voi-512763'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/28143384.jpg', 'deck_name': 'Yubel Fiendsmith', 'href': 'https://ygoprodeck.com/deck/yubel-fiendsmith-july-2024-512480'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/73542331.jpg', 'deck_name': 'Pure Build Kashtira', 'href': 'https://ygoprodeck.com/deck/pure-build-kashtira-512751'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/27204311.jpg', 'deck_name': 'Fiendsmith Centur-Ion', 'href': 'https://ygoprodeck.com/deck/fiendsmith-centur-ion-july-2024-512714'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/93860227.jpg', 'deck_name': 'Fiendsmith Tune', 'href': 'https://ygoprodeck.com/deck/voiceless-voice-fiendsmith-tune-512705'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/96030710.jpg', 'deck_name': 'Centur-Ion', 'href': 'https://ygoprodeck.com/deck/centur-ion-july-2024-512626'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/91810826.jpg', 'deck_name': 'Tenpai deck', 'href': 'https://ygoprodeck.com/deck/tenpai-deck-512615'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/10000020.jpg', 'deck_name': 'Osiris - The Sky Dragon', 'href': 'https://ygoprodeck.com/deck/osiris-the-sky-dragon-512609'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/53842431.jpg', 'deck_name': 'Trif', 'href': 'https://ygoprodeck.com/deck/trif-512603'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/44822037.jpg', 'deck_name': 'White Wood v 6.0', 'href': 'https://ygoprodeck.com/deck/white-wood-v-6-0-512598'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/23657016.jpg', 'deck_name': 'Tenpai Dragon', 'href': 'https://ygoprodeck.com/deck/tenpai-dragon-512591'},
+    {'image_url': 'https://images.ygoprodeck.com/images/cards_small/37617348.jpg', 'deck_name': 'Rescue-ACE Fiendsmith', 'href': 'https://ygoprodeck.com/deck/rescue-ace-fiendsmith-512583'}
+]
+
+# Number of decks shown on the home page
+POPULAR_DECKS_SIZE = 12
+
+# The rendered feed. Expired entries are served while the feed is rebuilt in the background.
+popular_decks_cache = TTLCache(maxsize=1, ttl=15 * 60)
+
+# Held while a background refresh of the feed is running
+_popular_decks_lock = threading.Lock()
+
+
+# Function to rebuild the popular decks feed
+def refresh_popular_decks():
+    """Rank the decks flagged popular, most recently changed first, and replace the
+    popular_decks table with the top POPULAR_DECKS_SIZE in one transaction. Only flagged decks
+    are published, so no one's deck is shown on the home page without being chosen for it.
+    Return the number ranked."""
+
+    ordering = [Deck.updated_at.desc().nulls_last(), Deck.id.desc()]
+    ranked = (
+        select(func.row_number().over(order_by=ordering), Deck.id, literal(datetime.utcnow()))
+        .where(Deck.popular.is_(True))
+        .order_by(*ordering)
+        .limit(POPULAR_DECKS_SIZE)
+    )
+
+    db.session.execute(delete(PopularDeck))
+    result = db.session.execute(insert(PopularDeck).from_select(['rank', 'deck_id', 'refreshed_at'], ranked))
+    db.session.commit()
+
+    invalidate_popular_decks()
+    return result.rowcount
+
+
+# Function to drop the cached popular decks feed
+def invalidate_popular_decks():
+    """Forget the cached feed so the next request reads the popular_decks table again.
+    Call after refreshing the feed or changing a deck that may be in it."""
+    popular_decks_cache.clear()
+
+
+# Function to get the popular decks feed
+def get_popular_decks():
+    """Return the home page's popular decks as dicts with image_url, deck_name and href.
+    Served from the process cache; a miss reads the materialized feed, and an expired or
+    missing feed is rebuilt on a background thread rather than during the request."""
+
+    feed, fresh = popular_decks_cache.lookup('feed')
+    if feed is not MISSING:
+        if not fresh:
+            refresh_popular_decks_in_background()
+        return feed
+
+    rows = (
+        db.session.query(PopularDeck.refreshed_at, Deck.id, Deck.name, Deck.cover_card_url)
+        .join(Deck, Deck.id == PopularDeck.deck_id)
+        .order_by(PopularDeck.rank)
+        .all()
+    )
+
+    feed = [
+        {'image_url': localize_image_url(cover_card_url), 'deck_name': name, 'href': f"/decks/{deck_id}"}
+        for _, deck_id, name, cover_card_url in rows
+    ]
+    feed += [
+        {**deck, 'image_url': localize_image_url(deck['image_url'])}
+        for deck in FEATURED_DECKS[:POPULAR_DECKS_SIZE - len(feed)]
+    ]
+
+    max_age = popular_decks_cache.ttl
+    if not rows or datetime.utcnow() - rows[0].refreshed_at > timedelta(seconds=max_age):
+        refresh_popular_decks_in_background()
+
+    popular_decks_cache.set('feed', feed, stale_ttl=max_age)
+    return feed
+
+
+# Function to rebuild the popular decks feed off the request thread
+def refresh_popular_decks_in_background():
+    """Run refresh_popular_decks on a background thread, one refresh at a time."""
+
+    if not _popular_decks_lock.acquire(blocking=False):
+        return
+
+    app = current_app._get_current_object()
+
+    def refresh():
+        try:
+            with app.app_context():
+                refresh_popular_decks()
+        finally:
+            _popular_decks_lock.release()
+
+    threading.Thread(target=refresh, daemon=True).start()
 
-    return new_card
 
 # Map card type to main deck or extra deck
 card_type_to_deck = {
@@ -0,0 +1,87 @@
+"""Shared HTTP client for calls to upstream services (YGOPRODeck)."""
+
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import metrics
+
+class UpstreamClient:
+    """A per-process requests session with connection pooling, keep-alive,
+    connect/read timeouts and bounded retries with jittered exponential backoff."""
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.3, backoff_jitter=0.2):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_jitter = backoff_jitter
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, **settings):
+        """Update settings (pool_size, connect_timeout, read_timeout, retries, backoff,
+        backoff_jitter) and drop the current session so the next call uses them."""
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise TypeError(f"Unknown client setting '{name}'.")
+            setattr(self, name, value)
+        self.close()
+
+    @property
+    def session(self):
+        """The pooled session for this process, created on first use (and again after a fork)."""
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._session = self._build_session()
+                self._pid = os.getpid()
+            return self._session
+
+    def get(self, url, **kwargs):
+        """Send a GET request through the pooled session, with the default timeouts unless given.
+        The call's duration and status are recorded in the request metrics."""
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.get(url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.record_upstream(url, status, time.perf_counter() - started)
+
+    def close(self):
+        """Close pooled connections."""
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+    def _build_session(self):
+        """Create a session whose adapters pool connections and retry idempotent requests."""
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            backoff_jitter=self.backoff_jitter,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+
+# Shared client for the whole process
+upstream = UpstreamClient()
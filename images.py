@@ -0,0 +1,305 @@
+"""Local card image cache: a size-bounded, content-addressed store on disk that is
+filled from YGOPRODeck on demand and served from our own /images route."""
+
+import hashlib
+import importlib.util
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+import requests
+from cache import TTLCache
+from http_client import upstream
+
+# Where card art is fetched from; tests point this at a local stub
+IMAGE_UPSTREAM_URL = "https://images.ygoprodeck.com/images"
+
+# Sizes served by the image route: the upstream folder each comes from, and the
+# bounding box thumbnails are made at when Pillow is installed. 'small' matches
+# YGOPRODeck's small art, which fills the deck grid, search results and covers.
+IMAGE_SIZES = {
+    'full': {'folder': 'cards', 'box': None},
+    'small': {'folder': 'cards_small', 'box': (168, 246)}
+}
+
+# Upstream card art URLs, e.g. https://images.ygoprodeck.com/images/cards_small/89631139.jpg
+UPSTREAM_IMAGE_PATTERN = re.compile(r"^https?://images\.ygoprodeck\.com/images/(cards|cards_small)/(\d+)\.jpg$")
+
+
+# Function to build the local URL of a card image
+def card_image_path(card_id, size='full'):
+    """Return our image route's URL for a card's art at 'size'."""
+    return f"/images/cards/{size}/{card_id}.jpg"
+
+
+# Function to build the upstream URL of a card image
+def upstream_image_url(card_id, size='full'):
+    """Return YGOPRODeck's URL for a card's art at 'size'."""
+    return f"{IMAGE_UPSTREAM_URL}/{IMAGE_SIZES[size]['folder']}/{card_id}.jpg"
+
+
+# Function to point an upstream card image URL at the local route
+def localize_image_url(url):
+    """Return the local URL for a YGOPRODeck card art URL, or 'url' unchanged if it isn't one."""
+    match = UPSTREAM_IMAGE_PATTERN.match(url or '')
+    if not match:
+        return url
+    folder, card_id = match.groups()
+    size = next(name for name, spec in IMAGE_SIZES.items() if spec['folder'] == folder)
+    return card_image_path(int(card_id), size)
+
+
+class ImageStore:
+    """Content-addressed image files under 'root', looked up by key and evicted least recently
+    used first once they take more than 'max_bytes'.
+
+    objects/ab/abcd... holds each distinct image once, named by its SHA-256.
+    refs/<key> holds the digest of the image for a key; its mtime is the key's last use.
+
+    The index and size bound are per process. Processes sharing 'root' may evict images
+    another process still has indexed, so get() drops a key whose image is gone."""
+
+    def __init__(self, root=None, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._refs = None  # key -> digest, least recently used first
+        self._sizes = {}   # digest -> bytes on disk
+        self._counts = Counter()  # digest -> number of keys referring to it
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def configure(self, root=None, max_bytes=None):
+        """Change the directory and/or size bound. A new directory is loaded on next use."""
+        with self._lock:
+            if root is not None and root != self.root:
+                self.root = root
+                self._refs = None
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if self._refs is not None:
+                self._evict()
+
+    def get(self, key):
+        """Return (digest, path) for 'key' and mark it used, or None if it isn't stored."""
+        with self._lock:
+            refs = self._load()
+            digest = refs.get(key)
+            if digest is None:
+                return None
+            if not os.path.exists(self._object_path(digest)):
+                self._forget(key)
+                return None
+            refs.move_to_end(key)
+            try:
+                os.utime(self._ref_path(key))
+            except OSError:
+                pass
+            return digest, self._object_path(digest)
+
+    def put(self, key, data):
+        """Store 'data' under 'key', evicting old images if over the size bound. Return (digest, path)."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+
+        with self._lock:
+            refs = self._load()
+            if digest not in self._sizes:
+                self._write(path, data)
+                self._sizes[digest] = len(data)
+                self._total += len(data)
+
+            self._write(self._ref_path(key), digest.encode())
+            old = refs.pop(key, None)
+            refs[key] = digest
+            self._counts[digest] += 1
+            if old is not None:
+                self._release(old)
+            self._evict()
+
+        return digest, path
+
+    def discard(self, key):
+        """Drop 'key', e.g. because its image vanished after get() returned it."""
+        with self._lock:
+            if key in self._load():
+                self._forget(key)
+
+    def stats(self):
+        """Return the number of keys, distinct images and bytes stored."""
+        with self._lock:
+            refs = self._load()
+            return {'keys': len(refs), 'images': len(self._sizes), 'bytes': self._total, 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        """Delete every stored image."""
+        with self._lock:
+            refs = self._load()
+            for key in list(refs):
+                self._remove(self._ref_path(key))
+                self._release(refs.pop(key))
+
+    def _load(self):
+        """Read the refs directory into memory on first use, oldest use first."""
+        if self._refs is None:
+            os.makedirs(os.path.join(self.root, 'refs'), exist_ok=True)
+            os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+
+            entries = []
+            for name in os.listdir(os.path.join(self.root, 'refs')):
+                path = self._ref_path(name)
+                with open(path) as file:
+                    entries.append((os.path.getmtime(path), name, file.read().strip()))
+
+            self._refs = OrderedDict()
+            self._sizes = {}
+            self._counts = Counter()
+            self._total = 0
+            for _, key, digest in sorted(entries):
+                if digest not in self._sizes:
+                    try:
+                        self._sizes[digest] = os.path.getsize(self._object_path(digest))
+                    except OSError:
+                        # The image is gone, so the ref is useless
+                        self._remove(self._ref_path(key))
+                        continue
+                    self._total += self._sizes[digest]
+                self._refs[key] = digest
+                self._counts[digest] += 1
+        return self._refs
+
+    def _evict(self):
+        """Drop least recently used keys until the store fits in max_bytes."""
+        while self._total > self.max_bytes and len(self._refs) > 1:
+            key, digest = self._refs.popitem(last=False)
+            self._remove(self._ref_path(key))
+            self._release(digest)
+
+    def _forget(self, key):
+        """Drop a key and its ref file. Caller holds the lock."""
+        self._remove(self._ref_path(key))
+        self._release(self._refs.pop(key))
+
+    def _release(self, digest):
+        """Drop one key's reference to an image, deleting the image once no key refers to it."""
+        self._counts[digest] -= 1
+        if self._counts[digest] > 0:
+            return
+        del self._counts[digest]
+        self._remove(self._object_path(digest))
+        self._total -= self._sizes.pop(digest, 0)
+
+    def _ref_path(self, key):
+        return os.path.join(self.root, 'refs', key)
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    @staticmethod
+    def _write(path, data):
+        """Write a file atomically, so readers never see a partial image."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Shared store for the whole process
+image_store = ImageStore()
+
+# Card art that couldn't be fetched recently, so repeat requests don't go upstream again
+failed_images = TTLCache(maxsize=4096, ttl=60)
+
+
+# Function to get a card image into the store
+def fetch_card_image(card_id, size='full'):
+    """Return (digest, path) of a card's art at 'size', fetching it into the image store on a miss.
+    Thumbnails are made from the full art with Pillow when it's installed, otherwise
+    YGOPRODeck's own small art is used. Return None if the art can't be fetched; the
+    failure is remembered for a minute."""
+
+    key = f"{card_id}-{size}"
+    stored = image_store.get(key)
+    if stored is not None:
+        return stored
+    if failed_images.get(key):
+        return None
+
+    box = IMAGE_SIZES[size]['box']
+    data = None
+    if box is not None and thumbnails_available():
+        full = fetch_card_image(card_id, 'full')
+        if full is not None:
+            data = make_thumbnail(full[1], box)
+    if data is None:
+        data = download_image(upstream_image_url(card_id, size))
+    if data is None:
+        failed_images.set(key, True)
+        return None
+
+    return image_store.put(key, data)
+
+
+# Function to open a card image for sending
+def open_card_image(card_id, size='full', fetch=True):
+    """Return (digest, open binary file) of a card's art at 'size', or None if it isn't available.
+    Without 'fetch' only art already in the image store is returned. Art that another process
+    evicts between the lookup and the open is fetched again."""
+
+    key = f"{card_id}-{size}"
+    for _ in range(2):
+        stored = fetch_card_image(card_id, size) if fetch else image_store.get(key)
+        if stored is None:
+            return None
+        try:
+            return stored[0], open(stored[1], 'rb')
+        except FileNotFoundError:
+            image_store.discard(key)
+    return None
+
+
+# Function to download an image from upstream
+def download_image(url):
+    """Return the bytes at 'url', or None if it can't be fetched."""
+    try:
+        response = upstream.get(url)
+    except requests.RequestException as error:
+        print(f"Image download failed: {error}")
+        return None
+    if response.status_code != 200:
+        return None
+    return response.content
+
+
+# Function to check for Pillow
+def thumbnails_available():
+    """Return True if Pillow is installed, so thumbnails can be made locally."""
+    return importlib.util.find_spec('PIL') is not None
+
+
+# Function to shrink an image
+def make_thumbnail(path, box):
+    """Return JPEG bytes of the image at 'path' shrunk to fit 'box', or None without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        with Image.open(path) as image:
+            image.thumbnail(box)
+            output = io.BytesIO()
+            image.convert('RGB').save(output, format='JPEG', quality=85)
+            return output.getvalue()
+    except OSError:
+        # Not an image Pillow can read; fall back to the upstream thumbnail
+        return None
@@ -0,0 +1,275 @@
+"""Lightweight request metrics for YGO Deck Builder: SQL statement counts and timings,
+upstream call timings and per-route latency, exposed in Prometheus text format.
+
+Each process keeps its own histograms. When several worker processes serve the app, give
+them a shared directory: each writes a snapshot of its histograms there, and a scrape of
+any worker adds up every snapshot, so one scrape target reports the whole server."""
+
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from sqlalchemy import event
+
+# Seconds between a worker's snapshots in the shared metrics directory
+SNAPSHOT_INTERVAL = 1.0
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """A thread-safe Prometheus-style histogram: cumulative bucket counts, sum and count
+    of observations, kept separately for each combination of label values."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Record one observation of 'value' for the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            # Buckets are stored non-cumulative and summed when rendered
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def reset_after_fork(self):
+        """Forget the parent's observations and take a fresh lock, which the parent may have held at the fork."""
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def snapshot(self):
+        """Return a copy of the series: {label values: [bucket counts..., sum, count]}."""
+        with self._lock:
+            return {values: list(counts) for values, counts in self._series.items()}
+
+    def render(self, series=None):
+        """Return this histogram's lines in Prometheus text format, for 'series' (in snapshot()
+        form) if given, otherwise for this process's observations."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        series = sorted((self.snapshot() if series is None else series).items())
+
+        for values, counts in series:
+            labels = list(zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels + [('le', format_number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labels + [('le', '+Inf')])} {counts[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_number(counts[-2])}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class Metrics:
+    """The process's metrics, plus the counters of the request being served on each thread."""
+
+    def __init__(self):
+        self.enabled = True
+        self.shared_dir = None
+        self._last_snapshot = 0.0
+        self._snapshot_name = f"metrics-{os.getpid()}-{os.urandom(4).hex()}.json"
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', "Time to answer a request, by endpoint, method and status.",
+            labels=('endpoint', 'method', 'status')
+        )
+        self.request_queries = Histogram(
+            'http_request_sql_queries', "SQL statements run while answering a request, by endpoint.",
+            labels=('endpoint',), buckets=QUERY_COUNT_BUCKETS
+        )
+        self.sql_latency = Histogram(
+            'sql_query_duration_seconds', "Time to run a SQL statement, by statement type.",
+            labels=('operation',)
+        )
+        self.upstream_latency = Histogram(
+            'upstream_request_duration_seconds', "Time for an outbound HTTP call, by host and status.",
+            labels=('host', 'status')
+        )
+        self._local = threading.local()
+
+    def histograms(self):
+        return [self.request_latency, self.request_queries, self.sql_latency, self.upstream_latency]
+
+    def configure(self, enabled=None, shared_dir=None):
+        """Turn recording on or off, and/or set the directory worker processes share snapshots in."""
+        if enabled is not None:
+            self.enabled = enabled
+        if shared_dir is not None:
+            self.shared_dir = shared_dir or None
+            if self.shared_dir:
+                os.makedirs(self.shared_dir, exist_ok=True)
+
+    def clear(self):
+        """Forget every observation, including this process's snapshot."""
+        for histogram in self.histograms():
+            histogram.clear()
+        if self.shared_dir:
+            try:
+                os.remove(self._snapshot_path())
+            except FileNotFoundError:
+                pass
+
+    def reset_after_fork(self):
+        """Start a forked worker with no observations of its own, so the parent's aren't counted twice."""
+        for histogram in self.histograms():
+            histogram.reset_after_fork()
+        self._local = threading.local()
+        self._last_snapshot = 0.0
+        # A new name too, so a later worker reusing this pid can't overwrite its snapshot
+        self._snapshot_name = f"metrics-{os.getpid()}-{os.urandom(4).hex()}.json"
+
+    def render(self):
+        """Return every metric in Prometheus text format, summed over every process's
+        snapshot when there is a shared directory."""
+        if not self.shared_dir:
+            series = [None] * len(self.histograms())
+        else:
+            self.write_snapshot()
+            series = self.read_snapshots()
+
+        lines = []
+        for histogram, histogram_series in zip(self.histograms(), series):
+            lines.extend(histogram.render(histogram_series))
+        return "\n".join(lines) + "\n"
+
+    # --- Shared snapshots ---
+    def write_snapshot(self, at_most_every=0):
+        """Write this process's histograms to the shared directory, unless one was written less
+        than 'at_most_every' seconds ago. Written atomically, so readers never see a partial file."""
+        now = time.monotonic()
+        if not self.shared_dir or now - self._last_snapshot < at_most_every:
+            return
+        self._last_snapshot = now
+
+        snapshot = {
+            histogram.name: [[list(values), counts] for values, counts in histogram.snapshot().items()]
+            for histogram in self.histograms()
+        }
+        descriptor, temporary = tempfile.mkstemp(dir=self.shared_dir, suffix='.tmp')
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temporary, self._snapshot_path())
+
+    def read_snapshots(self):
+        """Return every process's snapshot summed, as one series dict per histogram.
+        Snapshots of exited workers are kept, so totals never go backwards while the server runs."""
+        totals = [{} for _ in self.histograms()]
+        for path in glob.glob(os.path.join(self.shared_dir, 'metrics-*.json')):
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for histogram, series in zip(self.histograms(), totals):
+                for values, counts in snapshot.get(histogram.name, []):
+                    current = series.setdefault(tuple(values), [0] * len(counts))
+                    for index, count in enumerate(counts):
+                        current[index] += count
+        return totals
+
+    def _snapshot_path(self):
+        return os.path.join(self.shared_dir, self._snapshot_name)
+
+    # --- Per-request counters ---
+    def start_request(self):
+        """Start counting SQL and upstream work for the request on this thread."""
+        self._local.request = {'started': time.perf_counter(), 'queries': 0, 'sql_seconds': 0.0, 'upstream_calls': 0, 'upstream_seconds': 0.0}
+
+    def finish_request(self, endpoint, method, status):
+        """Record the request on this thread and return its counters, with 'seconds' added, or None if none was started."""
+        current = getattr(self._local, 'request', None)
+        self._local.request = None
+        if current is None:
+            return None
+
+        current['seconds'] = time.perf_counter() - current['started']
+        endpoint = endpoint or 'none'
+        self.request_latency.observe(current['seconds'], endpoint, method, str(status))
+        self.request_queries.observe(current['queries'], endpoint)
+        self.write_snapshot(at_most_every=SNAPSHOT_INTERVAL)
+        return current
+
+    # --- Recording ---
+    def record_query(self, statement, seconds):
+        """Record one SQL statement."""
+        self.sql_latency.observe(seconds, statement_operation(statement))
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current['queries'] += 1
+            current['sql_seconds'] += seconds
+
+    def record_upstream(self, url, status, seconds):
+        """Record one outbound HTTP call. 'status' is the response code, or 'error' if none came back."""
+        if not self.enabled:
+            return
+        self.upstream_latency.observe(seconds, urlsplit(url).hostname or 'unknown', str(status))
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current['upstream_calls'] += 1
+            current['upstream_seconds'] += seconds
+
+    def instrument_engine(self, engine):
+        """Time every statement run through 'engine'."""
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if self.enabled:
+                conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.get('query_started')
+            if started:
+                self.record_query(statement, time.perf_counter() - started.pop())
+
+        @event.listens_for(engine, 'handle_error')
+        def handle_error(context):
+            # A failed statement never reaches after_cursor_execute
+            started = context.connection.info.get('query_started') if context.connection is not None else None
+            if started:
+                started.pop()
+
+
+# Function to name a SQL statement's type
+def statement_operation(statement):
+    """Return the leading keyword of a SQL statement (SELECT, INSERT, ...), which keeps label values few."""
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return keyword if keyword.isalpha() else 'OTHER'
+
+
+# Function to write labels in Prometheus text format
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# Function to write a number in Prometheus text format
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Shared metrics for the whole process
+metrics = Metrics()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=metrics.reset_after_fork)
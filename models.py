@@ -1,11 +1,20 @@
 """SQLAlchemy models for YGO Deck Builder."""
 
+import sqlite3
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import validates
-from flask_bcrypt import Bcrypt
+from sqlalchemy import DDL, event, and_, case, func, inspect, literal, or_, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased, validates, Session
+from passwords import password_hasher
+from images import card_image_path
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
+
+# Dialect INSERT constructs that support ON CONFLICT
+UPSERT_BY_DIALECT = {'postgresql': postgres_insert, 'sqlite': sqlite_insert}
 
 class User(db.Model):
     """A user."""
@@ -26,7 +35,7 @@ class User(db.Model):
     @classmethod
     def register(cls, username, unhash_password, email):
         """Register user with hashed password, return user."""
-        hashed = bcrypt.generate_password_hash(unhash_password).decode("utf8")
+        hashed = password_hasher.hash(unhash_password)
         user = cls(username=username, hash_password=hashed, email=email)
         # db.session.add(user)
         return user
@@ -34,9 +43,13 @@ class User(db.Model):
     @classmethod
     def authenticate(cls, username, unhash_password):
         """Validate that user exists & password is correct.
-        Return user if valid; else return False."""
+        Return user if valid; else return False.
+        Hashes made with an old cost factor are replaced with one at the current cost."""
         user = cls.query.filter_by(username=username).first()
-        if user and bcrypt.check_password_hash(user.hash_password, unhash_password):
+        if user and password_hasher.check(user.hash_password, unhash_password):
+            if password_hasher.needs_rehash(user.hash_password):
+                user.hash_password = password_hasher.hash(unhash_password)
+                db.session.commit()
             return user
         return False
 
@@ -53,6 +66,14 @@ class Deck(db.Model):
     cover_card_url = db.Column(db.String, nullable=False, default="/static/images/placeholder.png")
     # Popular column
     popular = db.Column(db.Boolean, nullable=True)
+    # Total copies in the main and extra deck, kept in step with deck_cards by the DeckCard events below
+    main_deck_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    extra_deck_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Bumped, with updated_at, whenever the deck's cards or its name, description or cover change
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(db.DateTime, nullable=True)
+    # True while some card in the deck has more copies than its banlist limit allows
+    over_limit = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
 
 
@@ -61,15 +82,22 @@ class Deck(db.Model):
     user = db.relationship("User", back_populates="decks")
     deck_cards = db.relationship("DeckCard", back_populates="deck", cascade="all, delete-orphan")    
 
-    # function that returns the total number of cards in the main deck (cards have an extra_deck attribute)
-    @property
-    def main_deck_count(self):
-        return sum([deck_card.quantity for deck_card in self.deck_cards if not deck_card.card.extra_deck])
-    
-    @property
-    # function that returns the total number of cards in the extra deck (cards have an extra_deck attribute)
-    def extra_deck_count(self):
-        return sum([deck_card.quantity for deck_card in self.deck_cards if deck_card.card.extra_deck])
+    @classmethod
+    def recount_all(cls):
+        """Recompute main_deck_count, extra_deck_count and over_limit for every deck in one
+        UPDATE, bumping each version. Return the number of decks updated."""
+
+        result = db.session.execute(
+            db.update(cls).values(
+                main_deck_count=deck_copies(cls.id, False),
+                extra_deck_count=deck_copies(cls.id, True),
+                over_limit=deck_is_over_limit(cls.id),
+                version=cls.version + 1
+            ),
+            execution_options={"synchronize_session": False}
+        )
+        db.session.commit()
+        return result.rowcount
     
     
 
@@ -77,6 +105,8 @@ class Card(db.Model):
     """A card."""
 
     __tablename__ = "cards"
+    # Search results are paged by (name, id), so a page is an index range scan
+    __table_args__ = (db.Index('ix_cards_name_id', 'name', 'id'),)
 
     # Columns
     id = db.Column(db.Integer, primary_key=True)
@@ -91,18 +121,68 @@ class Card(db.Model):
     img_url = db.Column(db.String, nullable=False)
     limit = db.Column(db.Integer, nullable=False, default=3)
     extra_deck = db.Column(db.Boolean, nullable=False) # True if card is in extra deck
+    refreshed_at = db.Column(db.DateTime, nullable=True) # Last time the card was fetched from the API
 
     # Relationships
     deck_cards = db.relationship("DeckCard", back_populates="card", cascade="all, delete-orphan")
 
+    @property
+    def img_url_small(self):
+        """Small artwork URL, following the YGOPRODeck image layout."""
+        return self.img_url.replace('/images/cards/', '/images/cards_small/')
+
+    @property
+    def local_img_url(self):
+        """Artwork URL on our own image cache route."""
+        return card_image_path(self.id, 'full')
+
+    @property
+    def local_img_url_small(self):
+        """Small artwork URL on our own image cache route."""
+        return card_image_path(self.id, 'small')
+
+    def to_api_dict(self):
+        """Serialize the card in the same shape the YGOPRODeck API returns it."""
+        card = {
+            'id': self.id,
+            'name': self.name,
+            'type': self.type,
+            'desc': self.description or '',
+            'race': self.race,
+            'card_images': [{
+                'id': self.id,
+                'image_url': self.local_img_url,
+                'image_url_small': self.local_img_url_small
+            }]
+        }
+
+        # The API omits stats that don't apply to the card (e.g. ATK on spells)
+        for key, value in (('attribute', self.attribute), ('level', self.level), ('atk', self.attack), ('def', self.defense)):
+            if value is not None:
+                card[key] = value
+
+        return card
+
+class CardArtwork(db.Model):
+    """An alternate artwork passcode, which names the same card as its main id. Stored so deck
+    lists and lookups using it resolve to the card without the API."""
+
+    __tablename__ = "card_artworks"
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True)
+    card_id = db.Column(db.Integer, db.ForeignKey("cards.id", ondelete="CASCADE"), nullable=False, index=True)
+
 class DeckCard(db.Model):
     """A card in a deck."""
 
     __tablename__ = "deck_cards"
 
     # Columns
-    deck_id = db.Column(db.Integer, db.ForeignKey("decks.id"), primary_key=True)
-    card_id = db.Column(db.Integer, db.ForeignKey("cards.id"), primary_key=True)
+    # Deleting a deck deletes its cards in the database, so bulk deletes needn't load them
+    deck_id = db.Column(db.Integer, db.ForeignKey("decks.id", ondelete="CASCADE"), primary_key=True)
+    # Indexed so the decks holding a card are found without scanning every deck
+    card_id = db.Column(db.Integer, db.ForeignKey("cards.id"), primary_key=True, index=True)
     quantity = db.Column(db.Integer, nullable=False)
 
     # Relationships
@@ -111,17 +191,297 @@ class DeckCard(db.Model):
 
     @validates('quantity')
     def validate_quantity(self, key, quantity):
-        """Validate that quantity does not exceed card limit"""
+        """Validate that quantity does not exceed card limit.
+        Lowering the quantity is always allowed, so decks left over a new banlist limit can be fixed."""
         if self.card is None:
             card = Card.query.get(self.card_id)
         else:
             card = self.card
         if card is None:
             raise ValueError("Card does not exist.")
-        if quantity > card.limit or quantity > 3 or quantity < 0:
+        lowered = self.quantity is not None and 0 <= quantity < self.quantity
+        if (quantity > card.limit and not lowered) or quantity > 3 or quantity < 0:
             raise ValueError(f"Invalid quantity. {card.name} quantity must be between 0 and {min(card.limit, 3)}.")
         return quantity
 
+class CatalogSync(db.Model):
+    """A completed bulk sync of the card catalog into the cards table."""
+
+    __tablename__ = "catalog_syncs"
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    synced_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    source = db.Column(db.String, nullable=False)
+    card_count = db.Column(db.Integer, nullable=False)
+
+
+class PopularDeck(db.Model):
+    """A deck in the materialized popular decks feed, rebuilt by refresh_popular_decks."""
+
+    __tablename__ = "popular_decks"
+
+    # Columns
+    rank = db.Column(db.Integer, primary_key=True)
+    deck_id = db.Column(db.Integer, db.ForeignKey("decks.id", ondelete="CASCADE"), nullable=False)
+    refreshed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Relationships
+    deck = db.relationship("Deck")
+
+class CardPair(db.Model):
+    """How many decks hold both card_a and card_b: one entry of the sparse, symmetric card
+    co-occurrence matrix behind deck suggestions. Both (a, b) and (b, a) are stored, so a
+    deck's row of the matrix is one index range on card_a."""
+
+    __tablename__ = "card_pairs"
+
+    # Columns
+    card_a = db.Column(db.Integer, db.ForeignKey("cards.id", ondelete="CASCADE"), primary_key=True)
+    card_b = db.Column(db.Integer, db.ForeignKey("cards.id", ondelete="CASCADE"), primary_key=True)
+    decks = db.Column(db.Integer, nullable=False, default=0)
+
+# --- EMPTY DECK CARD REMOVAL ---
+# A deck card whose quantity is lowered to zero is deleted by a trigger in the same
+# statement, so taking the last copy out of a deck is one UPDATE.
+
+DECK_CARD_DDL_BY_DIALECT = {
+    'sqlite': [
+        """CREATE TRIGGER IF NOT EXISTS deck_cards_drop_empty AFTER UPDATE OF quantity ON deck_cards
+        WHEN new.quantity <= 0 BEGIN
+            DELETE FROM deck_cards WHERE deck_id = new.deck_id AND card_id = new.card_id;
+        END"""
+    ],
+    'postgresql': [
+        """CREATE OR REPLACE FUNCTION deck_cards_drop_empty() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM deck_cards WHERE deck_id = NEW.deck_id AND card_id = NEW.card_id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE TRIGGER deck_cards_drop_empty AFTER UPDATE OF quantity ON deck_cards
+        FOR EACH ROW WHEN (NEW.quantity <= 0) EXECUTE FUNCTION deck_cards_drop_empty()"""
+    ]
+}
+
+# Create the trigger whenever db.create_all() creates the deck_cards table
+for dialect, statements in DECK_CARD_DDL_BY_DIALECT.items():
+    for statement in statements:
+        event.listen(DeckCard.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect))
+
+def install_deck_card_triggers():
+    """Create (or replace) the deck_cards triggers for the current database, for tables created
+    before they existed. Safe to run repeatedly."""
+    for statement in DECK_CARD_DDL_BY_DIALECT.get(db.session.get_bind().dialect.name, []):
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+# --- DECK COUNTER MAINTENANCE ---
+# Every DeckCard insert, update and delete adjusts its deck's main/extra counters,
+# rechecks its over_limit flag and bumps its version in the same transaction, so
+# limit checks never have to sum deck_cards and caches can key on the version.
+
+def deck_is_over_limit(deck_id):
+    """Return a SQL expression that is true if the deck with id 'deck_id' (a column or value)
+    holds more copies of some card than the card's limit."""
+    deck_cards, cards = DeckCard.__table__, Card.__table__
+    return (
+        select(deck_cards.c.deck_id)
+        .join(cards, cards.c.id == deck_cards.c.card_id)
+        .where(deck_cards.c.deck_id == deck_id, deck_cards.c.quantity > cards.c.limit)
+        .exists()
+    )
+
+def deck_copies(deck_id, extra_deck):
+    """Return a SQL expression for the copies of main deck cards, or extra deck cards if
+    'extra_deck', in the deck with id 'deck_id' (a column or value)."""
+    return (
+        select(func.coalesce(func.sum(DeckCard.quantity), 0))
+        .join(Card, Card.id == DeckCard.card_id)
+        .where(DeckCard.deck_id == deck_id, Card.extra_deck == extra_deck)
+        .scalar_subquery()
+    )
+
+def adjust_deck_counts(connection, deck_id, card_id, delta):
+    """Add 'delta' copies of a card to the right counter of a deck, recheck its over_limit flag
+    and bump its version in one UPDATE."""
+    if not delta:
+        return
+
+    decks = Deck.__table__
+    is_extra = select(Card.extra_deck).where(Card.id == card_id).scalar_subquery()
+    connection.execute(
+        decks.update()
+        .where(decks.c.id == deck_id)
+        .values(
+            main_deck_count=decks.c.main_deck_count + case((is_extra, 0), else_=delta),
+            extra_deck_count=decks.c.extra_deck_count + case((is_extra, delta), else_=0),
+            over_limit=deck_is_over_limit(decks.c.id),
+            version=decks.c.version + 1,
+            updated_at=datetime.utcnow()
+        )
+    )
+
+def stored_quantity(deck_card):
+    """Return the quantity currently stored in the database for 'deck_card'."""
+    history = inspect(deck_card).attrs.quantity.history
+    return history.deleted[0] if history.deleted else deck_card.quantity
+
+def mark_deck_changed(deck_card):
+    """Remember that the deck's counters changed during this flush."""
+    inspect(deck_card).session.info.setdefault("changed_deck_ids", set()).add(deck_card.deck_id)
+
+def mark_pair_change(deck_card, kind):
+    """Remember that a card was 'added' to or 'removed' from a deck during this flush."""
+    changes = inspect(deck_card).session.info.setdefault("card_pair_changes", {})
+    changes.setdefault(deck_card.deck_id, {'added': set(), 'removed': set()})[kind].add(deck_card.card_id)
+
+@event.listens_for(DeckCard, "after_insert")
+def count_inserted_deck_card(mapper, connection, deck_card):
+    adjust_deck_counts(connection, deck_card.deck_id, deck_card.card_id, deck_card.quantity)
+    mark_deck_changed(deck_card)
+    mark_pair_change(deck_card, 'added')
+
+@event.listens_for(DeckCard, "after_update")
+def count_updated_deck_card(mapper, connection, deck_card):
+    history = inspect(deck_card).attrs.quantity.history
+    if history.deleted:
+        adjust_deck_counts(connection, deck_card.deck_id, deck_card.card_id, deck_card.quantity - history.deleted[0])
+        mark_deck_changed(deck_card)
+
+@event.listens_for(DeckCard, "after_delete")
+def count_deleted_deck_card(mapper, connection, deck_card):
+    adjust_deck_counts(connection, deck_card.deck_id, deck_card.card_id, -stored_quantity(deck_card))
+    mark_deck_changed(deck_card)
+    mark_pair_change(deck_card, 'removed')
+
+@event.listens_for(Deck, "before_update")
+def bump_edited_deck_version(mapper, connection, deck):
+    """Bump the version when the deck's own details change, so caches keyed on it see renames and new covers."""
+    state = inspect(deck)
+    if any(state.attrs[name].history.has_changes() for name in ("name", "description", "cover_card_url")):
+        deck.version = Deck.version + 1
+        deck.updated_at = datetime.utcnow()
+
+@event.listens_for(Session, "after_flush_postexec")
+def expire_changed_deck_counts(session, flush_context):
+    """Expire the counters of loaded decks changed in this flush so they reload from the database."""
+    for deck_id in session.info.pop("changed_deck_ids", ()):
+        deck = session.identity_map.get(inspect(Deck).identity_key_from_primary_key((deck_id,)))
+        if deck is not None:
+            session.expire(deck, ["main_deck_count", "extra_deck_count", "over_limit", "version", "updated_at"])
+
+
+# --- CARD CO-OCCURRENCE MAINTENANCE ---
+# Cards added to or removed from a deck during a flush adjust the card_pairs counts
+# between them and the deck's other cards before the flush ends, so the matrix is
+# kept current incrementally instead of being rebuilt (`flask rebuild-card-pairs`).
+# Staple pairs are shared by many decks, so every statement touches card_pairs rows in
+# (card_a, card_b) order: concurrent edits then lock overlapping rows in the same order
+# and wait for each other instead of deadlocking.
+
+def deck_pairs(members, changed):
+    """Return every ordered pair of distinct cards in 'members' that involves a 'changed' card, sorted."""
+    return sorted((a, b) for a in members for b in members if a != b and (a in changed or b in changed))
+
+def lock_card_pairs(session, *criteria):
+    """Lock the card_pairs rows matching 'criteria' in (card_a, card_b) order, ahead of an UPDATE
+    whose own lock order the database chooses. A no-op on SQLite, which locks the whole database."""
+    if session.get_bind().dialect.name == 'sqlite':
+        return
+    session.execute(select(CardPair.card_a).where(*criteria).order_by(CardPair.card_a, CardPair.card_b).with_for_update())
+
+def adjust_card_pairs(session, members, changed, delta):
+    """Add 'delta' to the co-occurrence count of every pair of 'members' involving a 'changed' card."""
+    pairs = deck_pairs(members, changed)
+    if not pairs:
+        return
+    members, changed = sorted(members), sorted(changed)
+
+    pair_filter = (
+        CardPair.card_a.in_(members), CardPair.card_b.in_(members), CardPair.card_a != CardPair.card_b,
+        or_(CardPair.card_a.in_(changed), CardPair.card_b.in_(changed))
+    )
+
+    if delta < 0:
+        lock_card_pairs(session, *pair_filter)
+        session.execute(db.update(CardPair).where(*pair_filter).values(decks=CardPair.decks + delta), execution_options={"synchronize_session": False})
+        session.execute(db.delete(CardPair).where(*pair_filter, CardPair.decks <= 0), execution_options={"synchronize_session": False})
+        return
+
+    rows = [{'card_a': a, 'card_b': b, 'decks': delta} for a, b in pairs]
+    upsert = UPSERT_BY_DIALECT.get(session.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(CardPair)
+        stmt = stmt.on_conflict_do_update(index_elements=[CardPair.card_a, CardPair.card_b], set_={'decks': CardPair.decks + stmt.excluded.decks})
+        session.execute(stmt, rows)
+    else:
+        existing = set(session.execute(select(CardPair.card_a, CardPair.card_b).where(*pair_filter)))
+        lock_card_pairs(session, *pair_filter)
+        session.execute(db.update(CardPair).where(*pair_filter).values(decks=CardPair.decks + delta), execution_options={"synchronize_session": False})
+        new_rows = [row for row in rows if (row['card_a'], row['card_b']) not in existing]
+        if new_rows:
+            session.execute(db.insert(CardPair), new_rows)
+
+def release_deck_pairs(session, deck_id):
+    """Take every pair of a deck's cards out of the co-occurrence counts in two statements.
+    Call before deleting the deck's cards in bulk, which skips the DeckCard events."""
+    in_deck = select(DeckCard.card_id).where(DeckCard.deck_id == deck_id)
+    pair_filter = (CardPair.card_a.in_(in_deck), CardPair.card_b.in_(in_deck))
+    lock_card_pairs(session, *pair_filter)
+    session.execute(db.update(CardPair).where(*pair_filter).values(decks=CardPair.decks - 1), execution_options={"synchronize_session": False})
+    session.execute(db.delete(CardPair).where(*pair_filter, CardPair.decks <= 0), execution_options={"synchronize_session": False})
+
+def claim_deck_pairs(session, deck_id):
+    """Count every pair of a deck's cards in the co-occurrence counts with one INSERT ... SELECT.
+    Call after inserting the deck's cards in bulk, which skips the DeckCard events."""
+    first, second = aliased(DeckCard), aliased(DeckCard)
+    pairs = (
+        select(first.card_id, second.card_id, literal(1))
+        .join(second, and_(second.deck_id == first.deck_id, second.card_id != first.card_id))
+        .where(first.deck_id == deck_id)
+        .order_by(first.card_id, second.card_id)
+    )
+
+    upsert = UPSERT_BY_DIALECT.get(session.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(CardPair).from_select(['card_a', 'card_b', 'decks'], pairs)
+        session.execute(stmt.on_conflict_do_update(index_elements=[CardPair.card_a, CardPair.card_b], set_={'decks': CardPair.decks + stmt.excluded.decks}))
+    else:
+        in_deck = select(DeckCard.card_id).where(DeckCard.deck_id == deck_id)
+        lock_card_pairs(session, CardPair.card_a.in_(in_deck), CardPair.card_b.in_(in_deck))
+        session.execute(
+            db.update(CardPair).where(CardPair.card_a.in_(in_deck), CardPair.card_b.in_(in_deck)).values(decks=CardPair.decks + 1),
+            execution_options={"synchronize_session": False}
+        )
+        stored = select(CardPair.card_a).where(CardPair.card_a == first.card_id, CardPair.card_b == second.card_id).exists()
+        session.execute(db.insert(CardPair).from_select(['card_a', 'card_b', 'decks'], pairs.where(~stored)))
+
+@event.listens_for(Session, "after_flush")
+def update_card_pairs(session, flush_context):
+    """Apply the flush's deck card additions and removals to the co-occurrence counts."""
+    for deck_id, changes in session.info.pop("card_pair_changes", {}).items():
+        # A card removed and added back in one flush is still in the deck
+        added, removed = changes['added'] - changes['removed'], changes['removed'] - changes['added']
+        if not added and not removed:
+            continue
+
+        current = set(session.scalars(select(DeckCard.card_id).where(DeckCard.deck_id == deck_id)))
+        if removed:
+            adjust_card_pairs(session, (current - added) | removed, removed, -1)
+        if added:
+            adjust_card_pairs(session, current, added, 1)
+
+
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked on each connection."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 
 # Function to connect to the database
 def connect_db(app):
@@ -0,0 +1,138 @@
+"""Opening hand odds for a deck: exact hypergeometric probabilities of drawing cards, and a
+NumPy Monte Carlo estimate for hands that must meet several conditions at once.
+
+Decks are passed as a composition: a sorted tuple of (card_id, copies) for the main deck,
+so results can be memoized and shared by every deck with the same cards."""
+
+import importlib.util
+from functools import lru_cache
+
+# Opening hands going first and going second
+HAND_SIZES = (5, 6)
+
+# Bounds on Monte Carlo trials per query. The endpoint is public, so the cap keeps a
+# query's shuffled decks to a couple of megabytes
+DEFAULT_TRIALS = 20000
+MAX_TRIALS = 20000
+
+# Monte Carlo seed, fixed so estimates are repeatable and every caller shares the memoized result
+SIMULATION_SEED = 0
+
+class OddsUnavailable(Exception):
+    """Raised when NumPy isn't installed."""
+
+
+# Function to check for NumPy
+def odds_available():
+    """Return True if NumPy is installed, so odds can be computed."""
+    return importlib.util.find_spec('numpy') is not None
+
+
+# Function to import NumPy on first use
+def require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise OddsUnavailable("Deck odds need NumPy, which is not installed.")
+    return numpy
+
+
+@lru_cache(maxsize=64)
+def comb_table(size):
+    """Return a read-only (size + 1) x (size + 1) array where [n, r] is n choose r (0 when r > n)."""
+    np = require_numpy()
+    table = np.zeros((size + 1, size + 1))
+    table[:, 0] = 1
+    for n in range(1, size + 1):
+        table[n, 1:] = table[n - 1, 1:] + table[n - 1, :-1]
+    table.flags.writeable = False
+    return table
+
+
+# Function to validate a card count
+def check_at_least(at_least):
+    """Raise ValueError unless a hand can hold 'at_least' cards (1 up to the largest hand size)."""
+    if not 1 <= at_least <= max(HAND_SIZES):
+        raise ValueError(f"at_least must be between 1 and {max(HAND_SIZES)}.")
+
+
+# Function to compute hypergeometric odds for many card groups at once
+def at_least_odds(copies, deck_size, at_least=1, hand_sizes=HAND_SIZES):
+    """Return an array of shape (len(copies), len(hand_sizes)) with the chance that a hand of
+    each size holds at least 'at_least' of a group of cards with that many copies in the deck.
+    Every group and hand size is evaluated in one vectorized pass. Raise ValueError if
+    'at_least' is out of range."""
+
+    check_at_least(at_least)
+    np = require_numpy()
+    comb = comb_table(deck_size)
+
+    successes = np.asarray(copies, dtype=int)[:, None, None]
+    # A deck smaller than the hand is drawn whole
+    draws = np.minimum(hand_sizes, deck_size)[None, :, None]
+    drawn = np.arange(at_least)[None, None, :]
+
+    # P(X < at_least) = sum over i < at_least of C(K, i) C(N - K, n - i) / C(N, n)
+    misses = draws - drawn
+    below = comb[successes, drawn] * comb[deck_size - successes, np.clip(misses, 0, None)] * (misses >= 0)
+    probabilities = 1 - below.sum(axis=2) / comb[deck_size, draws[:, :, 0]]
+    return np.clip(probabilities, 0, 1)
+
+
+@lru_cache(maxsize=1024)
+def deck_odds(composition, chosen=(), at_least=1):
+    """Return the exact opening hand odds for a deck composition: the chance of drawing at least
+    one copy of each card, and, if 'chosen' card ids are given, of drawing at least 'at_least'
+    cards from that set. Memoized by composition. Raise ValueError if 'at_least' is out of range."""
+
+    check_at_least(at_least)
+    deck_size = sum(copies for _, copies in composition)
+    copies = [count for _, count in composition]
+    result = {'deck_size': deck_size, 'hand_sizes': list(HAND_SIZES), 'cards': []}
+    if not deck_size:
+        return result
+
+    for (card_id, count), odds in zip(composition, at_least_odds(copies, deck_size).tolist()):
+        result['cards'].append({'id': card_id, 'copies': count, 'odds': dict(zip(map(str, HAND_SIZES), odds))})
+
+    if chosen:
+        chosen_copies = sum(count for card_id, count in composition if card_id in chosen)
+        odds = at_least_odds([chosen_copies], deck_size, at_least)[0].tolist()
+        result['set'] = {'card_ids': sorted(chosen), 'copies': chosen_copies, 'at_least': at_least, 'odds': dict(zip(map(str, HAND_SIZES), odds))}
+
+    return result
+
+
+@lru_cache(maxsize=256)
+def simulate_hands(composition, conditions, trials=DEFAULT_TRIALS):
+    """Estimate the chance that an opening hand meets every condition by dealing 'trials' shuffled
+    hands with NumPy. 'conditions' is a tuple of (card id tuple, at least) pairs: the hand needs at
+    least that many cards from each group. Seeded with SIMULATION_SEED, so results are repeatable
+    and memoizable. Raise ValueError if a condition's count or 'trials' is out of range."""
+
+    for _, at_least in conditions:
+        check_at_least(at_least)
+    if not 1 <= trials <= MAX_TRIALS:
+        raise ValueError(f"trials must be between 1 and {MAX_TRIALS}.")
+
+    np = require_numpy()
+    deck = np.repeat(np.array([card_id for card_id, _ in composition]), [copies for _, copies in composition])
+    result = {'deck_size': len(deck), 'hand_sizes': list(HAND_SIZES), 'trials': trials, 'seed': SIMULATION_SEED}
+    if len(deck) < max(HAND_SIZES):
+        raise ValueError(f"The main deck needs at least {max(HAND_SIZES)} cards.")
+
+    # Shuffle every trial's deck positions at once, in the smallest dtype that holds them,
+    # then look up the cards of the largest hand
+    rng = np.random.default_rng(SIMULATION_SEED)
+    positions = np.arange(len(deck), dtype=np.min_scalar_type(len(deck)))
+    hands = deck[rng.permuted(np.tile(positions, (trials, 1)), axis=1)[:, :max(HAND_SIZES)]]
+
+    met = np.ones((trials, len(HAND_SIZES)), dtype=bool)
+    for card_ids, at_least in conditions:
+        # Running count of the group's cards through the hand, read off at each hand size
+        drawn = np.isin(hands, card_ids).cumsum(axis=1)[:, [size - 1 for size in HAND_SIZES]]
+        met &= drawn >= at_least
+
+    result['conditions'] = [{'card_ids': list(card_ids), 'at_least': at_least} for card_ids, at_least in conditions]
+    result['odds'] = dict(zip(map(str, HAND_SIZES), met.mean(axis=0).tolist()))
+    return result
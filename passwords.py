@@ -0,0 +1,136 @@
+"""Password hashing on a bounded thread pool, so bcrypt work can't pile up behind request workers."""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+class PasswordHasherBusy(Exception):
+    """Raised when every hashing thread is busy and the wait queue is full."""
+
+class ProcessSlots:
+    """A non-blocking semaphore shared by every process on the machine: 'count' lock files in
+    'directory', each held with flock by at most one caller. Locks are released by the kernel
+    if the holder dies, so a killed worker can't leak a slot."""
+
+    def __init__(self, directory, count):
+        if fcntl is None:
+            raise RuntimeError("Shared hashing slots need fcntl, which this platform lacks.")
+        os.makedirs(directory, exist_ok=True)
+        self.paths = [os.path.join(directory, f"bcrypt-slot-{slot}.lock") for slot in range(count)]
+
+    def acquire(self):
+        """Take a free slot and return its file descriptor, or None if every slot is taken."""
+        for path in self.paths:
+            descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return descriptor
+            except BlockingIOError:
+                os.close(descriptor)
+        return None
+
+    def release(self, descriptor):
+        """Give back a slot taken by acquire()."""
+        fcntl.flock(descriptor, fcntl.LOCK_UN)
+        os.close(descriptor)
+
+
+class PasswordHasher:
+    """Runs bcrypt hashes and checks on a small thread pool. At most 'max_workers' hashes
+    run at once and 'max_pending' more may wait; beyond that calls fail fast with
+    PasswordHasherBusy instead of queueing. 'rounds' is the bcrypt cost factor for new hashes.
+
+    Those bounds are per process. Under a pre-fork server with single-threaded workers
+    (gunicorn's default sync workers) a process never has more than one hash in flight, so
+    set 'lock_dir' to a directory every worker shares: at most 'max_workers' hashes then run
+    across all of them, and logins past that answer 503 at once instead of pinning workers
+    (a sync worker has no way to wait without being pinned, so max_pending doesn't apply)."""
+
+    def __init__(self, rounds=12, max_workers=2, max_pending=8, lock_dir=None):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.lock_dir = lock_dir
+        self._executor = None
+        self._slots = None
+        self._shared_slots = None
+        self._lock = threading.Lock()
+
+    def configure(self, **settings):
+        """Update settings (rounds, max_workers, max_pending, lock_dir). Pool size changes apply to the next pool."""
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise TypeError(f"Unknown hasher setting '{name}'.")
+            setattr(self, name, value)
+        self.shutdown()
+
+    def hash(self, password):
+        """Return a bcrypt hash of 'password' at the configured cost, as text."""
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, hashed, password):
+        """Return True if 'password' matches the bcrypt hash 'hashed'."""
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """Return True if 'hashed' was made with a different cost than the configured one."""
+        # bcrypt hashes look like $2b$12$<salt and hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        """Stop the pool after running hashes finish."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._slots = None
+            self._shared_slots = None
+
+    def _forget_pool(self):
+        """Drop the pool without waiting on it. A forked worker inherits the pool but not its
+        threads, so it must start its own."""
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._shared_slots = None
+
+    def _run(self, function, *args):
+        """Run 'function' on the pool and wait for it, or raise PasswordHasherBusy if the pool is saturated."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+                self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+                if self.lock_dir:
+                    self._shared_slots = ProcessSlots(self.lock_dir, self.max_workers)
+            executor, slots, shared_slots = self._executor, self._slots, self._shared_slots
+
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many logins in progress, try again shortly.")
+        shared_slot = None
+        try:
+            if shared_slots is not None:
+                shared_slot = shared_slots.acquire()
+                if shared_slot is None:
+                    raise PasswordHasherBusy("Too many logins in progress, try again shortly.")
+            return executor.submit(function, *args).result()
+        finally:
+            if shared_slot is not None:
+                shared_slots.release(shared_slot)
+            slots.release()
+
+
+# Shared hasher for the whole process
+password_hasher = PasswordHasher()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=password_hasher._forget_pool)
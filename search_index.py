@@ -0,0 +1,169 @@
+"""Full-text and substring search over card names and effect text.
+
+SQLite uses an FTS5 trigram index kept in sync with the cards table by triggers.
+Postgres uses pg_trgm GIN indexes for substring matching and a tsvector GIN index
+for effect text. Other databases fall back to unindexed ILIKE scans.
+
+Searches too short for trigrams match the start of card names instead, read in name
+order straight off a case-insensitive (name, id) index on SQLite and Postgres."""
+
+from sqlalchemy import DDL, Float, cast, event, func, literal, literal_column, or_, select, table, column, text
+from models import db, Card
+
+# --- INDEX DDL ---
+
+SQLITE_DDL = [
+    # External content table: the text lives in cards, the index in cards_fts
+    """CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+        name, description, content='cards', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS cards_fts_insert AFTER INSERT ON cards BEGIN
+        INSERT INTO cards_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cards_fts_delete AFTER DELETE ON cards BEGIN
+        INSERT INTO cards_fts(cards_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS cards_fts_update AFTER UPDATE OF name, description ON cards BEGIN
+        INSERT INTO cards_fts(cards_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO cards_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    # Index any rows that were already in cards
+    "INSERT INTO cards_fts(cards_fts) VALUES ('rebuild')",
+    # Case-insensitive name prefixes, for searches too short for trigrams
+    "CREATE INDEX IF NOT EXISTS ix_cards_name_nocase ON cards (name COLLATE NOCASE, id)"
+]
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_cards_name_trgm ON cards USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_cards_description_trgm ON cards USING gin (description gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_cards_document ON cards USING gin (to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, '')))",
+    'CREATE INDEX IF NOT EXISTS ix_cards_name_prefix ON cards ((lower(name) COLLATE "C"), id)'
+]
+
+DDL_BY_DIALECT = {'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL}
+
+# Create the index whenever db.create_all() creates the cards table
+for dialect, statements in DDL_BY_DIALECT.items():
+    for statement in statements:
+        event.listen(Card.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect))
+
+# The FTS table isn't part of the metadata, so drop it along with cards
+event.listen(Card.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS cards_fts").execute_if(dialect='sqlite'))
+
+
+def build_search_index():
+    """Create (or rebuild) the search index for the current database. Safe to run repeatedly."""
+    dialect = db.session.get_bind().dialect.name
+    for statement in DDL_BY_DIALECT.get(dialect, []):
+        db.session.execute(text(statement))
+    db.session.commit()
+    return dialect
+
+
+# --- QUERIES ---
+
+# The SQLite FTS table, for joins
+cards_fts = table('cards_fts', column('rowid'))
+
+# Must match the expression of ix_cards_document exactly for Postgres to use the index
+POSTGRES_DOCUMENT = literal_column("to_tsvector('english', coalesce(cards.name, '') || ' ' || coalesce(cards.description, ''))")
+
+# Trigrams need at least three characters
+MIN_INDEXED_LENGTH = 3
+
+# Effect text matches are ranked by bm25 only when there are at most this many; scoring
+# more costs more than it tells apart, so larger sets are ranked by name alone
+MAX_RANKED_TEXT_MATCHES = 500
+
+# Sorts after every string that starts with a given prefix
+PREFIX_END = '\U0010ffff'
+
+# Must match the expressions of ix_cards_name_nocase and ix_cards_name_prefix for the indexes to be used
+PREFIX_KEYS = {
+    'sqlite': lambda search: (Card.name.collate('NOCASE'), search),
+    'postgresql': lambda search: (func.lower(Card.name).collate('C'), search.lower())
+}
+
+
+def filter_cards_by_text(query, search, search_text=False):
+    """Filter a Card query to cards whose name contains 'search', or whose name or effect
+    text matches it if 'search_text'. Return the filtered query and its ranking ORDER BY:
+    exact name matches, then names starting with 'search', then other name matches
+    (ahead of effect-text-only matches), then text relevance, then name.
+    Searches shorter than MIN_INDEXED_LENGTH match the start of names only, in name order."""
+
+    dialect = db.session.get_bind().dialect.name
+    search = search.strip()
+
+    if len(search) < MIN_INDEXED_LENGTH and dialect in PREFIX_KEYS:
+        # A range scan of the prefix index, which also yields the rows in page order
+        key, prefix = PREFIX_KEYS[dialect](search)
+        query = query.filter(key >= prefix, key < prefix + PREFIX_END)
+        return query, [(key, False), (Card.id, False)]
+
+    if dialect == 'sqlite':
+        # SQLite's LIKE already ignores ASCII case, and lower() on every row is much slower
+        name_match = Card.name.contains(search, autoescape=True)
+        sort_keys = [
+            (Card.name.collate('NOCASE') == search, True),
+            (Card.name.startswith(search, autoescape=True), True)
+        ]
+    else:
+        name_match = Card.name.icontains(search, autoescape=True)
+        sort_keys = [
+            (func.lower(Card.name) == search.lower(), True),
+            (Card.name.istartswith(search, autoescape=True), True)
+        ]
+    if search_text:
+        sort_keys.append((name_match, True))
+
+    if dialect == 'sqlite' and len(search) >= MIN_INDEXED_LENGTH:
+        # Quote the search as an FTS5 phrase, restricted to the name column unless searching text
+        phrase = '"' + search.replace('"', '""') + '"'
+        fts_query = phrase if search_text else f"name : {phrase}"
+
+        # bm25() only works directly against the FTS table, so score the matches in a
+        # subquery, weighting name hits above effect text hits
+        matches = (
+            select(cards_fts.c.rowid.label('card_id'), func.bm25(literal_column('cards_fts'), 10.0, 1.0).label('score'))
+            .where(text("cards_fts MATCH :fts_query").bindparams(fts_query=fts_query))
+            .subquery()
+        )
+        query = query.join(matches, matches.c.card_id == Card.id)
+        if search_text:
+            # Same number of sort keys either way, so page cursors stay valid
+            sort_keys.append((matches.c.score if text_match_count(fts_query) <= MAX_RANKED_TEXT_MATCHES else literal(0.0), False))
+
+    elif dialect == 'postgresql':
+        if search_text:
+            tsquery = func.websearch_to_tsquery('english', search)
+            query = query.filter(or_(
+                name_match,
+                POSTGRES_DOCUMENT.op('@@')(tsquery),
+                Card.description.icontains(search, autoescape=True)
+            ))
+            sort_keys.append((ranking(func.ts_rank(POSTGRES_DOCUMENT, tsquery)), True))
+        else:
+            query = query.filter(name_match)
+        sort_keys.append((ranking(func.similarity(Card.name, search)), True))
+
+    else:
+        if search_text:
+            description_match = (Card.description.contains if dialect == 'sqlite' else Card.description.icontains)(search, autoescape=True)
+            query = query.filter(or_(name_match, description_match))
+        else:
+            query = query.filter(name_match)
+
+    return query, sort_keys + [(Card.name, False), (Card.id, False)]
+
+
+def text_match_count(fts_query):
+    """Return how many cards match an FTS5 query, which the index answers without scoring them."""
+    return db.session.execute(text("SELECT count(*) FROM cards_fts WHERE cards_fts MATCH :fts_query"), {'fts_query': fts_query}).scalar()
+
+
+def ranking(score):
+    """Widen a Postgres real score to double precision, so the value a page cursor carries
+    compares equal to the score it was read from."""
+    return cast(score, Float(precision=53))
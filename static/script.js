@@ -6,80 +6,75 @@ function getDeckIdFromUrl() {
 }
 
 
-// FUNCTION to FETCH the deck's cards and UPDATE THE MAIN DECK GRID
-async function updateMainDeckGrid(deckId) {
+// FUNCTION to FILL a deck grid with the given cards
+function fillDeckGrid(prefix, size, deckCards) {
+    // Reset the grid
+    for (let i = 1; i <= size; i++) {
+        const cardImg = document.getElementById(`${prefix}-card-img-${i}`);
+        cardImg.src = '/static/images/placeholder.png';
+        cardImg.parentElement.dataset.cardDescription = '';
+        delete cardImg.parentElement.dataset.cardId;
+        delete cardImg.parentElement.dataset.cardImage;
+    }
+
+    // Update the grid with deck's cards
+    let cardIndex = 0;
+    deckCards.forEach(card => {
+        for (let i = 0; i < card.quantity && cardIndex < size; i++) {
+            const cardImg = document.getElementById(`${prefix}-card-img-${cardIndex + 1}`);
+            cardImg.src = card.img_url;
+            cardImg.parentElement.dataset.cardDescription = card.card_desc;
+            cardImg.parentElement.dataset.cardId = card.id;
+            cardImg.parentElement.dataset.cardImage = card.img_url_full;
+            cardIndex++;
+        }
+    });
+}
+
+// FUNCTION to FETCH the deck's cards once and UPDATE THE MAIN AND EXTRA DECK GRIDS
+async function updateDeckGrids(deckId) {
     try {
-        const response = await fetch(`/api/decks/${deckId}/cards`);
+        // The server answers 304 when the deck is unchanged and the browser reuses its cached copy
+        const response = await fetch(`/api/decks/${deckId}/cards?split=1`);
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
 
         const deckCards = await response.json();
-
-        // Reset the grid
-        for (let i = 1; i <= 60; i++) {
-            const cardImg = document.getElementById(`main-card-img-${i}`);
-            cardImg.src = '/static/images/placeholder.png';
-            cardImg.parentElement.dataset.cardDescription = '';
-        }
-
-        // Update the grid with deck's cards
-        let cardIndex = 0;
-        deckCards.forEach(card => {
-            if (!card.is_extra_deck) {
-                for (let i = 0; i < card.quantity; i++) {
-                    const row = Math.floor(cardIndex / 15);
-                    const col = cardIndex % 4;
-                    cardImg = document.getElementById(`main-card-img-${cardIndex + 1}`)
-                    cardImg.src = card.img_url;
-                    cardImg.parentElement.dataset.cardDescription = card.card_desc;
-                    cardImg.parentElement.dataset.cardId = card.id;
-                    cardIndex++;
-                }
-
-            }
-        });
+        fillDeckGrid('main', 60, deckCards.main);
+        fillDeckGrid('extra', 15, deckCards.extra);
 
     } catch (error) {
         console.error('Error fetching deck cards:', error);
     }
 }
 
-// FUNCTION to FETCH the deck's cards and UPDATE THE EXTRA DECK GRID
-async function updateExtraDeckGrid(deckId) {
+// FUNCTION to FETCH cards that often share decks with this deck's cards and SHOW THEM as suggestions
+async function updateSuggestions(deckId) {
     try {
-        const response = await fetch(`/api/decks/${deckId}/cards`);
+        const response = await fetch(`/api/decks/${deckId}/suggestions`);
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
 
-        const deckCards = await response.json();
-
-        // Reset the grid
-        for (let i = 1; i <= 15; i++) {
-            const cardImg = document.getElementById(`extra-card-img-${i}`);
-            cardImg.src = '/static/images/placeholder.png';
-            cardImg.parentElement.dataset.cardDescription = '';
-        }
+        const result = await response.json();
+        const suggestionList = document.querySelector('.suggestion-list');
+        suggestionList.innerHTML = '';
 
-        // Update the grid with deck's cards
-        let cardIndex = 0;
-        deckCards.forEach(card => {
-            if (card.is_extra_deck) {
-                for (let i = 0; i < card.quantity; i++) {
-                    const row = Math.floor(cardIndex / 15);
-                    const col = cardIndex % 4;
-                    cardImg = document.getElementById(`extra-card-img-${cardIndex + 1}`)
-                    cardImg.src = card.img_url;
-                    cardImg.parentElement.dataset.cardDescription = card.card_desc;
-                    cardImg.parentElement.dataset.cardId = card.id;
-                    cardIndex++;
-                }
-            }
+        // Same frames as search results, so clicking adds the card and hovering shows it
+        result.cards.forEach(card => {
+            const cardFrame = document.createElement('div');
+            cardFrame.classList.add('card-frame');
+            cardFrame.dataset.cardId = card.id;
+            cardFrame.dataset.cardDescription = card.card_desc;
+            cardFrame.dataset.cardImage = card.img_url_full;
+            cardFrame.title = card.name;
+            cardFrame.innerHTML = `<img src="${card.img_url}">`;
+            suggestionList.appendChild(cardFrame);
         });
 
     } catch (error) {
-        console.error('Error fetching deck cards:', error);
+        console.error('Error fetching suggestions:', error);
     }
 }
 
@@ -91,8 +86,8 @@ document.querySelector('#confirm-clear-deck').addEventListener('click', async (e
         const result = await response.json();
         if (response.ok) {
             // alert(result.message);
-            updateMainDeckGrid(deckId);
-            updateExtraDeckGrid(deckId);
+            updateDeckGrids(deckId);
+            updateSuggestions(deckId);
         } else {
             alert(result.error);
         }
@@ -119,106 +114,91 @@ document.getElementById('confirm-delete-deck').addEventListener('click', async (
 });
 
 
+// Card changes waiting to be sent, coalesced into one request once clicks pause
+let pendingDeckOps = [];
+let deckOpsTimer = null;
+
+// Most card changes the server accepts in one request (MAX_DECK_OPS)
+const MAX_DECK_OPS = 75;
+
+// FUNCTION to QUEUE adding (delta 1) or removing (delta -1) a card
+function queueDeckOp(cardId, delta) {
+    pendingDeckOps.push({ card_id: parseInt(cardId), delta: delta });
+    clearTimeout(deckOpsTimer);
+    if (pendingDeckOps.length >= MAX_DECK_OPS) {
+        sendDeckOps();
+    } else {
+        deckOpsTimer = setTimeout(sendDeckOps, 150);
+    }
+}
+
+// FUNCTION to SEND the queued card changes and UPDATE THE DECK GRIDS from the result
+async function sendDeckOps() {
+    const deckId = getDeckIdFromUrl();
+    const ops = pendingDeckOps;
+    pendingDeckOps = [];
+
+    try {
+        // Non-atomic, so each click is accepted or rejected on its own like before
+        const response = await fetch(`/api/decks/${deckId}/ops`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ops: ops, atomic: false })
+        });
+        const result = await response.json();
+        if (response.ok) {
+            fillDeckGrid('main', 60, result.main);
+            fillDeckGrid('extra', 15, result.extra);
+            updateSuggestions(deckId);
+            if (result.rejected.length) {
+                alert(result.rejected[0].error);
+            }
+        } else {
+            alert(result.error);
+        }
+    } catch (error) {
+        console.error('Error updating deck:', error);
+    }
+}
+
+
 // Event delegation for adding and removing cards
-document.addEventListener('click', async (event) => {
+document.addEventListener('click', (event) => {
     const target = event.target;
 
     // Handling add card event
     if (target.classList.contains('add-card-icon')) {
-        const deckId = getDeckIdFromUrl();
-        const cardId = target.dataset.cardId;
-        try {
-            const response = await fetch(`/decks/${deckId}/cards/add/${cardId}`, { method: 'POST' });
-            const result = await response.json();
-            if (response.ok) {
-                updateMainDeckGrid(deckId);
-                updateExtraDeckGrid(deckId);
-            } else {
-                alert(result.error);
-            }
-        } catch (error) {
-            console.error('Error adding card:', error);
-        }
+        queueDeckOp(target.dataset.cardId, 1);
     }
 
     // Handling remove card event
     if (target.classList.contains('remove-card-icon')) {
-        const deckId = getDeckIdFromUrl();
-        const cardId = target.dataset.cardId;
-        try {
-            const response = await fetch(`/decks/${deckId}/cards/remove/${cardId}`, { method: 'POST' });
-            const result = await response.json();
-            if (response.ok) {
-                updateMainDeckGrid(deckId);
-                updateExtraDeckGrid(deckId);
-            } else {
-                alert(result.error);
-            }
-        } catch (error) {
-            console.error('Error removing card:', error);
-        }
+        queueDeckOp(target.dataset.cardId, -1);
     }
 });
 
 
 // Let user remove card from main deck by clicking on the card
-document.addEventListener('click', async (event) => {
+document.addEventListener('click', (event) => {
     const target = event.target;
     if ((target.matches('.main-card-slot img') && target.closest('.main-card-slot').dataset.cardId)) {
-        const deckId = getDeckIdFromUrl();
-        const cardId = target.closest('.main-card-slot').dataset.cardId;
-        try {
-            const response = await fetch(`/decks/${deckId}/cards/remove/${cardId}`, { method: 'POST' });
-            const result = await response.json();
-            if (response.ok) {
-                updateMainDeckGrid(deckId);
-            } else {
-                alert(result.error);
-            }
-        } catch (error) {
-            console.error('Error removing card:', error);
-        }
+        queueDeckOp(target.closest('.main-card-slot').dataset.cardId, -1);
     }
 });
 
 // Let user remove card from extra deck by clicking on the card
-document.addEventListener('click', async (event) => {
+document.addEventListener('click', (event) => {
     const target = event.target;
     if ((target.matches('.extra-card-slot img') && target.closest('.extra-card-slot').dataset.cardId)) {
-        const deckId = getDeckIdFromUrl();
-        const cardId = target.closest('.extra-card-slot').dataset.cardId;
-        try {
-            const response = await fetch(`/decks/${deckId}/cards/remove/${cardId}`, { method: 'POST' });
-            const result = await response.json();
-            if (response.ok) {
-                updateExtraDeckGrid(deckId);
-            } else {
-                alert(result.error);
-            }
-        } catch (error) {
-            console.error('Error removing card:', error);
-        }
+        queueDeckOp(target.closest('.extra-card-slot').dataset.cardId, -1);
     }
 });
 
 // Let user add card from search results by clicking on the card
-document.addEventListener('click', async (event) => {
+document.addEventListener('click', (event) => {
     const target = event.target;
     if (target.matches('.card-frame img') && target.closest('.card-frame').dataset.cardId) {
-        const deckId = getDeckIdFromUrl();
-        const cardId = target.closest('.card-frame').dataset.cardId;
-        try {
-            const response = await fetch(`/decks/${deckId}/cards/add/${cardId}`, { method: 'POST' });
-            const result = await response.json();
-            if (response.ok) {
-                updateMainDeckGrid(deckId);
-                updateExtraDeckGrid(deckId);
-            } else {
-                alert(result.error);
-            }
-        } catch (error) {
-            console.error('Error adding card:', error);
-        }
+        queueDeckOp(target.closest('.card-frame').dataset.cardId, 1);
     }
 });
 
@@ -235,23 +215,23 @@ document.addEventListener('mouseover', (event) => {
         description.textContent = cardDesc;
     };
 
-    // Main deck cards hover effect
+    // Main deck cards hover effect (the slots show small art, the card view the full art)
     if (target.matches('.main-card-slot img') && target.src !== '/static/images/placeholder.png') {
-        const cardImgSrc = target.src;
+        const cardImgSrc = target.closest('.main-card-slot').dataset.cardImage || target.src;
         const cardDescription = target.closest('.main-card-slot').dataset.cardDescription;
         updateCardView(cardImgSrc, cardDescription);
     }
 
     // Extra deck cards hover effect
     if (target.matches('.extra-card-slot img') && target.src !== '/static/images/placeholder.png') {
-        const cardImgSrc = target.src;
+        const cardImgSrc = target.closest('.extra-card-slot').dataset.cardImage || target.src;
         const cardDescription = target.closest('.extra-card-slot').dataset.cardDescription;
         updateCardView(cardImgSrc, cardDescription);
     }
 
     // Search result cards hover effect
     if (target.matches('.card-frame img')) {
-        const cardImgSrc = target.src;
+        const cardImgSrc = target.closest('.card-frame').dataset.cardImage || target.src;
         const cardDescription = target.closest('.card-frame').dataset.cardDescription;
         updateCardView(cardImgSrc, cardDescription);
     }
@@ -262,29 +242,28 @@ document.addEventListener('mouseover', (event) => {
 document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('card-search-form').addEventListener('submit', async (event) => {
         event.preventDefault();
-        await fetchCards(0);
+        await fetchCards('');
     });
 
     document.getElementById('nextPageBtn').addEventListener('click', async (event) => {
         event.preventDefault();
-        await paginate(30);
+        await fetchCards(event.currentTarget.dataset.cursor);
     });
 
     document.getElementById('prevPageBtn').addEventListener('click', async (event) => {
         event.preventDefault();
-        await paginate(-30);
+        await fetchCards(event.currentTarget.dataset.cursor);
     });
 });
 
 
-// Function to fetch cards from the API
-async function fetchCards(offsetChange) {
+// Function to fetch a page of cards from the API. 'cursor' is the next or prev cursor of the
+// current page, or empty for the first page of a new search.
+async function fetchCards(cursor) {
     const form = document.getElementById('card-search-form');
     const formData = new FormData(form);
-    const currentOffset = parseInt(formData.get('offset')) || 0;
-    const newOffset = currentOffset + offsetChange;
 
-    formData.set('offset', newOffset);
+    formData.set('cursor', cursor || '');
 
     try {
         const response = await fetch('/api/cards/search', {
@@ -313,6 +292,7 @@ async function fetchCards(offsetChange) {
             cardFrame.classList.add('card-frame');
             cardFrame.dataset.cardId = card.id;
             cardFrame.dataset.cardDescription = card.desc;
+            cardFrame.dataset.cardImage = card.card_images[0].image_url;
             cardFrame.innerHTML = `
                 <img src="${card.card_images[0].image_url_small}">
                 <div class="card-buttons-container container-fluid">
@@ -329,12 +309,12 @@ async function fetchCards(offsetChange) {
             searchResultContainer.appendChild(cardFrame);
         });
 
-        // Update the offset input value
-        document.querySelector('input[name="offset"]').value = newOffset;
+        // Update the cursor input value
+        document.querySelector('input[name="cursor"]').value = cursor || '';
 
-        // Enable or disable pagination buttons
-        document.getElementById('prevPageBtn').disabled = newOffset <= 0;
-        document.getElementById('nextPageBtn').disabled = result.pages_remaining === 0;
+        // Point the pagination buttons at the neighbouring pages, or disable them at either end
+        updatePageButton(document.getElementById('prevPageBtn'), result.prev_cursor);
+        updatePageButton(document.getElementById('nextPageBtn'), result.next_cursor);
 
     } catch (error) {
         console.error('Error searching cards:', error);
@@ -342,28 +322,22 @@ async function fetchCards(offsetChange) {
     }
 }
 
-async function paginate(offsetChange) {
-    const form = document.getElementById('card-search-form');
-    const formData = new FormData(form);
-    const currentOffset = parseInt(formData.get('offset')) || 0;
-    const newOffset = currentOffset + offsetChange;
-
-    formData.set('offset', newOffset);
-
-    await fetchCards(offsetChange);
+function updatePageButton(button, cursor) {
+    button.dataset.cursor = cursor || '';
+    button.disabled = !cursor;
 }
 
-// Reset the offset to 0 when a new search is submitted
+// Start from the first page when a new search is submitted
 document.getElementById('card-search-form').addEventListener('submit', () => {
     const form = event.target;
-    form.querySelector('input[name="offset"]').value = 0;
+    form.querySelector('input[name="cursor"]').value = '';
 });
 
 // Add event listener to clear filter button
 document.getElementById('clear-filters-btn').addEventListener('click', async (event) => {
     const form = document.getElementById('card-search-form');
     form.reset();
-    form.querySelector('input[name="offset"]').value = 0;
+    form.querySelector('input[name="cursor"]').value = '';
 });
 
 // Submit rename deck form
@@ -408,6 +382,6 @@ document.addEventListener('contextmenu', async (event) => {
 // Initial update when the page loads
 document.addEventListener('DOMContentLoaded', () => {
     const deckId = getDeckIdFromUrl();
-    updateMainDeckGrid(deckId);
-    updateExtraDeckGrid(deckId);
+    updateDeckGrids(deckId);
+    updateSuggestions(deckId);
 });
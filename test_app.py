@@ -0,0 +1,680 @@
+import unittest
+from unittest.mock import patch
+from sqlalchemy import event
+from dotenv import load_dotenv
+import os
+import tempfile
+
+# Load environment variables
+load_dotenv()
+
+# Point the app at the test database before importing it, falling back to in-memory SQLite
+os.environ['SUPABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'test')
+# Cheap password hashes keep the tests fast
+os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+# Keep cached card art out of the source tree
+os.environ['IMAGE_CACHE_DIR'] = tempfile.mkdtemp()
+
+from app import app, CURR_USER_KEY
+from passwords import password_hasher, PasswordHasherBusy
+from metrics import metrics
+from odds import odds_available
+from images import image_store
+from fragments import fragment_cache
+from deck_codes import format_ydk, format_ydke, parse_deck_code
+from models import db, User, Deck, CardPair, DeckCard
+from helpers import rebuild_card_pairs
+from helpers import load_card_dump, sync_card_catalog, card_cache, deck_stats_cache, user_cache, user_lookup_counts, popular_decks_cache, refresh_popular_decks, get_popular_decks, FEATURED_DECKS
+
+# Fixture cardinfo dump, so the tests never touch the network
+CARD_DUMP_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'cardinfo.json')
+
+# Fixture card ids
+BLUE_EYES = 89631139
+DARK_MAGICIAN = 46986414
+ULTIMATE_DRAGON = 23995346
+POT_OF_GREED = 55144522
+MONSTER_REBORN = 83764718
+
+class TestDeckRoutes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Configure the app for testing."""
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Create all tables, sync the fixture dump and log in a user with an empty deck."""
+        card_cache.clear()
+        deck_stats_cache.clear()
+        fragment_cache.clear()
+        popular_decks_cache.clear()
+        user_cache.clear()
+        user_lookup_counts.clear()
+        with app.app_context():
+            db.create_all()
+            sync_card_catalog(load_card_dump(CARD_DUMP_PATH), source=CARD_DUMP_PATH)
+
+            user = User.register(username="testuser", unhash_password="password", email="test@test.com")
+            db.session.add(user)
+            db.session.commit()
+
+            deck = Deck(name="Test Deck", user_id=user.id)
+            db.session.add(deck)
+            db.session.commit()
+
+            self.user_id = user.id
+            self.deck_id = deck.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        """Clean up the session and drop all tables."""
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def add_card(self, card_id, times=1):
+        """Add a card to the test deck 'times' times through the add route."""
+        for _ in range(times):
+            self.client.post(f"/decks/{self.deck_id}/cards/add/{card_id}")
+
+
+    # --- DECK CARDS API TESTS ---
+    def test_get_deck_cards(self):
+        """Test the deck cards list and the split main/extra payload."""
+        self.add_card(BLUE_EYES, 2)
+        self.add_card(ULTIMATE_DRAGON)
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({card['id']: card['quantity'] for card in response.get_json()}, {BLUE_EYES: 2, ULTIMATE_DRAGON: 1})
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards?split=1")
+        data = response.get_json()
+        self.assertEqual([card['id'] for card in data['main']], [BLUE_EYES])
+        self.assertEqual([card['id'] for card in data['extra']], [ULTIMATE_DRAGON])
+
+    def test_get_deck_cards_conditional(self):
+        """Test that an unchanged deck answers 304 and a changed deck or card gets a new ETag."""
+        self.add_card(BLUE_EYES)
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards")
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.add_card(DARK_MAGICIAN)
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.get_json()), 2)
+
+        # The split variant of the same deck version has its own tag
+        etag = response.headers['ETag']
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards?split=1", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # A catalog sync can change the cards' text without changing the deck
+        etag = response.headers['ETag']
+        with app.app_context():
+            sync_card_catalog(load_card_dump(CARD_DUMP_PATH), source=CARD_DUMP_PATH)
+        response = self.client.get(f"/api/decks/{self.deck_id}/cards?split=1", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+
+    # --- DECK OPS API TESTS ---
+    def post_ops(self, ops, atomic=True):
+        """Send a batch of (card_id, delta) ops to the test deck."""
+        return self.client.post(f"/api/decks/{self.deck_id}/ops", json={
+            "ops": [{"card_id": card_id, "delta": delta} for card_id, delta in ops],
+            "atomic": atomic
+        })
+
+    def test_deck_ops_applies_batch(self):
+        """Test that a batch is applied in one request and returns the resulting deck."""
+        response = self.post_ops([(BLUE_EYES, 3), (ULTIMATE_DRAGON, 1), (BLUE_EYES, -1), (DARK_MAGICIAN, 1)])
+        self.assertEqual(response.status_code, 200)
+
+        data = response.get_json()
+        self.assertEqual({card['id']: card['quantity'] for card in data['main']}, {BLUE_EYES: 2, DARK_MAGICIAN: 1})
+        self.assertEqual([card['id'] for card in data['extra']], [ULTIMATE_DRAGON])
+        self.assertEqual((data['main_deck_count'], data['extra_deck_count']), (3, 1))
+        self.assertEqual(data['rejected'], [])
+
+    def test_deck_ops_atomic_rejects_whole_batch(self):
+        """Test that one rule-breaking op rolls back the whole atomic batch."""
+        self.add_card(DARK_MAGICIAN)
+
+        response = self.post_ops([(BLUE_EYES, 2), (MONSTER_REBORN, 2), (DARK_MAGICIAN, -1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], "Cannot add more than 1 copies of Monster Reborn.")
+
+        with app.app_context():
+            self.assertEqual([dc.card_id for dc in DeckCard.query.all()], [DARK_MAGICIAN])
+
+    def test_deck_ops_non_atomic_skips_rejected(self):
+        """Test that non-atomic batches apply valid ops and list the rejected ones."""
+        response = self.post_ops([(BLUE_EYES, 1)] * 4 + [(POT_OF_GREED, 1), (DARK_MAGICIAN, -1)], atomic=False)
+        self.assertEqual(response.status_code, 200)
+
+        data = response.get_json()
+        self.assertEqual({card['id']: card['quantity'] for card in data['main']}, {BLUE_EYES: 3})
+        self.assertEqual([rejected['error'] for rejected in data['rejected']], [
+            "Cannot add more than 3 copies of Blue-Eyes White Dragon.",
+            "Pot of Greed is banned.",
+            "Dark Magician is not in the deck."
+        ])
+
+    def test_deck_ops_deck_size_limits(self):
+        """Test the 60 card main deck and 15 card extra deck limits."""
+        response = self.post_ops([(ULTIMATE_DRAGON, 16)])
+        self.assertEqual(response.get_json()['error'], "Cannot add more than 15 cards to the extra deck.")
+
+        with app.app_context():
+            db.session.execute(db.update(Deck).values(main_deck_count=60))
+            db.session.commit()
+        response = self.post_ops([(BLUE_EYES, 1)])
+        self.assertEqual(response.get_json()['error'], "Cannot add more than 60 cards to the main deck.")
+
+    def test_deck_ops_invalid_payload(self):
+        """Test that malformed ops are rejected."""
+        response = self.client.post(f"/api/decks/{self.deck_id}/ops", json={"ops": [{"card_id": "abc"}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_deck_ops_resolves_unknown_cards_in_bulk(self):
+        """Test that unknown cards are fetched in one API request and oversized batches are refused."""
+        with patch('helpers.fetch_cards_by_ids', return_value=[]) as fetch:
+            response = self.post_ops([(1, 1), (2, 1), (BLUE_EYES, 1), (3, 1)], atomic=False)
+        fetch.assert_called_once_with([1, 2, 3])
+        self.assertEqual(len(response.get_json()['rejected']), 3)
+
+        with patch('helpers.fetch_cards_by_ids') as fetch:
+            response = self.post_ops([(card_id, 1) for card_id in range(1, 77)])
+        self.assertEqual(response.status_code, 400)
+        fetch.assert_not_called()
+
+
+    # --- IMPORT AND EXPORT TESTS ---
+    def test_import_ydk_replaces_deck(self):
+        """Test that a .ydk import replaces the deck's cards in one request."""
+        self.add_card(DARK_MAGICIAN)
+        ydk = format_ydk([BLUE_EYES] * 3 + [MONSTER_REBORN], [ULTIMATE_DRAGON])
+
+        response = self.client.post(f"/api/decks/{self.deck_id}/import", json={"deck": ydk})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual({card['id']: card['quantity'] for card in data['main']}, {BLUE_EYES: 3, MONSTER_REBORN: 1})
+        self.assertEqual([card['id'] for card in data['extra']], [ULTIMATE_DRAGON])
+        self.assertEqual((data['main_deck_count'], data['extra_deck_count']), (4, 1))
+
+    def test_import_fetches_only_unknown_cards(self):
+        """Test that cards missing locally are fetched in a single API request."""
+        unknown = dict(load_card_dump(CARD_DUMP_PATH)[0], id=1234, name="Unknown Card", card_images=[
+            {"id": 1234, "image_url": "https://images.ygoprodeck.com/images/cards/1234.jpg"},
+            {"id": 5678, "image_url": "https://images.ygoprodeck.com/images/cards/5678.jpg"}
+        ])
+        with patch('helpers.fetch_cards_by_ids', return_value=[unknown]) as fetch:
+            response = self.client.post(f"/api/decks/{self.deck_id}/import", data=format_ydke([BLUE_EYES, 1234, 5678], []))
+
+        fetch.assert_called_once_with([1234, 5678])
+        self.assertEqual(response.status_code, 200)
+        # The alternate artwork passcode counts as the same card
+        self.assertEqual({card['id']: card['quantity'] for card in response.get_json()['main']}, {BLUE_EYES: 1, 1234: 2})
+
+    def test_import_rejects_whole_list(self):
+        """Test that a list breaking the rules changes nothing and reports every problem."""
+        self.add_card(DARK_MAGICIAN)
+        ydk = format_ydk([BLUE_EYES] * 4 + [POT_OF_GREED], [])
+
+        with patch('helpers.fetch_cards_by_ids', return_value=[]):
+            response = self.client.post(f"/api/decks/{self.deck_id}/import", json={"deck": ydk + "999\n"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual({rejected['error'] for rejected in response.get_json()['rejected']}, {
+            "Cannot add more than 3 copies of Blue-Eyes White Dragon.",
+            "Pot of Greed is banned."
+        })
+
+        with app.app_context():
+            self.assertEqual([dc.card_id for dc in DeckCard.query.all()], [DARK_MAGICIAN])
+
+    def test_import_invalid_list(self):
+        """Test that malformed and empty lists are rejected."""
+        response = self.client.post(f"/api/decks/{self.deck_id}/import", json={"deck": "ydke://%%%!!!"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f"/api/decks/{self.deck_id}/import", json={"deck": "#main\n"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_rejects_oversized_list(self):
+        """Test that a list longer than a full main, extra and side deck is refused unresolved."""
+        with patch('helpers.fetch_cards_by_ids') as fetch:
+            response = self.client.post(f"/api/decks/{self.deck_id}/import", data=format_ydke(list(range(1, 92)), []))
+
+        self.assertEqual(response.status_code, 400)
+        fetch.assert_not_called()
+
+    def test_export(self):
+        """Test .ydk and ydke:// exports."""
+        self.add_card(BLUE_EYES, 2)
+        self.add_card(ULTIMATE_DRAGON)
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/export")
+        self.assertIn('filename="Test_Deck.ydk"', response.headers['Content-Disposition'])
+        self.assertEqual(parse_deck_code(response.get_data(as_text=True)), ([BLUE_EYES, BLUE_EYES], [ULTIMATE_DRAGON], []))
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/export?format=ydke")
+        self.assertEqual(parse_deck_code(response.get_json()['ydke']), ([BLUE_EYES, BLUE_EYES], [ULTIMATE_DRAGON], []))
+
+
+    # --- CURRENT USER TESTS ---
+    def test_current_user_cached(self):
+        """Test that the deck editor's JSON endpoints query the user at most once."""
+        for _ in range(3):
+            self.post_ops([(BLUE_EYES, 1)])
+            self.client.get(f"/api/decks/{self.deck_id}/cards")
+
+        self.assertEqual(user_lookup_counts['db'], 1)
+        self.assertEqual(user_lookup_counts['cache'], 2)
+        self.assertEqual(user_lookup_counts['skipped'], 3)
+
+        stats = self.client.get("/api/cache/stats").get_json()
+        self.assertEqual(stats['users']['sources']['db'], 1)
+
+    def test_current_user_invalidated_on_edit(self):
+        """Test that editing the profile drops the cached user."""
+        self.client.get("/user/edit")
+        response = self.client.post("/user/edit", data={
+            "username": "renamed",
+            "email": "test@test.com",
+            "img_url": "",
+            "password": "password",
+            "password_confirm": "password"
+        })
+        self.assertEqual(response.status_code, 302)
+
+        response = self.client.get("/user/edit")
+        self.assertIn(b"renamed", response.data)
+        self.assertEqual(user_lookup_counts['db'], 2)
+
+
+    # --- LOGIN TESTS ---
+    def test_login_rehashes_old_cost(self):
+        """Test that logging in upgrades a hash made with an old cost factor."""
+        password_hasher.configure(rounds=5)
+        try:
+            response = self.client.post("/login", data={"username": "testuser", "password": "password"})
+            self.assertEqual(response.status_code, 302)
+        finally:
+            password_hasher.configure(rounds=4)
+
+        with app.app_context():
+            hashed = User.query.get(self.user_id).hash_password
+        self.assertTrue(hashed.startswith("$2b$05$"))
+
+    def test_login_busy(self):
+        """Test that a saturated hashing pool answers 503 instead of queueing."""
+        with patch('models.password_hasher.check', side_effect=PasswordHasherBusy("busy")):
+            response = self.client.post("/login", data={"username": "testuser", "password": "password"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+
+    # --- IMAGE TESTS ---
+    @patch('images.download_image', return_value=b'small art')
+    @patch('images.thumbnails_available', return_value=False)
+    def test_card_image_route(self, thumbnails_available, download_image):
+        """Test that card art is served from the image cache with long-lived validators."""
+        image_store.clear()
+
+        response = self.client.get(f"/images/cards/small/{BLUE_EYES}.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'small art')
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertTrue(response.cache_control.public)
+        self.assertEqual(response.cache_control.max_age, app.config['IMAGE_MAX_AGE'])
+
+        etag = response.headers['ETag']
+        response = self.client.get(f"/images/cards/small/{BLUE_EYES}.jpg", headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        download_image.assert_called_once()
+
+        self.assertEqual(self.client.get(f"/images/cards/huge/{BLUE_EYES}.jpg").status_code, 404)
+
+        # Ids outside the cards table aren't fetched, the browser is sent upstream instead
+        response = self.client.get("/images/cards/small/1.jpg")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, "https://images.ygoprodeck.com/images/cards_small/1.jpg")
+        download_image.assert_called_once()
+
+    def test_deck_images_use_local_route(self):
+        """Test that deck slots and covers point at the local image route."""
+        self.add_card(BLUE_EYES)
+        data = self.client.get(f"/api/decks/{self.deck_id}/cards").get_json()
+        self.assertEqual(data[0]['img_url'], f"/images/cards/small/{BLUE_EYES}.jpg")
+        self.assertEqual(data[0]['img_url_full'], f"/images/cards/full/{BLUE_EYES}.jpg")
+
+        self.client.post(f"/api/{self.deck_id}/set_cover/{BLUE_EYES}")
+        with app.app_context():
+            self.assertEqual(db.session.get(Deck, self.deck_id).cover_card_url, f"/images/cards/small/{BLUE_EYES}.jpg")
+
+
+    # --- POPULAR DECKS TESTS ---
+    def test_popular_decks_feed(self):
+        """Test that only flagged decks are ranked, ahead of the featured lists."""
+        with app.app_context():
+            user = User.query.get(self.user_id)
+            flagged = Deck(name="Flagged Deck", user_id=user.id, popular=True)
+            full = Deck(name="Full Deck", user_id=user.id)
+            db.session.add_all([flagged, full])
+            db.session.commit()
+            db.session.execute(db.update(Deck).where(Deck.id == full.id).values(main_deck_count=40))
+            db.session.commit()
+
+            # A full deck isn't published unless it is flagged
+            self.assertEqual(refresh_popular_decks(), 1)
+            feed = get_popular_decks()
+
+        self.assertEqual(feed[0]['deck_name'], "Flagged Deck")
+        self.assertEqual([deck['href'] for deck in feed[1:]], [deck['href'] for deck in FEATURED_DECKS[:11]])
+        self.assertEqual(feed[1]['image_url'], "/images/cards/small/88284599.jpg")
+
+        response = self.client.get("/")
+        self.assertIn(b"Flagged Deck", response.data)
+        self.assertNotIn(b"Full Deck", response.data)
+
+    def test_popular_decks_invalidated_on_delete(self):
+        """Test that deleting a deck drops it from the cached feed."""
+        with app.app_context():
+            db.session.execute(db.update(Deck).values(popular=True))
+            db.session.commit()
+            refresh_popular_decks()
+            self.assertEqual(get_popular_decks()[0]['deck_name'], "Test Deck")
+
+        self.client.post(f"/decks/{self.deck_id}/delete")
+
+        # The emptied feed is rebuilt off the request thread
+        with app.app_context(), patch('helpers.refresh_popular_decks_in_background') as refresh:
+            self.assertEqual([deck['href'] for deck in get_popular_decks()], [deck['href'] for deck in FEATURED_DECKS])
+            refresh.assert_called_once()
+
+    def test_deck_stats(self):
+        """Test that deck statistics count copies per type, attribute, level and ATK bucket."""
+        self.add_card(BLUE_EYES, 3)
+        self.add_card(DARK_MAGICIAN, 2)
+        self.add_card(MONSTER_REBORN)
+
+        stats = self.client.get(f"/api/decks/{self.deck_id}/stats").get_json()
+        self.assertEqual(stats['main_deck_count'], 6)
+        self.assertIn({"value": "Normal Monster", "copies": 5}, stats['type'])
+        self.assertIn({"value": "Spell Card", "copies": 1}, stats['type'])
+        self.assertEqual(stats['attribute'], [{"value": "DARK", "copies": 2}, {"value": "LIGHT", "copies": 3}])
+        self.assertEqual(stats['level'], [{"value": 7, "copies": 2}, {"value": 8, "copies": 3}])
+        self.assertEqual(stats['attack'], [{"value": 2500, "copies": 2}, {"value": 3000, "copies": 3}])
+
+    def test_deck_stats_cached_per_version(self):
+        """Test that repeat views are served from the cache until the deck's cards change."""
+        self.add_card(BLUE_EYES)
+        url = f"/api/decks/{self.deck_id}/stats"
+
+        first = self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(deck_stats_cache.stats()['hits'], 1)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code, 304)
+
+        self.add_card(BLUE_EYES)
+        stats = self.client.get(url).get_json()
+        self.assertEqual(stats['type'], [{"value": "Normal Monster", "copies": 2}])
+        self.assertEqual(deck_stats_cache.stats()['misses'], 2)
+
+    @unittest.skipUnless(odds_available(), "NumPy is not installed")
+    def test_deck_odds(self):
+        """Test the exact odds of opening with each card and with a chosen set of cards."""
+        self.add_card(BLUE_EYES, 3)
+        self.add_card(DARK_MAGICIAN, 2)
+        self.add_card(ULTIMATE_DRAGON)
+
+        odds = self.client.get(f"/api/decks/{self.deck_id}/odds?cards={BLUE_EYES},{DARK_MAGICIAN}&at_least=2").get_json()
+        # Extra deck cards are left out, so every 5 card hand is the whole main deck
+        self.assertEqual(odds['deck_size'], 5)
+        self.assertEqual([card['id'] for card in odds['cards']], [DARK_MAGICIAN, BLUE_EYES])
+        self.assertEqual(odds['cards'][0]['odds']['5'], 1.0)
+        self.assertEqual(odds['set']['copies'], 5)
+        self.assertEqual(odds['set']['odds']['5'], 1.0)
+
+        response = self.client.get(f"/api/decks/{self.deck_id}/odds?cards={ULTIMATE_DRAGON}")
+        self.assertEqual(response.status_code, 400)
+
+        # A hand can't hold fewer than 1 or more than 6 cards
+        for at_least in (0, -1, 7, 100):
+            response = self.client.get(f"/api/decks/{self.deck_id}/odds?cards={BLUE_EYES}&at_least={at_least}")
+            self.assertEqual(response.status_code, 400)
+            response = self.client.get(f"/api/decks/{self.deck_id}/odds?mode=simulate&condition={BLUE_EYES}:{at_least}")
+            self.assertEqual(response.status_code, 400)
+
+    @unittest.skipUnless(odds_available(), "NumPy is not installed")
+    def test_deck_odds_simulation(self):
+        """Test that simulated multi-condition odds are repeatable and close to the exact odds."""
+        for card_id in (BLUE_EYES, DARK_MAGICIAN, POT_OF_GREED, MONSTER_REBORN):
+            with app.app_context():
+                db.session.execute(db.insert(DeckCard).values(deck_id=self.deck_id, card_id=card_id, quantity=10))
+                db.session.commit()
+
+        url = f"/api/decks/{self.deck_id}/odds?mode=simulate&condition={BLUE_EYES}:1&trials=20000"
+        simulated = self.client.get(url).get_json()
+        exact = self.client.get(f"/api/decks/{self.deck_id}/odds").get_json()
+        self.assertAlmostEqual(simulated['odds']['5'], exact['cards'][0]['odds']['5'], delta=0.02)
+        self.assertEqual(self.client.get(url).get_json(), simulated)
+
+        both = self.client.get(f"/api/decks/{self.deck_id}/odds?mode=simulate&condition={BLUE_EYES}:1&condition={DARK_MAGICIAN},{POT_OF_GREED}:2").get_json()
+        self.assertLess(both['odds']['5'], simulated['odds']['5'])
+
+    def add_other_deck(self, name, card_ids):
+        """Create another deck holding one copy of each of 'card_ids'. Return its id."""
+        with app.app_context():
+            deck = Deck(name=name, user_id=self.user_id)
+            db.session.add(deck)
+            db.session.commit()
+            db.session.add_all([DeckCard(deck_id=deck.id, card_id=card_id, quantity=1) for card_id in card_ids])
+            db.session.commit()
+            return deck.id
+
+    def card_pairs(self):
+        """Return the stored co-occurrence counts as {(card_a, card_b): decks}."""
+        with app.app_context():
+            return {(pair.card_a, pair.card_b): pair.decks for pair in CardPair.query}
+
+    def test_card_pairs_follow_deck_changes(self):
+        """Test that co-occurrence counts are updated as cards are added and removed."""
+        self.add_other_deck("Other Deck", [BLUE_EYES, DARK_MAGICIAN])
+        self.add_card(BLUE_EYES)
+        self.add_card(DARK_MAGICIAN, 2)
+        self.add_card(MONSTER_REBORN)
+
+        pairs = self.card_pairs()
+        self.assertEqual(pairs[(BLUE_EYES, DARK_MAGICIAN)], 2)
+        self.assertEqual(pairs[(DARK_MAGICIAN, BLUE_EYES)], 2)
+        self.assertEqual(pairs[(MONSTER_REBORN, BLUE_EYES)], 1)
+
+        # A second copy doesn't count twice, and removing the last copy drops the card's pairs
+        self.client.post(f"/decks/{self.deck_id}/cards/remove/{DARK_MAGICIAN}")
+        self.assertEqual(self.card_pairs()[(BLUE_EYES, DARK_MAGICIAN)], 2)
+        self.client.post(f"/decks/{self.deck_id}/cards/remove/{DARK_MAGICIAN}")
+        pairs = self.card_pairs()
+        self.assertEqual(pairs[(BLUE_EYES, DARK_MAGICIAN)], 1)
+        self.assertNotIn((MONSTER_REBORN, DARK_MAGICIAN), pairs)
+
+        # The incremental counts match a full rebuild
+        with app.app_context():
+            rebuild_card_pairs()
+        self.assertEqual(self.card_pairs(), pairs)
+
+        # Deleting a deck removes its pairs
+        self.client.post(f"/decks/{self.deck_id}/delete")
+        self.assertEqual(self.card_pairs(), {(BLUE_EYES, DARK_MAGICIAN): 1, (DARK_MAGICIAN, BLUE_EYES): 1})
+
+    def count_statements(self, request):
+        """Return the number of SQL statements run while answering 'request' (a no-argument callable)."""
+        statements = []
+        with app.app_context():
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                request()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+        return len(statements)
+
+    def test_clear_deck_is_set_based(self):
+        """Test that clearing a deck takes the same statements however many cards it holds, and
+        keeps the counters, version and card pairs right."""
+        other_deck = self.add_other_deck("Other Deck", [BLUE_EYES, DARK_MAGICIAN])
+        self.add_card(BLUE_EYES)
+        one_card = self.count_statements(lambda: self.client.post(f"/api/decks/{self.deck_id}/clear"))
+
+        self.add_card(BLUE_EYES, 2)
+        self.add_card(DARK_MAGICIAN)
+        self.add_card(MONSTER_REBORN)
+        with app.app_context():
+            version = db.session.get(Deck, self.deck_id).version
+        self.assertEqual(self.count_statements(lambda: self.client.post(f"/api/decks/{self.deck_id}/clear")), one_card)
+
+        with app.app_context():
+            deck = db.session.get(Deck, self.deck_id)
+            self.assertEqual((deck.main_deck_count, deck.extra_deck_count, deck.version), (0, 0, version + 1))
+            self.assertEqual(DeckCard.query.filter_by(deck_id=self.deck_id).count(), 0)
+        self.assertEqual(self.card_pairs(), {(BLUE_EYES, DARK_MAGICIAN): 1, (DARK_MAGICIAN, BLUE_EYES): 1})
+
+        # Deleting a deck removes its cards in the database
+        self.client.post(f"/decks/{other_deck}/delete")
+        with app.app_context():
+            self.assertEqual(DeckCard.query.filter_by(deck_id=other_deck).count(), 0)
+        self.assertEqual(self.card_pairs(), {})
+
+    def test_duplicate_deck(self):
+        """Test that a copied deck has the same cards, counters and card pairs as the original."""
+        self.add_card(BLUE_EYES, 3)
+        self.add_card(DARK_MAGICIAN)
+        self.add_card(ULTIMATE_DRAGON)
+
+        response = self.client.post(f"/api/decks/{self.deck_id}/duplicate", json={"name": "Dragons"})
+        self.assertEqual(response.status_code, 201)
+        copy = response.get_json()
+        self.assertEqual((copy['name'], copy['main_deck_count'], copy['extra_deck_count']), ("Dragons", 4, 1))
+
+        original = self.client.get(f"/api/decks/{self.deck_id}/cards").get_json()
+        self.assertEqual(self.client.get(f"/api/decks/{copy['deck_id']}/cards").get_json(), original)
+        self.assertEqual(self.card_pairs()[(BLUE_EYES, DARK_MAGICIAN)], 2)
+
+        # The pairs counted for the copy match a full rebuild
+        pairs = self.card_pairs()
+        with app.app_context():
+            rebuild_card_pairs()
+        self.assertEqual(self.card_pairs(), pairs)
+
+        # The deck editor's button opens the copy
+        response = self.client.post(f"/decks/{self.deck_id}/duplicate")
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            self.assertEqual(Deck.query.filter_by(name="Test Deck (copy)").count(), 1)
+
+    def test_deck_suggestions(self):
+        """Test that suggestions rank cards by how often they share decks with the deck's cards."""
+        self.add_other_deck("Dragons", [BLUE_EYES, ULTIMATE_DRAGON, MONSTER_REBORN])
+        more_dragons = self.add_other_deck("More Dragons", [BLUE_EYES, ULTIMATE_DRAGON])
+        self.add_card(BLUE_EYES, 2)
+
+        # A deck from before Pot of Greed was banned
+        with app.app_context():
+            db.session.execute(db.insert(DeckCard).values(deck_id=more_dragons, card_id=POT_OF_GREED, quantity=1))
+            db.session.commit()
+            rebuild_card_pairs()
+
+        suggestions = self.client.get(f"/api/decks/{self.deck_id}/suggestions").get_json()['cards']
+        # Pot of Greed is banned, so it is never suggested
+        self.assertEqual([(card['id'], card['score']) for card in suggestions], [(ULTIMATE_DRAGON, 4), (MONSTER_REBORN, 2)])
+        self.assertEqual(suggestions[0]['img_url'], f"/images/cards/small/{ULTIMATE_DRAGON}.jpg")
+
+        # Cards already in the deck aren't suggested
+        self.add_card(ULTIMATE_DRAGON)
+        suggestions = self.client.get(f"/api/decks/{self.deck_id}/suggestions?limit=1").get_json()['cards']
+        self.assertEqual([card['id'] for card in suggestions], [MONSTER_REBORN])
+
+    def test_deck_view_fragments(self):
+        """Test that the deck grid is rendered once per name and the search form only cached blank."""
+        self.client.get(f"/decks/{self.deck_id}")
+        self.client.get(f"/decks/{self.deck_id}")
+        stats = fragment_cache.stats()
+        self.assertEqual((stats['size'], stats['hits']), (2, 2))
+
+        # Adding a card doesn't change the markup, so nothing new is stored
+        self.add_card(BLUE_EYES)
+        self.client.get(f"/decks/{self.deck_id}")
+        self.assertEqual(fragment_cache.stats()['size'], 2)
+
+        # Renaming does, so the new name is rendered
+        self.client.post(f"/api/{self.deck_id}/rename", data={"name": "Dragons"})
+        self.assertIn(b"<h1>Dragons</h1>", self.client.get(f"/decks/{self.deck_id}").data)
+        self.assertEqual(fragment_cache.stats()['size'], 3)
+
+        # A search's form values are rendered but not cached
+        response = self.client.get(f"/decks/{self.deck_id}?name=dragon")
+        self.assertIn(b'value="dragon"', response.data)
+        self.assertEqual(fragment_cache.stats()['size'], 3)
+
+    def test_card_search_cursors(self):
+        """Test that the search API pages with cursors and rejects a cursor from another search."""
+        first = self.client.get("/api/cards/search?name=dragon").get_json()
+        self.assertIsNone(first['prev_cursor'])
+        self.assertIsNone(first['next_cursor'])
+
+        # The deck editor pages by the same cursors, 24 cards at a time
+        response = self.client.get(f"/decks/{self.deck_id}?name=dragon")
+        self.assertEqual(response.status_code, 200)
+
+        everything = self.client.get("/api/cards/search").get_json()
+        self.assertEqual(len(everything['cards']), 13)
+
+        response = self.client.get("/api/cards/search?name=magician&cursor=bad")
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics_endpoint(self):
+        """Test that requests are reported on /metrics with their latency and SQL statement count."""
+        metrics.clear()
+        self.client.get(f"/api/decks/{self.deck_id}/cards")
+
+        with patch.dict(app.config, {'METRICS_TOKEN': None}):
+            self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+        with patch.dict(app.config, {'METRICS_TOKEN': 'scrape-token'}):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            self.assertEqual(self.client.get("/metrics", headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+            response = self.client.get("/metrics", headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        output = response.get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{endpoint="get_deck_cards",method="GET",status="200"} 1', output)
+        self.assertIn('http_request_sql_queries_count{endpoint="get_deck_cards"} 1', output)
+        self.assertIn('sql_query_duration_seconds_count{operation="SELECT"}', output)
+
+    def test_over_budget_requests_logged(self):
+        """Test that requests over the query budget are logged when the flag is on."""
+        with patch.dict(app.config, {'METRICS_LOG_OVER_BUDGET': True, 'METRICS_QUERY_BUDGET': 0}):
+            with self.assertLogs(app.logger, level='WARNING') as logs:
+                self.client.get(f"/api/decks/{self.deck_id}/cards")
+        self.assertIn(f"GET /api/decks/{self.deck_id}/cards -> 200", logs.output[0])
+
+        with patch.dict(app.config, {'METRICS_LOG_OVER_BUDGET': False, 'METRICS_QUERY_BUDGET': 0}):
+            with self.assertNoLogs(app.logger, level='WARNING'):
+                self.client.get(f"/api/decks/{self.deck_id}/cards")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from cache import TTLCache, MISSING
+
+class FakeTimer:
+    """A clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        """Create a small cache on a fake clock."""
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        """Test that cached values are returned and counted as hits."""
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_expiry(self):
+        """Test that entries expire after the TTL."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2, ttl=30)
+        self.timer.now = 11
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted when full."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_configure_shrinks(self):
+        """Test that shrinking the cache evicts the oldest entries."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.configure(maxsize=1)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get('b'), 2)
+
+    def test_stale_lookup(self):
+        """Test that lookup() serves expired entries inside their stale window."""
+        self.cache.set('a', None, stale_ttl=5)
+        self.assertEqual(self.cache.lookup('a'), (None, True))
+
+        self.timer.now = 12
+        self.assertEqual(self.cache.lookup('a'), (None, False))
+        self.assertIsNone(self.cache.get('a'))
+
+        self.timer.now = 16
+        self.assertEqual(self.cache.lookup('a'), (MISSING, False))
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+
+    def test_invalidate(self):
+        """Test explicit invalidation."""
+        self.cache.set('a', 1)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from deck_codes import parse_ydk, format_ydk, parse_ydke, format_ydke, parse_deck_code
+
+MAIN = [89631139, 89631139, 46986414, 14558127]
+EXTRA = [23995346]
+SIDE = [83764718]
+
+class TestDeckCodes(unittest.TestCase):
+
+    # --- YDK TESTS ---
+    def test_parse_ydk(self):
+        """Test that .ydk sections are read one entry per copy, skipping comments."""
+        text = "#created by someone\n#main\n89631139\n89631139\n46986414\n14558127\n\n#extra\n23995346\n!side\n83764718\n"
+        self.assertEqual(parse_ydk(text), (MAIN, EXTRA, SIDE))
+
+    def test_ydk_round_trip(self):
+        """Test that written .ydk text reads back the same lists."""
+        self.assertEqual(parse_ydk(format_ydk(MAIN, EXTRA, SIDE)), (MAIN, EXTRA, SIDE))
+
+    def test_parse_ydk_rejects_bad_lines(self):
+        """Test that non-numeric lines are reported with their line number."""
+        with self.assertRaisesRegex(ValueError, "line 3"):
+            parse_ydk("#main\n89631139\nBlue-Eyes\n")
+
+
+    # --- YDKE TESTS ---
+    def test_parse_ydke(self):
+        """Test a known ydke:// URL: Blue-Eyes x2 main, Ultimate Dragon extra, empty side."""
+        self.assertEqual(parse_ydke("ydke://o6lXBaOpVwU=!0iNuAQ==!!"), ([89631139, 89631139], [23995346], []))
+
+    def test_ydke_round_trip(self):
+        """Test that written ydke:// URLs read back the same lists."""
+        url = format_ydke(MAIN, EXTRA, SIDE)
+        self.assertTrue(url.startswith("ydke://"))
+        self.assertEqual(parse_ydke(url), (MAIN, EXTRA, SIDE))
+
+    def test_parse_ydke_rejects_malformed(self):
+        """Test that bad base64 and truncated URLs are rejected."""
+        for url in ("ydke://not base64!!!", "ydke://o6lW!!!", "ydke://o6lWBQ=="):
+            with self.assertRaises(ValueError):
+                parse_ydke(url)
+
+    def test_parse_deck_code_detects_format(self):
+        """Test that either format is accepted by parse_deck_code."""
+        self.assertEqual(parse_deck_code(format_ydke(MAIN, EXTRA)), (MAIN, EXTRA, []))
+        self.assertEqual(parse_deck_code(format_ydk(MAIN, EXTRA)), (MAIN, EXTRA, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
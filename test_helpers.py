@@ -0,0 +1,711 @@
+import tempfile
+import threading
+import time
+import unittest
+import requests
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, Card, CardPair, CatalogSync, User, Deck, DeckCard, deck_pairs
+import helpers
+from helpers import load_card_dump, sync_card_catalog, add_cards_to_db, add_card_to_db, search_local_cards, find_cards, search_remote_cards, get_card, resolve_cards, card_cache, card_lookup_counts
+from helpers import cached_fetch_ygo_cards, search_cache, search_cache_key, refresh_banlist
+from helpers import add_deck_card_copy, remove_deck_card_copy, rebuild_card_pairs
+from dotenv import load_dotenv
+import os
+
+# Load environment variables
+load_dotenv()
+
+# Get the database URI from .env, falling back to an in-memory SQLite database
+SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite://')
+
+# Fixture cardinfo dump, so the tests never touch the network
+CARD_DUMP_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'cardinfo.json')
+
+class TestCardCatalog(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test database and create tables."""
+        # Create a minimal Flask application
+        cls.app = Flask(__name__)
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        cls.app.config['TESTING'] = True
+
+        # Initialize the database with the Flask app
+        db.init_app(cls.app)
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Create all tables and sync the fixture dump."""
+        helpers._catalog_synced = False
+        with self.app.app_context():
+            db.create_all()
+            sync_card_catalog(load_card_dump(CARD_DUMP_PATH), source=CARD_DUMP_PATH)
+
+    def tearDown(self):
+        """Clean up the session and drop all tables."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+    # --- SYNC TESTS ---
+    def test_sync_loads_every_card(self):
+        """Test that the sync loads every card and records the sync."""
+        with self.app.app_context():
+            self.assertEqual(Card.query.count(), 13)
+            self.assertEqual(CatalogSync.query.count(), 1)
+
+            # Banlist and deck placement are derived like add_card_to_db does
+            self.assertEqual(Card.query.get(55144522).limit, 0)
+            self.assertEqual(Card.query.get(83764718).limit, 1)
+            self.assertTrue(Card.query.get(23995346).extra_deck)
+
+            # Only on the OCG banlist, so unlimited here
+            self.assertEqual(Card.query.get(23434538).limit, 3)
+
+    def test_resync_updates_existing_cards(self):
+        """Test that syncing again updates cards in place instead of duplicating them."""
+        with self.app.app_context():
+            cards = load_card_dump(CARD_DUMP_PATH)
+            cards[0]['desc'] = "Updated text."
+            sync_card_catalog(cards)
+
+            self.assertEqual(Card.query.count(), 13)
+            self.assertEqual(Card.query.get(cards[0]['id']).description, "Updated text.")
+
+    def test_add_cards_upserts_in_bulk(self):
+        """Test that add_cards_to_db inserts new cards, updates existing ones and returns them by id."""
+        with self.app.app_context():
+            cards = load_card_dump(CARD_DUMP_PATH)
+            cards[0]['desc'] = "Updated text."
+            new_card = dict(cards[1], id=1, name="New Card")
+
+            result = add_cards_to_db([cards[0], new_card])
+            self.assertEqual(set(result), {cards[0]['id'], 1})
+            self.assertEqual(result[cards[0]['id']].description, "Updated text.")
+            self.assertEqual(result[1].name, "New Card")
+            self.assertEqual(Card.query.count(), 14)
+
+    def test_add_card_to_db_wraps_bulk_path(self):
+        """Test that the single-card helper returns the stored card."""
+        with self.app.app_context():
+            card = load_card_dump(CARD_DUMP_PATH)[0]
+            self.assertEqual(add_card_to_db(card).id, card['id'])
+            self.assertEqual(Card.query.count(), 13)
+
+
+    # --- SEARCH TESTS ---
+    def test_search_by_name(self):
+        """Test case-insensitive partial name search."""
+        with self.app.app_context():
+            result = search_local_cards(fname="blue-eyes")
+            names = [card['name'] for card in result['data']]
+            self.assertEqual(names, ["Blue-Eyes Ultimate Dragon", "Blue-Eyes White Dragon"])
+
+    def test_search_filters(self):
+        """Test the type, attribute, race, level, atk and def filters."""
+        with self.app.app_context():
+            result = search_local_cards(attribute="dark", race="spellcaster", level="7")
+            self.assertEqual([card['name'] for card in result['data']], ["Dark Magician"])
+
+            result = search_local_cards(type="Spell Card")
+            self.assertEqual(len(result['data']), 3)
+
+            result = search_local_cards(attack="gte2500", defense="gte2100")
+            names = {card['name'] for card in result['data']}
+            self.assertEqual(names, {"Blue-Eyes White Dragon", "Blue-Eyes Ultimate Dragon", "Dark Magician"})
+
+    def test_search_response_shape(self):
+        """Test that results use the same shape as the API."""
+        with self.app.app_context():
+            card = search_local_cards(fname="Dark Magician Girl")['data'][0]
+            self.assertEqual(card['id'], 38033121)
+            self.assertEqual(card['atk'], 2000)
+            self.assertEqual(card['card_images'][0]['image_url_small'], "/images/cards/small/38033121.jpg")
+
+            # Spells have no stats
+            card = search_local_cards(fname="Raigeki")['data'][0]
+            self.assertNotIn('atk', card)
+
+    def test_search_pagination(self):
+        """Test paging forward and back with next_cursor and prev_cursor."""
+        with self.app.app_context():
+            everything = [card['id'] for card in search_local_cards(num=20)['data']]
+
+            first = search_local_cards(num=5)
+            self.assertEqual(len(first['data']), 5)
+            self.assertIsNone(first['meta']['prev_cursor'])
+
+            second = search_local_cards(num=5, cursor=first['meta']['next_cursor'])
+            last = search_local_cards(num=5, cursor=second['meta']['next_cursor'])
+            self.assertEqual(len(last['data']), 3)
+            self.assertIsNone(last['meta']['next_cursor'])
+            self.assertEqual([card['id'] for page in (first, second, last) for card in page['data']], everything)
+
+            # Back from the last page to the first
+            back = search_local_cards(num=5, cursor=last['meta']['prev_cursor'])
+            self.assertEqual(back['data'], second['data'])
+            back = search_local_cards(num=5, cursor=back['meta']['prev_cursor'])
+            self.assertEqual(back['data'], first['data'])
+            self.assertIsNone(back['meta']['prev_cursor'])
+
+    def test_search_pagination_follows_ranking(self):
+        """Test that cursors page through ranked searches in rank order."""
+        with self.app.app_context():
+            for filters in ({"fname": "dragon"}, {"fname": "blue-eyes white dragon", "search_text": True}):
+                ranked = [card['id'] for card in search_local_cards(**filters)['data']]
+                paged, cursor = [], None
+                while True:
+                    page = search_local_cards(num=1, cursor=cursor, **filters)
+                    paged += [card['id'] for card in page['data']]
+                    cursor = page['meta']['next_cursor']
+                    if cursor is None:
+                        break
+                self.assertEqual(paged, ranked)
+
+    def test_search_rejects_foreign_cursor(self):
+        """Test that a cursor only works for the search it came from."""
+        with self.app.app_context():
+            cursor = search_local_cards(num=1, fname="dragon")['meta']['next_cursor']
+            with self.assertRaises(ValueError):
+                search_local_cards(num=1, fname="magician", cursor=cursor)
+            with self.assertRaises(ValueError):
+                search_local_cards(num=1, fname="dragon", cursor="not-a-cursor")
+
+    def test_search_no_match(self):
+        """Test that no matches and invalid stat filters return None like the API."""
+        with self.app.app_context():
+            self.assertIsNone(search_local_cards(fname="Exodia"))
+            self.assertIsNone(search_local_cards(attack="gteabc"))
+
+    def test_search_effect_text(self):
+        """Test that effect text is only searched when asked, and name matches rank first."""
+        with self.app.app_context():
+            self.assertIsNone(search_local_cards(fname="negate"))
+
+            result = search_local_cards(fname="negate", search_text=True)
+            self.assertEqual({card['name'] for card in result['data']}, {"Ash Blossom & Joyous Spring", "Number 39: Utopia"})
+
+            # The exact name match beats the card that only mentions it in its text
+            result = search_local_cards(fname="blue-eyes white dragon", search_text=True)
+            self.assertEqual([card['name'] for card in result['data']], ["Blue-Eyes White Dragon", "Blue-Eyes Ultimate Dragon"])
+
+    def test_search_ranking(self):
+        """Test that exact and prefix name matches rank above other substring matches."""
+        with self.app.app_context():
+            result = search_local_cards(fname="dragon")
+            self.assertEqual([card['name'] for card in result['data']][0], "Blue-Eyes Ultimate Dragon")
+
+            result = search_local_cards(fname="cyber dragon")
+            self.assertEqual([card['name'] for card in result['data']], ["Cyber Dragon"])
+
+            # Too short for trigrams, so only name prefixes match
+            result = search_local_cards(fname="ra")
+            self.assertEqual([card['name'] for card in result['data']], ["Raigeki"])
+
+    def test_unranked_text_matches_page(self):
+        """Test that text matches too many to score are ranked by name and still page by cursor."""
+        with self.app.app_context(), patch('search_index.MAX_RANKED_TEXT_MATCHES', 0):
+            filters = {"fname": "dragon", "search_text": True}
+            ranked = [card['id'] for card in search_local_cards(**filters)['data']]
+            paged, cursor = [], None
+            while True:
+                page = search_local_cards(num=1, cursor=cursor, **filters)
+                paged += [card['id'] for card in page['data']]
+                cursor = page['meta']['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(paged, ranked)
+
+    def test_search_index_follows_updates(self):
+        """Test that the index picks up inserted and changed cards."""
+        with self.app.app_context():
+            cards = load_card_dump(CARD_DUMP_PATH)
+            cards[0]['desc'] = "Shining scales of silver."
+            sync_card_catalog(cards)
+
+            result = search_local_cards(fname="silver", search_text=True)
+            self.assertEqual([card['id'] for card in result['data']], [cards[0]['id']])
+            self.assertIsNone(search_local_cards(fname="engine of destruction", search_text=True))
+
+    def test_find_cards_stays_local(self):
+        """Test that searches never call the API once the catalog is synced."""
+        with self.app.app_context():
+            with patch('helpers.upstream.get', side_effect=AssertionError("network call")):
+                result = find_cards(fname="Dark", num=24)
+            self.assertEqual(len(result['data']), 2)
+
+
+class TestCardResolution(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test database and create tables."""
+        cls.app = Flask(__name__)
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        cls.app.config['TESTING'] = True
+
+        db.init_app(cls.app)
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Create all tables, sync the fixture dump and empty the card cache."""
+        card_cache.clear()
+        card_lookup_counts.clear()
+        with self.app.app_context():
+            db.create_all()
+            self.cards = load_card_dump(CARD_DUMP_PATH)
+            sync_card_catalog(self.cards, source=CARD_DUMP_PATH)
+
+    def tearDown(self):
+        """Clean up the session and drop all tables."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+    # --- RESOLUTION TESTS ---
+    def test_stored_card_needs_no_api_call(self):
+        """Test that stored cards are served from the table, then from the cache."""
+        with patch('helpers.upstream.get', side_effect=AssertionError("network call")):
+            with self.app.app_context():
+                card = get_card(89631139)
+                self.assertEqual(card.name, "Blue-Eyes White Dragon")
+
+            with self.app.app_context():
+                card = get_card(89631139)
+                self.assertEqual(card.limit, 3)
+
+        self.assertEqual(card_lookup_counts['db'], 1)
+        self.assertEqual(card_lookup_counts['cache'], 1)
+
+    def test_alternate_artwork_needs_no_api_call(self):
+        """Test that an alternate artwork passcode resolves to its stored card, then from the cache."""
+        with self.app.app_context():
+            dark_magician = self.cards[1]
+            add_cards_to_db([dict(dark_magician, card_images=dark_magician['card_images'] + [
+                {"id": 36996508, "image_url": "https://images.ygoprodeck.com/images/cards/36996508.jpg"}
+            ])])
+
+        with patch('helpers.upstream.get', side_effect=AssertionError("network call")):
+            for _ in range(2):
+                with self.app.app_context():
+                    self.assertEqual(get_card(36996508).id, 46986414)
+
+        self.assertEqual(card_lookup_counts, {'db': 1, 'cache': 1})
+
+    def test_stale_card_is_refreshed(self):
+        """Test that a card older than the TTL has its ban status refreshed from the API."""
+        with self.app.app_context():
+            card = db.session.get(Card, 55144522)
+            card.refreshed_at = datetime.utcnow() - timedelta(seconds=card_cache.ttl + 1)
+            db.session.commit()
+
+            # Pot of Greed comes off the banlist upstream
+            api_card = dict(self.cards[5], banlist_info=None)
+            with patch('helpers.fetch_card_by_id', return_value=api_card) as fetch:
+                card = get_card(55144522)
+
+            fetch.assert_called_once_with(55144522)
+            self.assertEqual(card.limit, 3)
+            self.assertEqual(card_lookup_counts['api'], 1)
+
+    def test_stale_cards_are_refreshed_in_batches(self):
+        """Test that batch resolution refreshes stale cards' ban status in the same single request."""
+        with self.app.app_context():
+            card = db.session.get(Card, 55144522)
+            card.refreshed_at = datetime.utcnow() - timedelta(seconds=card_cache.ttl + 1)
+            db.session.commit()
+
+            # Pot of Greed comes off the banlist upstream
+            api_card = dict(self.cards[5], banlist_info=None)
+            with patch('helpers.fetch_cards_by_ids', return_value=[api_card]) as fetch:
+                cards = resolve_cards([55144522, 89631139])
+
+            fetch.assert_called_once_with([55144522])
+            self.assertEqual(cards[55144522].limit, 3)
+
+    def test_unknown_card(self):
+        """Test that a card missing locally and upstream resolves to None."""
+        with self.app.app_context():
+            with patch('helpers.fetch_card_by_id', return_value=None):
+                self.assertIsNone(get_card(1))
+
+
+class TestBanlistRefresh(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up test database and create tables."""
+        cls.app = Flask(__name__)
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        cls.app.config['TESTING'] = True
+
+        db.init_app(cls.app)
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Sync the fixture dump and build one deck with 3 Blue-Eyes and one with 1."""
+        card_cache.clear()
+        with self.app.app_context():
+            db.create_all()
+            self.cards = load_card_dump(CARD_DUMP_PATH)
+            sync_card_catalog(self.cards, source=CARD_DUMP_PATH)
+
+            user = User(username="banlist", hash_password="unused", email="banlist@test.com")
+            db.session.add(user)
+            db.session.commit()
+
+            full = Deck(name="Three Blue-Eyes", user_id=user.id)
+            single = Deck(name="One Blue-Eyes", user_id=user.id)
+            db.session.add_all([full, single])
+            db.session.commit()
+            db.session.add_all([
+                DeckCard(deck_id=full.id, card_id=89631139, quantity=3),
+                DeckCard(deck_id=single.id, card_id=89631139, quantity=1)
+            ])
+            db.session.commit()
+            self.full_id, self.single_id = full.id, single.id
+
+    def tearDown(self):
+        """Clean up the session and drop all tables."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def banlist(self, changes=None):
+        """Return the fixture's banlist, as the API's banlist=tcg query would, with 'changes'
+        (card id -> ban_tcg status, or None to unlist) applied."""
+        changes = changes or {}
+        banlist = []
+        for card in self.cards:
+            status = changes.get(card['id'], (card.get('banlist_info') or {}).get('ban_tcg'))
+            if status:
+                banlist.append(dict(card, banlist_info={'ban_tcg': status}))
+        return banlist
+
+
+    # --- BANLIST TESTS ---
+    def test_refresh_updates_limits_and_flags_decks(self):
+        """Test that new limits are applied and only decks now over a limit are flagged."""
+        with self.app.app_context():
+            # Blue-Eyes is limited and Pot of Greed comes off the list
+            changed, over_limit = refresh_banlist(self.banlist({89631139: 'Limited', 55144522: None}))
+
+            self.assertEqual(changed, [55144522, 89631139])
+            self.assertEqual(over_limit, [self.full_id])
+            self.assertEqual(db.session.get(Card, 89631139).limit, 1)
+            self.assertEqual(db.session.get(Card, 55144522).limit, 3)
+            self.assertEqual(db.session.get(Card, 83764718).limit, 1)
+            self.assertTrue(db.session.get(Deck, self.full_id).over_limit)
+            self.assertFalse(db.session.get(Deck, self.single_id).over_limit)
+
+    def test_unchanged_banlist_touches_nothing(self):
+        """Test that refreshing with the current banlist changes no cards or decks."""
+        with self.app.app_context():
+            version = db.session.get(Deck, self.full_id).version
+            self.assertEqual(refresh_banlist(self.banlist()), ([], []))
+            self.assertEqual(db.session.get(Deck, self.full_id).version, version)
+
+    def test_ocg_only_cards_are_unlimited(self):
+        """Test that cards without a TCG status, or with one we don't know, don't abort the refresh."""
+        with self.app.app_context():
+            maxx = next(card for card in self.cards if card['id'] == 23434538)
+            banlist = self.banlist({89631139: 'Limited'}) + [maxx, dict(self.cards[0], id=46986414, banlist_info={'ban_tcg': 'Forbidden'})]
+            changed, _ = refresh_banlist(banlist)
+
+            self.assertEqual(changed, [89631139])
+            self.assertEqual(db.session.get(Card, 23434538).limit, 3)
+            self.assertEqual(db.session.get(Card, 46986414).limit, 3)
+
+    def test_lowering_clears_flag(self):
+        """Test that removing copies from an over-limit deck is allowed and clears its flag."""
+        with self.app.app_context():
+            refresh_banlist(self.banlist({89631139: 'Limited'}))
+
+            deck_card = db.session.get(DeckCard, (self.full_id, 89631139))
+            deck_card.quantity = 2
+            db.session.commit()
+            self.assertTrue(db.session.get(Deck, self.full_id).over_limit)
+
+            with self.assertRaises(ValueError):
+                deck_card.quantity = 3
+
+            deck_card.quantity = 1
+            db.session.commit()
+            self.assertFalse(db.session.get(Deck, self.full_id).over_limit)
+
+    def test_sync_flags_decks(self):
+        """Test that a catalog sync that changes limits flags decks too."""
+        with self.app.app_context():
+            cards = [dict(card, banlist_info={'ban_tcg': 'Semi-Limited'}) if card['id'] == 89631139 else card for card in self.cards]
+            sync_card_catalog(cards)
+            self.assertTrue(db.session.get(Deck, self.full_id).over_limit)
+            self.assertEqual(db.session.get(Card, 89631139).limit, 2)
+
+
+class TestConcurrentDeckEdits(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """Set up a test database that separate threads can share."""
+        # An in-memory SQLite database is private to one connection, so use a file instead
+        cls.db_file = None
+        uri = SQLALCHEMY_DATABASE_URI
+        if uri == 'sqlite://':
+            handle, cls.db_file = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            uri = f"sqlite:///{cls.db_file}"
+
+        cls.app = Flask(__name__)
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = uri
+        cls.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        cls.app.config['TESTING'] = True
+
+        db.init_app(cls.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        with cls.app.app_context():
+            db.engine.dispose()
+        if cls.db_file:
+            os.remove(cls.db_file)
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Sync the fixture dump and create an empty deck."""
+        with self.app.app_context():
+            db.create_all()
+            sync_card_catalog(load_card_dump(CARD_DUMP_PATH), source=CARD_DUMP_PATH)
+
+            user = User(username="concurrent", hash_password="unused", email="concurrent@test.com")
+            db.session.add(user)
+            db.session.commit()
+
+            deck = Deck(name="Hammered", user_id=user.id)
+            db.session.add(deck)
+            db.session.commit()
+            self.deck_id = deck.id
+
+    def tearDown(self):
+        """Clean up the session and drop all tables."""
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def hammer(self, operation, card_ids):
+        """Run 'operation'(deck id, card id) for every card id at once, one thread each, and
+        return the quantities the committed calls returned."""
+        barrier = threading.Barrier(len(card_ids))
+        results, errors = [], []
+
+        def worker(card_id):
+            with self.app.app_context():
+                try:
+                    barrier.wait()
+                    quantity = operation(self.deck_id, card_id)
+                    db.session.commit()
+                    results.append(quantity)
+                except Exception as error:
+                    errors.append(error)
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=worker, args=(card_id,)) for card_id in card_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        return results
+
+    def deck_state(self):
+        """Return the deck's counters and its cards' quantities, read fresh."""
+        with self.app.app_context():
+            deck = db.session.get(Deck, self.deck_id)
+            quantities = {deck_card.card_id: deck_card.quantity for deck_card in DeckCard.query.filter_by(deck_id=self.deck_id)}
+            return deck.main_deck_count, deck.extra_deck_count, deck.over_limit, quantities
+
+
+    # --- CONCURRENCY TESTS ---
+    def test_card_limit_holds(self):
+        """Test that many simultaneous adds of one card stop at its limit."""
+        results = self.hammer(add_deck_card_copy, [89631139] * 16)
+
+        self.assertEqual(sorted(q for q in results if q is not None), [1, 2, 3])
+        self.assertEqual(self.deck_state(), (3, 0, False, {89631139: 3}))
+
+    def test_deck_size_holds(self):
+        """Test that simultaneous adds of different cards stop at 60 main deck cards."""
+        with self.app.app_context():
+            db.session.execute(db.update(Deck).where(Deck.id == self.deck_id).values(main_deck_count=57))
+            db.session.commit()
+
+        main_cards = [89631139, 46986414, 38033121, 14558127, 44095762, 70095154]
+        results = self.hammer(add_deck_card_copy, main_cards * 2)
+
+        self.assertEqual(len([q for q in results if q is not None]), 3)
+        main_count, extra_count, _, quantities = self.deck_state()
+        self.assertEqual((main_count, extra_count), (60, 0))
+        self.assertEqual(sum(quantities.values()), 3)
+
+    def test_removes_stop_at_zero(self):
+        """Test that simultaneous removes take out each copy once and drop the card with the last."""
+        self.hammer(add_deck_card_copy, [89631139, 89631139, 46986414])
+        results = self.hammer(remove_deck_card_copy, [89631139] * 8)
+
+        self.assertEqual(sorted(q for q in results if q is not None), [0, 1])
+        self.assertEqual(self.deck_state(), (1, 0, False, {46986414: 1}))
+
+    def test_pairs_follow_adds_and_removes(self):
+        """Test that the card pairs kept by adds and removes match a rebuild."""
+        self.hammer(add_deck_card_copy, [89631139, 46986414, 23995346, 46986414])
+        self.hammer(remove_deck_card_copy, [46986414, 23995346])
+
+        with self.app.app_context():
+            kept = set(db.session.execute(db.select(CardPair.card_a, CardPair.card_b, CardPair.decks)))
+            rebuild_card_pairs()
+            db.session.commit()
+            self.assertEqual(kept, set(db.session.execute(db.select(CardPair.card_a, CardPair.card_b, CardPair.decks))))
+            self.assertEqual(kept, {(89631139, 46986414, 1), (46986414, 89631139, 1)})
+
+    def test_pairs_touched_in_key_order(self):
+        """Test that pair rows are written in (card_a, card_b) order, whatever order the set iterates in."""
+        pairs = deck_pairs({89631139, 46986414, 23995346, 14558127}, {23995346})
+        self.assertEqual(pairs, sorted(pairs))
+        self.assertEqual(len(pairs), 6)
+
+
+class TestSearchCache(unittest.TestCase):
+
+    def setUp(self):
+        """Create an app context and empty the search cache."""
+        self.app = Flask(__name__)
+        self.app.config['SEARCH_CACHE_NEGATIVE_TTL'] = 30
+        self.app.config['SEARCH_CACHE_STALE_TTL'] = 60
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        search_cache.clear()
+        self.now = 0.0
+        search_cache.timer = lambda: self.now
+
+    def tearDown(self):
+        """Restore the real clock and pop the app context."""
+        search_cache.timer = time.monotonic
+        search_cache.clear()
+        self.ctx.pop()
+
+    def test_key_normalization(self):
+        """Test that equivalent searches share a cache key."""
+        self.assertEqual(
+            search_cache_key({"fname": " Dark Magician", "race": "Spellcaster", "level": None, "num": 24, "offset": 0}),
+            search_cache_key({"offset": 0, "race": "spellcaster", "num": 24, "fname": "dark magician", "attribute": ""})
+        )
+        self.assertNotEqual(search_cache_key({"fname": "dark", "offset": 0}), search_cache_key({"fname": "dark", "offset": 24}))
+
+    def test_repeat_search_is_cached(self):
+        """Test that repeating a search doesn't call the API."""
+        result = {"data": [{"id": 1}], "meta": {"pages_remaining": 0}}
+        with patch('helpers.request_ygo_cards', return_value=result) as fetch:
+            self.assertEqual(cached_fetch_ygo_cards(fname="Dark", num=24, offset=0), result)
+            self.assertEqual(cached_fetch_ygo_cards(fname="dark", num=24, offset=0), result)
+        fetch.assert_called_once()
+        self.assertEqual(search_cache.stats()['hit_ratio'], 0.5)
+
+    def test_remote_cursors_carry_offsets(self):
+        """Test that API searches page by offset behind the same cursors."""
+        self.app.config['SEARCH_PREFETCH_PAGES'] = 0
+        page = {"data": [{"id": 1, "card_images": []}], "meta": {"pages_remaining": 1}}
+        with patch('helpers.request_ygo_cards', return_value=page) as fetch:
+            first = search_remote_cards(fname="dark")
+            self.assertIsNone(first['meta']['prev_cursor'])
+
+            second = search_remote_cards(fname="dark", cursor=first['meta']['next_cursor'])
+            self.assertEqual(fetch.call_args.kwargs['offset'], 24)
+
+            # Back on the first page, which the search cache already holds
+            back = search_remote_cards(fname="dark", cursor=second['meta']['prev_cursor'])
+            self.assertIsNone(back['meta']['prev_cursor'])
+            self.assertEqual(fetch.call_count, 2)
+
+            with self.assertRaises(ValueError):
+                search_remote_cards(fname="light", cursor=first['meta']['next_cursor'])
+
+    def test_no_match_is_cached_briefly(self):
+        """Test that "no cards match" is cached for the negative TTL only."""
+        with patch('helpers.request_ygo_cards', return_value=None) as fetch:
+            self.assertIsNone(cached_fetch_ygo_cards(fname="zzz"))
+            self.assertIsNone(cached_fetch_ygo_cards(fname="zzz"))
+            self.assertEqual(fetch.call_count, 1)
+
+            self.now = 31
+            cached_fetch_ygo_cards(fname="zzz")
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_stale_while_revalidate(self):
+        """Test that an expired result is served immediately and refreshed in the background."""
+        old = {"data": [{"id": 1}], "meta": {"pages_remaining": 0}}
+        new = {"data": [{"id": 2}], "meta": {"pages_remaining": 0}}
+
+        with patch('helpers.request_ygo_cards', side_effect=[old, new]) as fetch:
+            cached_fetch_ygo_cards(fname="dark")
+            self.now = search_cache.ttl + 1
+            self.assertEqual(cached_fetch_ygo_cards(fname="dark"), old)
+
+            # Wait for the background refresh
+            for _ in range(100):
+                if search_cache.lookup(search_cache_key({"fname": "dark"}))[0] == new:
+                    break
+                time.sleep(0.01)
+
+            self.assertEqual(fetch.call_count, 2)
+            self.assertEqual(cached_fetch_ygo_cards(fname="dark"), new)
+
+    def test_failure_is_not_cached(self):
+        """Test that an API failure isn't cached as "no cards match"."""
+        page = {"data": [{"id": 1}], "meta": {"pages_remaining": 0}}
+        with patch('helpers.request_ygo_cards', side_effect=[requests.ConnectionError(), page]) as fetch:
+            self.assertIsNone(cached_fetch_ygo_cards(fname="dark"))
+            self.assertEqual(cached_fetch_ygo_cards(fname="dark"), page)
+            self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_revalidation_keeps_stale_result(self):
+        """Test that a failed background refresh keeps serving the stale result."""
+        old = {"data": [{"id": 1}], "meta": {"pages_remaining": 0}}
+        responses = [old]
+
+        def respond(**filters):
+            # Every refresh after the first search times out
+            if responses:
+                return responses.pop()
+            raise requests.Timeout()
+
+        with patch('helpers.request_ygo_cards', side_effect=respond) as fetch:
+            cached_fetch_ygo_cards(fname="dark")
+            self.now = search_cache.ttl + 1
+            self.assertEqual(cached_fetch_ygo_cards(fname="dark"), old)
+            self.wait_for_revalidation()
+            self.assertEqual(fetch.call_count, 2)
+
+            # The stale result is still served, and refreshed again
+            self.assertEqual(cached_fetch_ygo_cards(fname="dark"), old)
+            self.wait_for_revalidation()
+            self.assertEqual(fetch.call_count, 3)
+
+    def wait_for_revalidation(self):
+        """Wait for background search refreshes to finish."""
+        for _ in range(100):
+            if not helpers._revalidating:
+                return
+            time.sleep(0.01)
+        self.fail("Background refresh did not finish.")
+
+if __name__ == '__main__':
+    unittest.main()
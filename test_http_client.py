@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+from flask import Flask
+from http_client import UpstreamClient
+from metrics import Metrics
+import helpers
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers like cardinfo.php and records which client connection served each request."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        server.requests += 1
+
+        # Fail the first 'failures' requests to exercise retries
+        if server.failures > 0:
+            server.failures -= 1
+            self.reply(503, {"error": "Service Unavailable"})
+            return
+
+        time.sleep(server.delay)
+        # Answer with one card per page out of 'server.pages' pages
+        query = parse_qs(urlparse(self.path).query)
+        offset, num = int(query.get('offset', ['0'])[0]), int(query.get('num', ['30'])[0])
+        server.offsets.append(offset)
+        pages_remaining = max(0, server.pages - 1 - offset // num)
+        self.reply(200, {"data": [{"id": 89631139 + offset, "name": "Blue-Eyes White Dragon"}], "meta": {"pages_remaining": pages_remaining}})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestUpstreamClient(unittest.TestCase):
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Start a stub upstream on a free local port."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.connections = set()
+        self.server.requests = 0
+        self.server.failures = 0
+        self.server.delay = 0
+        self.server.pages = 1
+        self.server.offsets = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/v7/cardinfo.php"
+        self.client = UpstreamClient(read_timeout=0.5, retries=2, backoff=0, backoff_jitter=0)
+
+    def tearDown(self):
+        """Stop the stub upstream."""
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    # --- CLIENT TESTS ---
+    def test_connection_reuse(self):
+        """Test that helpers reuse one keep-alive connection across calls."""
+        with patch('helpers.upstream', self.client), patch('helpers.YGO_API_URL', self.url):
+            for offset in (0, 30, 60):
+                self.assertIsNotNone(helpers.fetch_ygo_cards(fname="blue", offset=offset))
+            self.assertEqual(helpers.fetch_card_by_id(89631139)['name'], "Blue-Eyes White Dragon")
+
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_calls_recorded_in_metrics(self):
+        """Test that each call's duration is recorded by host and status, retries included."""
+        recorder = Metrics()
+        self.server.failures = 1
+        with patch('http_client.metrics', recorder):
+            recorder.start_request()
+            self.client.get(self.url)
+            counters = recorder.finish_request('search_cards', 'GET', 200)
+
+        self.assertEqual(counters['upstream_calls'], 1)
+        self.assertIn('upstream_request_duration_seconds_count{host="127.0.0.1",status="200"} 1', recorder.render())
+
+    def test_retries_on_server_error(self):
+        """Test that 5xx responses are retried with backoff."""
+        self.server.failures = 2
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_gives_up_after_retries(self):
+        """Test that retries are bounded and the last response is returned."""
+        self.server.failures = 5
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_read_timeout(self):
+        """Test that a hung upstream fails fast instead of pinning the worker."""
+        self.server.delay = 2
+        self.client.configure(retries=0)
+        with patch('helpers.upstream', self.client), patch('helpers.YGO_API_URL', self.url):
+            started = time.monotonic()
+            self.assertIsNone(helpers.fetch_card_by_id(89631139))
+            self.assertLess(time.monotonic() - started, 1.5)
+
+
+    # --- PREFETCH TESTS ---
+    def wait_for_page(self, offset):
+        """Wait for the background prefetch of the "blue" search page at 'offset'."""
+        key = helpers.search_cache_key({"fname": "blue", "num": 30, "offset": offset})
+        for _ in range(100):
+            if helpers.search_cache.lookup(key)[1]:
+                return
+            time.sleep(0.01)
+        self.fail(f"Page at offset {offset} was not prefetched.")
+
+    def test_prefetch_next_page(self):
+        """Test that a search with pages remaining fetches the next page in the background."""
+        self.server.pages = 3
+        app = Flask(__name__)
+        app.config.update(SEARCH_PREFETCH_PAGES=1, SEARCH_PREFETCH_WORKERS=2)
+        helpers.search_cache.clear()
+
+        with app.app_context(), patch('helpers.upstream', self.client), patch('helpers.YGO_API_URL', self.url):
+            helpers.cached_fetch_ygo_cards(fname="blue", num=30, offset=0)
+            self.wait_for_page(offset=30)
+
+            # The next click is served from the cache, and prefetches the last page
+            page = helpers.cached_fetch_ygo_cards(fname="blue", num=30, offset=30)
+            self.assertEqual(page['data'][0]['id'], 89631139 + 30)
+            self.wait_for_page(offset=60)
+
+            # The last page has nothing after it to prefetch
+            helpers.cached_fetch_ygo_cards(fname="blue", num=30, offset=60)
+            time.sleep(0.05)
+
+        helpers.search_cache.clear()
+        self.assertEqual(self.server.offsets, [0, 30, 60])
+
+
+if __name__ == '__main__':
+    unittest.main()
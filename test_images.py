@@ -0,0 +1,174 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from images import ImageStore, image_store, failed_images, fetch_card_image, open_card_image, localize_image_url
+
+# What the fixture upstream serves, by path
+FIXTURE_ART = {
+    '/images/cards/89631139.jpg': b'full art of Blue-Eyes White Dragon',
+    '/images/cards_small/89631139.jpg': b'small art of Blue-Eyes White Dragon'
+}
+
+class FixtureImageHandler(BaseHTTPRequestHandler):
+    """Answers like images.ygoprodeck.com from FIXTURE_ART, counting requests."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = FIXTURE_ART.get(self.path)
+        self.send_response(200 if body else 404)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        self.wfile.write(body or b'')
+
+    def log_message(self, format, *args):
+        pass
+
+class TestImageStore(unittest.TestCase):
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Create a store in a temporary directory."""
+        self.root = tempfile.mkdtemp()
+        self.store = ImageStore(root=self.root, max_bytes=100)
+
+    def tearDown(self):
+        """Delete the temporary directory."""
+        shutil.rmtree(self.root)
+
+
+    # --- STORE TESTS ---
+    def test_put_and_get(self):
+        """Test that stored images are found by key and named by their content."""
+        digest, path = self.store.put('1-full', b'image one')
+        self.assertEqual(self.store.get('1-full'), (digest, path))
+        self.assertTrue(path.endswith(digest))
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'image one')
+        self.assertIsNone(self.store.get('2-full'))
+
+    def test_identical_images_stored_once(self):
+        """Test that keys with the same bytes share one file."""
+        self.store.put('1-full', b'same bytes')
+        self.store.put('1-small', b'same bytes')
+        self.assertEqual(self.store.stats()['images'], 1)
+        self.assertEqual(self.store.stats()['bytes'], len(b'same bytes'))
+
+    def test_evicts_least_recently_used(self):
+        """Test that the store stays under its size bound by dropping the least recently used image."""
+        self.store.put('1-full', b'a' * 40)
+        self.store.put('2-full', b'b' * 40)
+        self.store.get('1-full')
+        self.store.put('3-full', b'c' * 40)
+
+        self.assertIsNone(self.store.get('2-full'))
+        self.assertIsNotNone(self.store.get('1-full'))
+        self.assertIsNotNone(self.store.get('3-full'))
+        self.assertEqual(self.store.stats()['bytes'], 80)
+
+    def test_reloads_from_disk(self):
+        """Test that a new store over the same directory finds the images and their use order."""
+        self.store.put('1-full', b'a' * 40)
+        time.sleep(0.01)
+        self.store.put('2-full', b'b' * 40)
+
+        reopened = ImageStore(root=self.root, max_bytes=100)
+        self.assertEqual(reopened.stats()['keys'], 2)
+        reopened.put('3-full', b'c' * 40)
+        self.assertIsNone(reopened.get('1-full'))
+        self.assertIsNotNone(reopened.get('2-full'))
+
+    def test_missing_image_drops_key(self):
+        """Test that a key whose image another process evicted is dropped instead of served."""
+        other = ImageStore(root=self.root, max_bytes=100)
+        digest, path = self.store.put('1-full', b'a' * 40)
+        other.get('1-full')
+
+        # Another process evicts the image out from under this one
+        self.store.clear()
+        self.assertIsNone(other.get('1-full'))
+        self.assertEqual(other.stats()['keys'], 0)
+
+    def test_localize_image_url(self):
+        """Test that YGOPRODeck art URLs map onto the local route and others are left alone."""
+        self.assertEqual(localize_image_url("https://images.ygoprodeck.com/images/cards_small/89631139.jpg"), "/images/cards/small/89631139.jpg")
+        self.assertEqual(localize_image_url("https://images.ygoprodeck.com/images/cards/89631139.jpg"), "/images/cards/full/89631139.jpg")
+        self.assertEqual(localize_image_url("/static/images/placeholder.png"), "/static/images/placeholder.png")
+
+class TestFetchCardImage(unittest.TestCase):
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Start the fixture upstream and point the shared store at a temporary directory."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureImageHandler)
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.root = tempfile.mkdtemp()
+        failed_images.clear()
+        self.old_root = image_store.root
+        image_store.configure(root=self.root)
+        self.upstream = patch('images.IMAGE_UPSTREAM_URL', f"http://127.0.0.1:{self.server.server_address[1]}/images")
+        self.upstream.start()
+
+    def tearDown(self):
+        """Stop the fixture upstream and restore the shared store."""
+        self.upstream.stop()
+        if self.old_root:
+            image_store.configure(root=self.old_root)
+        shutil.rmtree(self.root)
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    # --- FETCH TESTS ---
+    def test_fetches_once(self):
+        """Test that art is downloaded on the first request only."""
+        digest, path = fetch_card_image(89631139, 'full')
+        self.assertEqual(fetch_card_image(89631139, 'full'), (digest, path))
+        self.assertEqual(self.server.requests, ['/images/cards/89631139.jpg'])
+
+    @patch('images.thumbnails_available', return_value=False)
+    def test_small_art_without_pillow(self, thumbnails_available):
+        """Test that without Pillow the small size comes from the upstream small art."""
+        digest, path = fetch_card_image(89631139, 'small')
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), FIXTURE_ART['/images/cards_small/89631139.jpg'])
+        self.assertEqual(self.server.requests, ['/images/cards_small/89631139.jpg'])
+
+    @patch('images.thumbnails_available', return_value=True)
+    @patch('images.make_thumbnail', return_value=b'thumbnail')
+    def test_small_art_made_from_full_art(self, make_thumbnail, thumbnails_available):
+        """Test that thumbnails are made locally from the full art when possible."""
+        digest, path = fetch_card_image(89631139, 'small')
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), b'thumbnail')
+        self.assertEqual(self.server.requests, ['/images/cards/89631139.jpg'])
+
+    def test_missing_art(self):
+        """Test that art the upstream doesn't have is reported as missing, without asking again right away."""
+        self.assertIsNone(fetch_card_image(1, 'full'))
+        self.assertIsNone(fetch_card_image(1, 'full'))
+        self.assertEqual(self.server.requests, ['/images/cards/1.jpg'])
+
+    def test_refetches_evicted_art(self):
+        """Test that art deleted between lookup and open is fetched again."""
+        digest, path = fetch_card_image(89631139, 'full')
+        os.remove(path)
+
+        with patch('images.image_store.get', return_value=(digest, path)):
+            self.assertIsNone(open_card_image(89631139, 'full', fetch=False))
+
+        opened_digest, file = open_card_image(89631139, 'full')
+        with file:
+            self.assertEqual(file.read(), FIXTURE_ART['/images/cards/89631139.jpg'])
+        self.assertEqual(opened_digest, digest)
+        self.assertEqual(len(self.server.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
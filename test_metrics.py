@@ -0,0 +1,102 @@
+import tempfile
+import unittest
+from sqlalchemy import create_engine, text
+from metrics import Histogram, Metrics, statement_operation
+
+class TestHistogram(unittest.TestCase):
+
+    def test_render_cumulative_buckets(self):
+        """Test that buckets are rendered cumulatively with sum and count per label set."""
+        histogram = Histogram('latency_seconds', "Latency.", labels=('route',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'home')
+        histogram.observe(0.5, 'home')
+        histogram.observe(5, 'home')
+
+        lines = histogram.render()
+        self.assertEqual(lines[:2], ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"])
+        self.assertIn('latency_seconds_bucket{route="home",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{route="home",le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{route="home",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{route="home"} 5.55', lines)
+        self.assertIn('latency_seconds_count{route="home"} 3', lines)
+
+    def test_label_values_escaped(self):
+        """Test that quotes and backslashes in label values are escaped."""
+        histogram = Histogram('latency_seconds', "Latency.", labels=('route',), buckets=(1,))
+        histogram.observe(0.5, 'say "hi"\\')
+        self.assertIn('latency_seconds_count{route="say \\"hi\\"\\\\"} 1', histogram.render())
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.engine = create_engine('sqlite://')
+        self.metrics.instrument_engine(self.engine)
+
+    def test_queries_counted_per_request(self):
+        """Test that statements run during a request are counted towards it and timed by type."""
+        self.metrics.start_request()
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        counters = self.metrics.finish_request('home', 'GET', 200)
+
+        self.assertEqual(counters['queries'], 2)
+        output = self.metrics.render()
+        self.assertIn('http_request_sql_queries_count{endpoint="home"} 1', output)
+        self.assertIn('http_request_duration_seconds_count{endpoint="home",method="GET",status="200"} 1', output)
+        self.assertIn('sql_query_duration_seconds_count{operation="SELECT"} 2', output)
+
+    def test_queries_outside_requests(self):
+        """Test that statements outside a request are timed but not counted towards one."""
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        self.assertIsNone(self.metrics.finish_request('home', 'GET', 200))
+        self.assertIn('sql_query_duration_seconds_count{operation="SELECT"} 1', self.metrics.render())
+
+    def test_disabled(self):
+        """Test that nothing is recorded while metrics are disabled."""
+        self.metrics.configure(enabled=False)
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        self.metrics.record_upstream("https://db.ygoprodeck.com/api/v7/cardinfo.php", 200, 0.1)
+        self.assertNotIn('_count', self.metrics.render())
+
+    def test_upstream_calls(self):
+        """Test that outbound calls are recorded by host and status."""
+        self.metrics.start_request()
+        self.metrics.record_upstream("https://db.ygoprodeck.com/api/v7/cardinfo.php?id=1", 200, 0.2)
+        self.metrics.record_upstream("https://images.ygoprodeck.com/images/cards/1.jpg", 'error', 0.1)
+        counters = self.metrics.finish_request('search_cards', 'GET', 200)
+
+        self.assertEqual(counters['upstream_calls'], 2)
+        output = self.metrics.render()
+        self.assertIn('upstream_request_duration_seconds_count{host="db.ygoprodeck.com",status="200"} 1', output)
+        self.assertIn('upstream_request_duration_seconds_count{host="images.ygoprodeck.com",status="error"} 1', output)
+
+    def test_shared_directory_sums_processes(self):
+        """Test that with a shared directory any process reports every process's observations."""
+        with tempfile.TemporaryDirectory() as shared_dir:
+            # Each stands in for a worker process
+            workers = [Metrics(), Metrics()]
+            for worker in workers:
+                worker.configure(shared_dir=shared_dir)
+                worker.start_request()
+            workers[1].record_upstream("https://db.ygoprodeck.com/api/v7/cardinfo.php", 200, 0.2)
+            for worker in workers:
+                worker.finish_request('home', 'GET', 200)
+
+            for worker in workers:
+                output = worker.render()
+                self.assertIn('http_request_duration_seconds_count{endpoint="home",method="GET",status="200"} 2', output)
+                self.assertIn('upstream_request_duration_seconds_count{host="db.ygoprodeck.com",status="200"} 1', output)
+
+    def test_statement_operation(self):
+        """Test that statements are labeled by their leading keyword."""
+        self.assertEqual(statement_operation("  select * from cards"), "SELECT")
+        self.assertEqual(statement_operation("INSERT INTO cards VALUES (?)"), "INSERT")
+        self.assertEqual(statement_operation("(SELECT 1)"), "OTHER")
+
+
+if __name__ == '__main__':
+    unittest.main()
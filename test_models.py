@@ -218,6 +218,63 @@ class TestModels(unittest.TestCase):
                 db.session.commit()
 
 
+    # --- DECK COUNTER TESTS ---
+    def create_deck_with_cards(self):
+        """Create a user, a deck, a main deck card and an extra deck card. Return their ids."""
+        user = User.register(username="testuser", unhash_password="password", email="test@test.com")
+        db.session.add(user)
+        db.session.commit()
+
+        deck = Deck(name="Test Deck", user_id=user.id)
+        main_card = Card(name="Main Card", type="Effect Monster", img_url="test.com", extra_deck=False)
+        extra_card = Card(name="Extra Card", type="Fusion Monster", img_url="test.com", extra_deck=True)
+        db.session.add_all([deck, main_card, extra_card])
+        db.session.commit()
+
+        return deck.id, main_card.id, extra_card.id
+
+    def test_deck_counts_follow_deck_cards(self):
+        """Test that main_deck_count and extra_deck_count track inserts, updates and deletes."""
+        with self.app.app_context():
+            deck_id, main_id, extra_id = self.create_deck_with_cards()
+            deck = db.session.get(Deck, deck_id)
+            self.assertEqual((deck.main_deck_count, deck.extra_deck_count), (0, 0))
+
+            # Insert
+            db.session.add(DeckCard(deck_id=deck_id, card_id=main_id, quantity=2))
+            db.session.add(DeckCard(deck_id=deck_id, card_id=extra_id, quantity=1))
+            db.session.commit()
+            self.assertEqual((deck.main_deck_count, deck.extra_deck_count), (2, 1))
+
+            # Update, visible before the commit
+            deck_card = DeckCard.query.filter_by(deck_id=deck_id, card_id=main_id).first()
+            deck_card.quantity = 3
+            db.session.flush()
+            self.assertEqual(deck.main_deck_count, 3)
+            db.session.commit()
+
+            # Delete
+            db.session.delete(DeckCard.query.filter_by(deck_id=deck_id, card_id=extra_id).first())
+            db.session.commit()
+            self.assertEqual((deck.main_deck_count, deck.extra_deck_count), (3, 0))
+
+    def test_deck_recount_all(self):
+        """Test that recount_all repairs counters and flags that drifted from deck_cards."""
+        with self.app.app_context():
+            deck_id, main_id, extra_id = self.create_deck_with_cards()
+            db.session.add(DeckCard(deck_id=deck_id, card_id=main_id, quantity=3))
+            db.session.add(DeckCard(deck_id=deck_id, card_id=extra_id, quantity=2))
+            db.session.commit()
+
+            # Break the counters behind the ORM's back
+            db.session.execute(db.update(Deck).values(main_deck_count=0, extra_deck_count=9, over_limit=True))
+            db.session.commit()
+
+            self.assertEqual(Deck.recount_all(), 1)
+            deck = db.session.get(Deck, deck_id)
+            self.assertEqual((deck.main_deck_count, deck.extra_deck_count, deck.over_limit), (3, 2, False))
+
+
     # --- DELETION TESTS ---
     def test_card_delete(self):
         """Test card deletion."""
@@ -0,0 +1,93 @@
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from passwords import PasswordHasher, PasswordHasherBusy, fcntl
+
+class TestPasswordHasher(unittest.TestCase):
+
+    # --- SETUP AND TEARDOWN METHODS ---
+    def setUp(self):
+        """Create a cheap hasher with one thread and one waiting slot."""
+        self.hasher = PasswordHasher(rounds=4, max_workers=1, max_pending=1)
+
+    def tearDown(self):
+        """Stop the hashing pool."""
+        self.hasher.shutdown()
+
+
+    # --- HASHING TESTS ---
+    def test_hash_and_check(self):
+        """Test that hashes verify against the right password only."""
+        hashed = self.hasher.hash("password")
+        self.assertTrue(hashed.startswith("$2b$04$"))
+        self.assertTrue(self.hasher.check(hashed, "password"))
+        self.assertFalse(self.hasher.check(hashed, "wrong password"))
+
+    def test_needs_rehash(self):
+        """Test that a change of cost factor marks older hashes for rehashing."""
+        hashed = self.hasher.hash("password")
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+
+        self.hasher.configure(rounds=5)
+        self.assertTrue(self.hasher.needs_rehash(hashed))
+        self.assertTrue(self.hasher.check(hashed, "password"))
+
+    def test_busy_when_saturated(self):
+        """Test that calls fail fast once the running and waiting slots are all taken."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash(password, salt):
+            started.set()
+            release.wait(5)
+            return b"$2b$04$hash"
+
+        with patch('passwords.bcrypt.hashpw', slow_hash):
+            threads = [threading.Thread(target=self.hasher.hash, args=("password",)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            started.wait(5)
+
+            with self.assertRaises(PasswordHasherBusy):
+                self.hasher.hash("password")
+
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        # Slots are given back once the hashes finish
+        self.assertTrue(self.hasher.check(self.hasher.hash("password"), "password"))
+
+    @unittest.skipIf(fcntl is None, "fcntl is not available")
+    def test_busy_across_processes(self):
+        """Test that hashers sharing a lock directory, like gunicorn sync workers, share one bound."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_hash(password, salt):
+            started.set()
+            release.wait(5)
+            return b"$2b$04$hash"
+
+        with tempfile.TemporaryDirectory() as lock_dir:
+            # Each stands in for a single-threaded worker process
+            workers = [PasswordHasher(rounds=4, max_workers=1, max_pending=0, lock_dir=lock_dir) for _ in range(2)]
+            with patch('passwords.bcrypt.hashpw', slow_hash):
+                thread = threading.Thread(target=workers[0].hash, args=("password",))
+                thread.start()
+                started.wait(5)
+
+                with self.assertRaises(PasswordHasherBusy):
+                    workers[1].hash("password")
+
+                release.set()
+                thread.join()
+
+            self.assertTrue(workers[1].check(workers[1].hash("password"), "password"))
+            for worker in workers:
+                worker.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()